@@ -18,6 +18,7 @@ A simplified version of banking system
 
 class Account:
 
+    __slots__ = ("account_id", "balance", "outgoing")
 
     def __init__(self, account_id) -> None:
         self.account_id = account_id
@@ -40,6 +41,10 @@ class Account:
             return True
         return False
 
+    def merge(self, other):
+        self.balance += other.get_balance()
+        self.outgoing += other.get_outgoing()
+
     def has_sufficient_balance(self, amount):
         if self.balance < amount:
             return False
@@ -0,0 +1,198 @@
+'''
+Transaction history of the accounts.
+
+the history of an account is append-only: every change appends the timestamp,
+the balance after the change and the cumulative outgoing total to three int64
+arrays. the balance at time T and the outgoing total between T1 and T2 are then
+found by a binary search over the timestamps.
+
+histories are created by a HistoryStore. with a memory budget, the store moves
+the resident entries of the least recently used histories to a spill file once
+the budget is exceeded. a spilled history keeps the first timestamp, offset and
+length of each spilled segment and reads a single segment back to answer a
+query about its older entries.
+
+when another account is merged into this one, its history is linked rather
+than copied: it stays a separate AccountHistory kept in merged_from.
+'''
+
+import os
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+ENTRY_BYTES = 3 * 8
+# entries per spilled segment, the most a query reads back from disk
+SEGMENT_ENTRIES = 4096
+
+
+class HistoryStore:
+
+
+    def __init__(self, directory = None, memory_budget = None):
+        # memory_budget is the number of bytes of resident history entries,
+        # None keeps every history in memory
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.resident_bytes = 0
+        self.recent = OrderedDict()
+        self.spill_path = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["file"] = None
+        state["lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def new_history(self, created_at):
+        return AccountHistory(created_at, self)
+
+    def touch(self, history, new_entries):
+        '''
+        account for the entries just appended to history and spill the least
+        recently used histories while the budget is exceeded.
+        '''
+        if self.memory_budget is None:
+            return
+        with self.lock:
+            self.resident_bytes += new_entries * ENTRY_BYTES
+            self.recent[history] = None
+            self.recent.move_to_end(history)
+            while self.resident_bytes > self.memory_budget and len(self.recent) > 1:
+                cold, _ = self.recent.popitem(last = False)
+                self.resident_bytes -= cold.spill()
+
+    def write_segment(self, timestamps, balances, outgoings):
+        if self.file is None:
+            if self.spill_path is None:
+                fd, self.spill_path = tempfile.mkstemp(prefix = "history-", suffix = ".spill", dir = self.directory)
+                os.close(fd)
+            self.file = open(self.spill_path, "a+b")
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        timestamps.tofile(self.file)
+        balances.tofile(self.file)
+        outgoings.tofile(self.file)
+        self.file.flush()
+        return offset
+
+    def read_segment(self, offset, count):
+        if self.file is None:
+            self.file = open(self.spill_path, "a+b")
+        columns = []
+        with self.lock:
+            self.file.seek(offset)
+            for _ in range(3):
+                column = array('q')
+                column.fromfile(self.file, count)
+                columns.append(column)
+        return columns
+
+
+class AccountHistory:
+
+
+    def __init__(self, created_at, store = None) -> None:
+        self.created_at = created_at
+        self.timestamps = array('q')
+        self.balances = array('q')
+        self.outgoings = array('q')
+        # spilled segments, oldest first
+        self.segment_starts = array('q')
+        self.segments = []
+        # outgoing totals brought in by merged accounts, which are not
+        # transactions of this account
+        self.merged_outgoing = 0
+        self.merged_from = []
+        self.store = store
+
+    def __len__(self):
+        return len(self.timestamps) + sum(count for _, count in self.segments)
+
+    def record(self, timestamp, balance, outgoing):
+        '''
+        record the balance and total outgoing of the account after a change at
+        timestamp. several changes at one timestamp keep only the last values.
+        '''
+        outgoing -= self.merged_outgoing
+        if self.timestamps and self.timestamps[-1] == timestamp:
+            self.balances[-1] = balance
+            self.outgoings[-1] = outgoing
+            return
+        self.timestamps.append(timestamp)
+        self.balances.append(balance)
+        self.outgoings.append(outgoing)
+        if self.store is not None:
+            self.store.touch(self, 1)
+
+    def spill(self):
+        '''
+        move the resident entries to the spill file and return the bytes freed.
+        '''
+        count = len(self.timestamps)
+        for start in range(0, count, SEGMENT_ENTRIES):
+            end = start + SEGMENT_ENTRIES
+            offset = self.store.write_segment(self.timestamps[start:end], self.balances[start:end], self.outgoings[start:end])
+            self.segment_starts.append(self.timestamps[start])
+            self.segments.append((offset, len(self.timestamps[start:end])))
+        self.timestamps = array('q')
+        self.balances = array('q')
+        self.outgoings = array('q')
+        return count * ENTRY_BYTES
+
+    def entry_at(self, timestamp, inclusive = True):
+        '''
+        return (balance, own outgoing total) after the last change at or before
+        timestamp, or strictly before it if inclusive is false. return None if
+        there was no change yet.
+        '''
+        search = bisect_right if inclusive else bisect_left
+        i = search(self.timestamps, timestamp)
+        if i > 0:
+            return self.balances[i - 1], self.outgoings[i - 1]
+
+        j = search(self.segment_starts, timestamp) - 1
+        if j < 0:
+            return None
+        timestamps, balances, outgoings = self.store.read_segment(*self.segments[j])
+        i = search(timestamps, timestamp) - 1
+        return balances[i], outgoings[i]
+
+    def balance_at(self, timestamp):
+        '''
+        return the balance of the account at timestamp, or None if the account
+        did not exist yet.
+        '''
+        if timestamp < self.created_at:
+            return None
+        entry = self.entry_at(timestamp)
+        if entry is None:
+            return 0
+        return entry[0]
+
+    def outgoing_between(self, time_from, time_to):
+        '''
+        return the total of the outgoing transactions performed from time_from to
+        time_to inclusive, including those of the accounts merged into this one.
+        '''
+        if time_to < time_from:
+            return 0
+        end = self.entry_at(time_to)
+        start = self.entry_at(time_from, inclusive = False)
+        total = (end[1] if end else 0) - (start[1] if start else 0)
+        for _, merged in self.merged_from:
+            total += merged.outgoing_between(time_from, time_to)
+        return total
+
+    def link_merged(self, timestamp, other, other_outgoing):
+        self.merged_from.append((timestamp, other))
+        self.merged_outgoing += other_outgoing
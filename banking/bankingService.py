@@ -0,0 +1,229 @@
+'''
+Asyncio front-end for the banking system.
+
+operations arrive as JSON lines, [name, timestamp, *args] with the arguments of
+the BankingSystem method of that name, either on stdin or from clients of a
+local unix socket. every request gets one JSON line back, in request order per
+client, holding the result or {"error": message}. requests whose arguments do
+not have the types of OPERATIONS are rejected when they are read, and an
+operation that raises while it is applied fails on its own, the operations
+around it are still applied.
+
+requests from all clients go through one bounded queue. once it holds
+max_pending requests, readers stop reading until the batcher catches up. the
+batcher takes up to batch_size queued requests, waiting at most linger_ms for
+more after the first one, and applies them with execute_batch, so scheduled
+payments are processed once per timestamp of the batch rather than once per
+request. timestamps are expected to be non-decreasing across clients.
+
+top_spenders is served from a cached ranking snapshot, which is kept until the
+spender ranking of the system changes.
+
+    python bankingService.py [--socket PATH] [--batch-size N] [--linger-ms MS] [--max-pending N]
+'''
+
+import argparse
+import asyncio
+import json
+import sys
+
+import bankingSystem
+
+
+# argument types of each operation, timestamp included
+OPERATIONS = {
+    "create_account": (int, str), "deposit": (int, str, int), "transfer": (int, str, str, int),
+    "top_spenders": (int, int), "schedule_payment": (int, str, int, int), "cancel_payment": (int, str, str),
+    "merge_accounts": (int, str, str), "get_balance": (int, str, int), "get_outgoing": (int, str, int, int),
+}
+
+
+def parse_op(line):
+    '''
+    return the operation tuple of a request line, or raise a ValueError naming
+    what is wrong with it.
+    '''
+    op = json.loads(line)
+    if not isinstance(op, list) or not op or op[0] not in OPERATIONS:
+        raise ValueError(f"unknown operation {op[0] if isinstance(op, list) and op else op}")
+    name, args, types = op[0], op[1:], OPERATIONS[op[0]]
+    if len(args) != len(types):
+        raise ValueError(f"{name} takes {len(types)} arguments")
+    for i, (arg, arg_type) in enumerate(zip(args, types)):
+        # json true and false would pass as int
+        if not isinstance(arg, arg_type) or isinstance(arg, bool):
+            raise ValueError(f"argument {i + 1} of {name} must be of type {arg_type.__name__}, got {arg!r}")
+    return tuple(op)
+
+
+class BankingService:
+
+
+    def __init__(self, system = None, batch_size = 256, linger_ms = 1.0, max_pending = 4096):
+        self.system = bankingSystem.BankingSystem() if system is None else system
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+        self.queue = asyncio.Queue(max_pending)
+        # (ranking version, top spenders list) of the last ranking read
+        self.top_cache = None
+        self.batches = 0
+
+    async def submit(self, op):
+        '''
+        queue op and return a future of its result. waits while the queue is full.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((op, future))
+        return future
+
+    async def run_batcher(self):
+        while True:
+            batch = [await self.queue.get()]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                # let the readers queue what they have, then linger once for the rest.
+                # wait_for on queue.get could drop a request taken as it times out
+                await asyncio.sleep(0)
+                if self.queue.empty():
+                    if loop.time() >= deadline:
+                        break
+                    await asyncio.sleep(deadline - loop.time())
+                    if self.queue.empty():
+                        break
+            self.apply(batch)
+
+    def apply(self, batch):
+        '''
+        apply a batch of (op, future) pairs in order and resolve the futures.
+        '''
+        self.batches += 1
+        results = []
+        run = []
+        for op, _ in batch:
+            if op[0] == "top_spenders":
+                results.extend(self.execute(run))
+                run = []
+                try:
+                    results.append(self.top_spenders(op[1], op[2]))
+                except Exception as e:
+                    results.append({"error": str(e)})
+            else:
+                run.append(op)
+        results.extend(self.execute(run))
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def execute(self, run):
+        '''
+        apply a run of operations with execute_batch and return their results. an
+        operation that raises gets an {"error": message} result and the run goes on
+        after it.
+        '''
+        results = []
+        while len(results) < len(run):
+            try:
+                for result in self.system.execute_batch(run[len(results):], lazy = True):
+                    results.append(result)
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
+    def top_spenders(self, timestamp, n):
+        ranking = getattr(self.system, "spender_ranking", None)
+        if ranking is None:
+            return self.system.top_spenders(timestamp, n)
+        # payments due by the timestamp can change the ranking
+        self.system.process_payments(timestamp)
+        cached = self.top_cache
+        if cached is None or cached[0] != ranking.version or len(cached[1]) < min(n, len(ranking)):
+            cached = self.top_cache = (ranking.version, self.system._top_spenders(n))
+        return self.system.format_top_spenders(cached[1][:n])
+
+    async def serve_stream(self, reader, write):
+        '''
+        read requests from reader until it is closed and pass each response line
+        to write, in request order.
+        '''
+        responses = asyncio.Queue()
+
+        async def respond():
+            while True:
+                future = await responses.get()
+                if future is None:
+                    return
+                try:
+                    write(json.dumps(await future) + "\n")
+                except Exception as e:
+                    write(json.dumps({"error": str(e)}) + "\n")
+
+        responder = asyncio.create_task(respond())
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                op = parse_op(line)
+            except (TypeError, ValueError) as e:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result({"error": str(e)})
+                await responses.put(future)
+                continue
+            await responses.put(await self.submit(op))
+        await responses.put(None)
+        await responder
+
+    async def serve_unix(self, path):
+        async def handle(reader, writer):
+            await self.serve_stream(reader, lambda line: writer.write(line.encode()))
+            await writer.drain()
+            writer.close()
+
+        batcher = asyncio.create_task(self.run_batcher())
+        server = await asyncio.start_unix_server(handle, path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def serve_stdin(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        batcher = asyncio.create_task(self.run_batcher())
+
+        def write(line):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+        await self.serve_stream(reader, write)
+        batcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "serve a BankingSystem over stdin or a unix socket")
+    parser.add_argument("--socket", help = "path of the unix socket to listen on, stdin is used if omitted")
+    parser.add_argument("--batch-size", type = int, default = 256)
+    parser.add_argument("--linger-ms", type = float, default = 1.0)
+    parser.add_argument("--max-pending", type = int, default = 4096)
+    args = parser.parse_args()
+
+    async def serve():
+        service = BankingService(batch_size = args.batch_size, linger_ms = args.linger_ms, max_pending = args.max_pending)
+        if args.socket:
+            await service.serve_unix(args.socket)
+        else:
+            await service.serve_stdin()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
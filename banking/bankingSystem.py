@@ -16,18 +16,47 @@ A simplified version of banking system
 '''
 
 import account
-import heapq
+import accountHistory
+import paymentScheduler
+import spenderRanking
 from collections import defaultdict
 
 class BankingSystem:
 
 
-    def __init__(self):
-        self.account_dict = {}
+    def __init__(self, account_dict = None, scheduler = None, history_store = None):
+        # account_dict may be any mapping of account id to account, e.g. a
+        # columnarStore.ColumnarAccounts to keep balances in int64 columns
+        self.account_dict = {} if account_dict is None else account_dict
         self.account_no = 0
         self.scheduled_payments = dict()
         self.scheduled_ordinal_no = 1
-        self.scheduled_payments_queue = []
+        # pending payments, see paymentScheduler
+        self.scheduled_payments_queue = paymentScheduler.TimingWheelScheduler() if scheduler is None else scheduler
+        self.spender_ranking = spenderRanking.SpenderRanking()
+        # pending payments of each account, keyed by payment id
+        self.account_payments = {}
+        # transaction histories of existing accounts, and of accounts merged away
+        # as a list of (merge timestamp, history) per account id
+        self.history_store = accountHistory.HistoryStore() if history_store is None else history_store
+        self.account_history = {}
+        self.closed_history = defaultdict(list)
+
+    # attributes holding the ledger state, see snapshot_state
+    STATE_FIELDS = ("account_dict", "account_no", "scheduled_payments", "scheduled_ordinal_no",
+                    "scheduled_payments_queue", "spender_ranking", "account_payments",
+                    "history_store", "account_history", "closed_history")
+
+    def snapshot_state(self):
+        '''
+        return the ledger state as a dict of attribute name to value. handing it
+        to restore_state on a new system rebuilds this one.
+        '''
+        return {field: getattr(self, field) for field in self.STATE_FIELDS}
+
+    def restore_state(self, state):
+        for field in self.STATE_FIELDS:
+            setattr(self, field, state[field])
     
 
     def create_account(self, timestamp, account_id):
@@ -37,10 +66,15 @@ class BankingSystem:
         accountid already exists.
         '''
         self.process_payments(timestamp)
+        return self._create_account(timestamp, account_id)
+
+    def _create_account(self, timestamp, account_id):
         if account_id in self.account_dict:
             return False
         new_account = account.Account(account_id)
         self.account_dict[account_id] = new_account
+        self.spender_ranking.add(account_id, new_account.get_outgoing())
+        self.account_history[account_id] = self.history_store.new_history(timestamp)
         return True
     
 
@@ -52,11 +86,18 @@ class BankingSystem:
         if the specified account does not exist, should return an empty string.
         '''
         self.process_payments(timestamp)
-        if account_id not in self.account_dict:
+        balance = self._deposit(timestamp, account_id, amount)
+        if balance is None:
             return ""
+        return str(balance)
+
+    def _deposit(self, timestamp, account_id, amount):
+        if account_id not in self.account_dict:
+            return None
         deposit_account = self.account_dict[account_id]
         deposit_account.deposit(amount)
-        return str(deposit_account.get_balance())
+        self.record_balance(timestamp, deposit_account)
+        return deposit_account.get_balance()
 
 
     def transfer(self, timestamp, source_account_id, target_account_id, amount):
@@ -69,25 +110,32 @@ class BankingSystem:
             - cond3: return an empty string if source account has insufficient funds to perform the transfer.
         '''
         self.process_payments(timestamp)
+        balance = self._transfer(timestamp, source_account_id, target_account_id, amount)
+        if balance is None:
+            return ""
+        return str(balance)
+
+    def _transfer(self, timestamp, source_account_id, target_account_id, amount):
         # cond1
         if source_account_id not in self.account_dict or target_account_id not in self.account_dict:
-            return ""
+            return None
         
         # cond2
         if source_account_id == target_account_id:
-            return  ""
+            return None
         
         source_account = self.account_dict[source_account_id]
         target_account = self.account_dict[target_account_id]
 
         # cond3
         if source_account.get_balance() < amount:
-            return ""
+            return None
         
-        source_account.transferOut(amount)
+        self.transfer_out(timestamp, source_account, amount)
         target_account.deposit(amount)
+        self.record_balance(timestamp, target_account)
 
-        return str(source_account.get_balance())
+        return source_account.get_balance()
 
 
     def top_spenders(self, timestamp, n):
@@ -101,17 +149,13 @@ class BankingSystem:
         - if less than n accounts exist in the system, then return all their identifiers. 
         '''
         self.process_payments(timestamp)
-        outgoing_order = []
-        for account_id, account in self.account_dict.items():
-            out_balance = account.get_outgoing()
-            heapq.heappush(outgoing_order, (-out_balance, account_id, account))
-        
-        top_n = []
-        while n > 0:
-            out_balance, account_id, account = heapq.heappop(outgoing_order)
-            top_n.append([-out_balance, account_id])
-            n -= 1
-        
+        return self.format_top_spenders(self._top_spenders(n))
+
+    def _top_spenders(self, n):
+        return self.spender_ranking.top(n)
+
+    @staticmethod
+    def format_top_spenders(top_n):
         out_str = ""
         for i in top_n:
             out_str = out_str + str(i[1]) + "(" + str(i[0]) + ") ,"
@@ -138,7 +182,9 @@ class BankingSystem:
             3. if an account needs to perform several scheduled payments simultaneously,
             they should be processed in order of creation.
         '''
+        return self._schedule_payment(timestamp, account_id, amount, delay)
 
+    def _schedule_payment(self, timestamp, account_id, amount, delay):
         if account_id not in self.account_dict:
             return ""
         
@@ -147,21 +193,42 @@ class BankingSystem:
 
         scheduled_payment = ScheduledPayment(unique_identifier, account_id, self.scheduled_ordinal_no, payment_time, amount)
         
-        self.scheduled_payments[self.scheduled_ordinal_no] = scheduled_payment
-        heapq.heappush(self.scheduled_payments_queue, (scheduled_payment.payment_time, scheduled_payment.ordinal_no, scheduled_payment))
+        # the payment is only registered once the scheduler has taken it
+        self.scheduled_payments_queue.add(scheduled_payment)
+        self.scheduled_payments[unique_identifier] = scheduled_payment
+        self.account_payments.setdefault(account_id, {})[unique_identifier] = scheduled_payment
 
         self.scheduled_ordinal_no += 1
         return unique_identifier
     
     def process_payments(self, timestamp):
 
-        while self.scheduled_payments_queue[0][0] <= timestamp:
-            payment = heapq.heappop(self.scheduled_payments_queue)[2]
-            if payment.ordinal_no not in self.scheduled_payments or payment.status == 0:
-                continue
-            account = payment.account_id
-            account.transferOut(payment.amount)
-            del self.scheduled_payments[payment.ordinal_no]
+        for payment in self.scheduled_payments_queue.pop_due(timestamp):
+            account = self.account_dict[payment.account_id]
+            self.transfer_out(payment.payment_time, account, payment.amount)
+            self.forget_payment(payment)
+
+    def forget_payment(self, payment):
+        del self.scheduled_payments[payment.payment_id]
+        pending = self.account_payments[payment.account_id]
+        del pending[payment.payment_id]
+        if not pending:
+            del self.account_payments[payment.account_id]
+
+    def transfer_out(self, timestamp, account, amount):
+        '''
+        withdraw the given amount from the account as an outgoing transaction and
+        move the account to its new position in the top spenders ranking.
+        return false if the account has insufficient funds.
+        '''
+        if not account.transferOut(amount):
+            return False
+        self.spender_ranking.update(account.account_id, account.get_outgoing())
+        self.record_balance(timestamp, account)
+        return True
+
+    def record_balance(self, timestamp, account):
+        self.account_history[account.account_id].record(timestamp, account.get_balance(), account.get_outgoing())
     
     def cancel_payment(self, timestamp, account_id, payment_id):
         '''
@@ -173,6 +240,9 @@ class BankingSystem:
         payment opertations at the given timestamp
         '''
         self.process_payments(timestamp)
+        return self._cancel_payment(account_id, payment_id)
+
+    def _cancel_payment(self, account_id, payment_id):
         if account_id not in self.account_dict or payment_id not in self.scheduled_payments:
             return False
         
@@ -181,9 +251,169 @@ class BankingSystem:
             return False
         
         payment.status = 0
-        del self.scheduled_payments[payment_id]
+        self.scheduled_payments_queue.cancel(payment)
+        self.forget_payment(payment)
         return True
 
+    def merge_accounts(self, timestamp, account_id_1, account_id_2):
+        '''
+        should merge account_id_2 into account_id_1. return true if the accounts
+        were merged, or false if either account does not exist or both ids are the same.
+            - the balance and the total outgoing of account_id_2 are added to account_id_1.
+            - pending scheduled payments of account_id_2 are performed from account_id_1.
+            - account_id_2 is removed, its balance history stays available to get_balance
+            for the time before the merge.
+        '''
+        self.process_payments(timestamp)
+        return self._merge_accounts(timestamp, account_id_1, account_id_2)
+
+    def _merge_accounts(self, timestamp, account_id_1, account_id_2):
+        if account_id_1 == account_id_2:
+            return False
+        if account_id_1 not in self.account_dict or account_id_2 not in self.account_dict:
+            return False
+
+        merged_account = self.account_dict[account_id_1]
+        removed_account = self.account_dict[account_id_2]
+        removed_outgoing = removed_account.get_outgoing()
+        merged_account.merge(removed_account)
+        del self.account_dict[account_id_2]
+
+        # only the pending payments of the removed account are touched
+        moved = self.account_payments.pop(account_id_2, None)
+        if moved:
+            for payment in moved.values():
+                payment.account_id = account_id_1
+            self.account_payments.setdefault(account_id_1, {}).update(moved)
+
+        self.spender_ranking.remove(account_id_2)
+        self.spender_ranking.update(account_id_1, merged_account.get_outgoing())
+
+        removed_history = self.account_history.pop(account_id_2)
+        self.closed_history[account_id_2].append((timestamp, removed_history))
+        merged_history = self.account_history[account_id_1]
+        merged_history.link_merged(timestamp, removed_history, removed_outgoing)
+        self.record_balance(timestamp, merged_account)
+        return True
+
+    def get_balance(self, timestamp, account_id, time_at):
+        '''
+        should return the total amount of money in the account account_id at time_at,
+        as a string. if the account did not exist at time_at, return an empty string.
+        an account merged into another one no longer exists from the time of the merge.
+        '''
+        self.process_payments(timestamp)
+        balance = self._get_balance(account_id, time_at)
+        if balance is None:
+            return ""
+        return str(balance)
+
+    def _get_balance(self, account_id, time_at):
+        history = self.account_history.get(account_id)
+        if history is not None and history.created_at <= time_at:
+            return history.balance_at(time_at)
+        # earlier accounts with the same id which were merged away
+        for closed_at, history in reversed(self.closed_history.get(account_id, ())):
+            if time_at < closed_at:
+                balance = history.balance_at(time_at)
+                if balance is not None:
+                    return balance
+        return None
+
+    def get_outgoing(self, timestamp, account_id, time_from, time_to):
+        '''
+        should return the total amount of outgoing transactions of account_id from
+        time_from to time_to inclusive, as a string. transactions of accounts merged
+        into account_id count as its own, and so do those of earlier accounts with
+        the same id. if no account account_id ever existed, return an empty string.
+        '''
+        self.process_payments(timestamp)
+        outgoing = self._get_outgoing(account_id, time_from, time_to)
+        if outgoing is None:
+            return ""
+        return str(outgoing)
+
+    def _get_outgoing(self, account_id, time_from, time_to):
+        histories = [history for _, history in self.closed_history.get(account_id, ())]
+        if account_id in self.account_history:
+            histories.append(self.account_history[account_id])
+        if not histories:
+            return None
+        return sum(history.outgoing_between(time_from, time_to) for history in histories)
+
+    def execute_batch(self, ops, results = True, lazy = False):
+        '''
+        apply a timestamp-ordered iterable of operations as if each of them had been
+        called one at a time. every operation is a tuple (name, timestamp, *args), where
+        name is one of create_account, deposit, transfer, top_spenders, schedule_payment,
+        cancel_payment, merge_accounts, get_balance or get_outgoing and args are the
+        remaining arguments of that method.
+
+        scheduled payments are processed once per distinct timestamp rather than once
+        per operation.
+        returns a list holding the result of each operation, or a generator yielding them
+        as the operations are applied if lazy is true.
+        if results is false, no result strings are built and None is returned once every
+        operation has been applied.
+        '''
+        batch = self._execute_batch(ops, results)
+        if not results:
+            for _ in batch:
+                pass
+            return None
+        if lazy:
+            return batch
+        return list(batch)
+
+    def _execute_batch(self, ops, results):
+        drained_at = None
+        for op in ops:
+            name, timestamp = op[0], op[1]
+
+            # scheduling never processes payments, everything else runs after the
+            # payments due at its timestamp
+            if name == "schedule_payment":
+                account_id, amount, delay = op[2:]
+                payment_id = self._schedule_payment(timestamp, account_id, amount, delay)
+                # a payment due right away must still run before the next operation
+                if payment_id and drained_at is not None and timestamp + delay <= drained_at:
+                    drained_at = None
+                yield payment_id
+                continue
+
+            if timestamp != drained_at:
+                self.process_payments(timestamp)
+                drained_at = timestamp
+
+            if name == "create_account":
+                yield self._create_account(timestamp, op[2])
+            elif name == "deposit":
+                balance = self._deposit(timestamp, op[2], op[3])
+                yield ("" if balance is None else str(balance)) if results else None
+            elif name == "transfer":
+                balance = self._transfer(timestamp, op[2], op[3], op[4])
+                yield ("" if balance is None else str(balance)) if results else None
+            elif name == "top_spenders":
+                yield self.format_top_spenders(self._top_spenders(op[2])) if results else None
+            elif name == "cancel_payment":
+                yield self._cancel_payment(op[2], op[3])
+            elif name == "merge_accounts":
+                yield self._merge_accounts(timestamp, op[2], op[3])
+            elif name == "get_balance":
+                if results:
+                    balance = self._get_balance(op[2], op[3])
+                    yield "" if balance is None else str(balance)
+                else:
+                    yield None
+            elif name == "get_outgoing":
+                if results:
+                    outgoing = self._get_outgoing(op[2], op[3], op[4])
+                    yield "" if outgoing is None else str(outgoing)
+                else:
+                    yield None
+            else:
+                raise ValueError(f"unknown operation {name}")
+
         
 class ScheduledPayment:
 
@@ -0,0 +1,469 @@
+'''
+Benchmarks for the banking system.
+
+run from this directory:
+
+    python benchmark.py memory [n_accounts ...]
+    python benchmark.py recovery [n_accounts n_ops]
+    python benchmark.py scheduler [n_pending]
+    python benchmark.py sharded [n_ops max_shards]
+    python benchmark.py contention [n_ops]
+    python benchmark.py history [history_length ...]
+    python benchmark.py service [n_requests n_clients]
+    python benchmark.py workload [n_accounts n_ops] [--json PATH]
+    python benchmark.py replay [n_accounts n_ops]
+'''
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import accountHistory
+import bankingService
+import bankingSystem
+import columnarStore
+import concurrentBankingSystem
+import durableBankingSystem
+import instrumentation
+import paymentScheduler
+import replay
+import shardedBankingSystem
+import workload
+
+
+ENGINES = {
+    "objects": lambda: bankingSystem.BankingSystem(),
+    "columnar": lambda: bankingSystem.BankingSystem(columnarStore.ColumnarAccounts(), history_store = columnarStore.ColumnarHistories()),
+}
+
+
+def benchmark_memory(n_accounts):
+    '''
+    create n_accounts funded accounts with every engine and report the memory
+    held by the system once they exist.
+    '''
+    ops = []
+    for i in range(n_accounts):
+        ops.append(("create_account", 1, f"account{i}"))
+        ops.append(("deposit", 1, f"account{i}", 100))
+
+    for name, engine in ENGINES.items():
+        tracemalloc.start()
+        start = time.perf_counter()
+        system = engine()
+        system.execute_batch(ops, results = False)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:10s} accounts={n_accounts:>10d} "
+              f"memory={current / 2**20:9.1f} MiB peak={peak / 2**20:9.1f} MiB "
+              f"bytes/account={current / n_accounts:7.1f} build={elapsed:7.2f}s")
+        del system
+
+
+def benchmark_recovery(n_accounts, n_ops, snapshot_every = 1_000_000):
+    '''
+    log n_accounts account creations followed by n_ops deposits and transfers,
+    then time reopening the ledger from its snapshot and log tail.
+    '''
+    directory = tempfile.mkdtemp(prefix = "banking-wal-")
+    rng = random.Random(0)
+    try:
+        system = durableBankingSystem.DurableBankingSystem(directory, fsync_every = 0, snapshot_every = snapshot_every)
+        start = time.perf_counter()
+        system.execute_batch((("create_account", 1, f"account{i}") for i in range(n_accounts)), results = False)
+
+        def ops():
+            for i in range(n_ops):
+                timestamp = 2 + i // 1000
+                source = f"account{rng.randrange(n_accounts)}"
+                if rng.random() < 0.5:
+                    yield ("deposit", timestamp, source, rng.randint(1, 100))
+                else:
+                    target = f"account{rng.randrange(n_accounts)}"
+                    yield ("transfer", timestamp, source, target, rng.randint(1, 100))
+
+        system.execute_batch(ops(), results = False)
+        system.close()
+        logged = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recovered = durableBankingSystem.DurableBankingSystem(directory, snapshot_every = snapshot_every)
+        recovery = time.perf_counter() - start
+        tail = recovered.wal.last_sequence_no - recovered.snapshot_sequence_no
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+        print(f"accounts={n_accounts} ops={n_ops} logging={logged:.2f}s "
+              f"recovery={recovery:.2f}s replayed_tail={tail} on_disk={size / 2**20:.1f} MiB")
+        recovered.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchmark_scheduler(n_pending, cancel_ratio = 0.5, horizon = 10_000_000):
+    '''
+    schedule n_pending payments spread over horizon timestamps, cancel
+    cancel_ratio of them and drain the rest, with the heap and the timing wheel.
+    '''
+    rng = random.Random(0)
+    times = [rng.randrange(horizon) for _ in range(n_pending)]
+    cancelled = rng.sample(range(n_pending), int(n_pending * cancel_ratio))
+
+    def fill(scheduler_class):
+        payments = [bankingSystem.ScheduledPayment(f"payment{i + 1}", "account", i + 1, t, 1) for i, t in enumerate(times)]
+        scheduler = scheduler_class()
+        start = time.perf_counter()
+        for payment in payments:
+            scheduler.add(payment)
+        added = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in cancelled:
+            scheduler.cancel(payments[i])
+        return scheduler, added, time.perf_counter() - start
+
+    for name, scheduler_class in [("heap", paymentScheduler.HeapScheduler), ("wheel", paymentScheduler.TimingWheelScheduler)]:
+        # memory is traced on a separate run, tracing slows allocation down
+        tracemalloc.start()
+        traced = fill(scheduler_class)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del traced
+
+        scheduler, added, cancelling = fill(scheduler_class)
+        start = time.perf_counter()
+        drained = 0
+        for timestamp in range(0, horizon + 1, horizon // 1000):
+            for _ in scheduler.pop_due(timestamp):
+                drained += 1
+        draining = time.perf_counter() - start
+        print(f"{name:6s} pending={n_pending} add={added:.2f}s cancel={cancelling:.2f}s "
+              f"drain={draining:.2f}s drained={drained} memory_after_cancel={memory / 2**20:.1f} MiB")
+
+def benchmark_sharded(n_ops, max_shards, n_accounts = 100_000):
+    '''
+    run the same deposit / transfer / top_spenders workload on a single
+    BankingSystem and on 1 to max_shards shards, and report throughput.
+    '''
+    rng = random.Random(0)
+    ops = [("create_account", 1, f"account{i}") for i in range(n_accounts)]
+    for i in range(n_ops):
+        timestamp = 2 + i // 1000
+        source = f"account{rng.randrange(n_accounts)}"
+        r = rng.random()
+        if r < 0.7:
+            ops.append(("deposit", timestamp, source, rng.randint(1, 100)))
+        elif r < 0.99:
+            ops.append(("transfer", timestamp, source, f"account{rng.randrange(n_accounts)}", rng.randint(1, 100)))
+        else:
+            ops.append(("top_spenders", timestamp, 10))
+
+    start = time.perf_counter()
+    expected = bankingSystem.BankingSystem().execute_batch(ops)
+    elapsed = time.perf_counter() - start
+    print(f"single     ops={len(ops)} {len(ops) / elapsed:10.0f} ops/s")
+
+    shards = 1
+    while shards <= max_shards:
+        system = shardedBankingSystem.ShardedBankingSystem(shards)
+        start = time.perf_counter()
+        results = system.execute_batch(ops)
+        elapsed = time.perf_counter() - start
+        system.close()
+        assert results == expected
+        print(f"shards={shards:<3d} ops={len(ops)} {len(ops) / elapsed:10.0f} ops/s")
+        shards *= 2
+
+
+class GlobalLockBankingSystem:
+    '''
+    a BankingSystem behind one lock, the way it is served without the
+    concurrent engine.
+    '''
+
+    def __init__(self):
+        self.system = bankingSystem.BankingSystem()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.system, name)
+
+        def locked(*args):
+            with self.lock:
+                return method(*args)
+        return locked
+
+
+def benchmark_contention(n_ops, n_accounts = 10_000):
+    '''
+    split n_ops deposits, transfers and scheduled payments over 8 to 64 threads,
+    behind a global lock and with striped account locks.
+    '''
+    engines = {
+        "global": GlobalLockBankingSystem,
+        "striped": concurrentBankingSystem.ConcurrentBankingSystem,
+    }
+    for n_threads in [8, 16, 32, 64]:
+        for name, engine in engines.items():
+            system = engine()
+            for i in range(n_accounts):
+                system.create_account(1, f"account{i}")
+                system.deposit(1, f"account{i}", 1000)
+            clock = iter(range(2, 2 + n_ops))
+
+            def worker(seed):
+                rng = random.Random(seed)
+                for _ in range(n_ops // n_threads):
+                    timestamp = next(clock)
+                    source = f"account{rng.randrange(n_accounts)}"
+                    r = rng.random()
+                    if r < 0.5:
+                        system.deposit(timestamp, source, rng.randint(1, 100))
+                    elif r < 0.95:
+                        system.transfer(timestamp, source, f"account{rng.randrange(n_accounts)}", rng.randint(1, 100))
+                    else:
+                        system.schedule_payment(timestamp, source, rng.randint(1, 100), rng.randint(0, 100))
+
+            threads = [threading.Thread(target = worker, args = (seed,)) for seed in range(n_threads)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            print(f"{name:8s} threads={n_threads:<3d} {n_ops / elapsed:10.0f} ops/s")
+
+
+def benchmark_history(length, n_queries = 10_000):
+    '''
+    time balance_at and outgoing_between on a history of the given length, held
+    in memory and spilled to disk.
+    '''
+    directory = tempfile.mkdtemp(prefix = "banking-history-")
+    try:
+        history = accountHistory.HistoryStore(directory).new_history(0)
+        balance = outgoing = 0
+        for timestamp in range(1, length + 1):
+            amount = (timestamp * 7919) % 100
+            if timestamp % 2:
+                balance += amount
+            else:
+                balance -= amount // 2
+                outgoing += amount // 2
+            history.record(timestamp, balance, outgoing)
+
+        rng = random.Random(0)
+        points = [rng.randint(0, length) for _ in range(n_queries)]
+        for placement in ["memory", "spilled"]:
+            if placement == "spilled":
+                history.spill()
+            start = time.perf_counter()
+            for t in points:
+                history.balance_at(t)
+            balance_latency = (time.perf_counter() - start) / n_queries
+            start = time.perf_counter()
+            for t in points:
+                history.outgoing_between(t // 2, t)
+            outgoing_latency = (time.perf_counter() - start) / n_queries
+            print(f"{placement:8s} length={length:<9d} balance_at={balance_latency * 1e6:7.2f}us "
+                  f"outgoing_between={outgoing_latency * 1e6:7.2f}us")
+    finally:
+        shutil.rmtree(directory)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def benchmark_service(n_requests, n_clients, n_accounts = 10_000, batch_size = 256, linger_ms = 1.0):
+    '''
+    run n_clients concurrent clients against a BankingService on a unix socket,
+    each sending its share of n_requests one at a time, and report the request
+    latency percentiles and the throughput.
+    '''
+    directory = tempfile.mkdtemp(prefix = "banking-service-")
+    path = os.path.join(directory, "service.sock")
+
+    async def client(seed, latencies):
+        rng = random.Random(seed)
+        reader, writer = await asyncio.open_unix_connection(path)
+        for i in range(n_requests // n_clients):
+            source = f"account{rng.randrange(n_accounts)}"
+            r = rng.random()
+            if r < 0.5:
+                op = ["deposit", 2 + i, source, rng.randint(1, 100)]
+            elif r < 0.9:
+                op = ["transfer", 2 + i, source, f"account{rng.randrange(n_accounts)}", rng.randint(1, 100)]
+            else:
+                op = ["top_spenders", 2 + i, 10]
+            start = time.perf_counter()
+            writer.write((json.dumps(op) + "\n").encode())
+            await reader.readline()
+            latencies.append(time.perf_counter() - start)
+        # wait for the server to close its side once it has seen the end of the requests
+        writer.write_eof()
+        await reader.read()
+        writer.close()
+
+    async def run():
+        service = bankingService.BankingService(batch_size = batch_size, linger_ms = linger_ms)
+        service.system.execute_batch((("create_account", 1, f"account{i}") for i in range(n_accounts)), results = False)
+        server = asyncio.create_task(service.serve_unix(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(client(seed, latencies) for seed in range(n_clients)))
+        elapsed = time.perf_counter() - start
+        server.cancel()
+        print(f"clients={n_clients} requests={len(latencies)} batches={service.batches} "
+              f"throughput={len(latencies) / elapsed:.0f} req/s "
+              f"p50={percentile(latencies, 50) * 1e3:.2f}ms p99={percentile(latencies, 99) * 1e3:.2f}ms")
+
+    try:
+        asyncio.run(run())
+    finally:
+        shutil.rmtree(directory)
+
+
+def latency_summary(latencies_ns):
+    total = sum(latencies_ns)
+    return {
+        "count": len(latencies_ns),
+        "ops_per_sec": len(latencies_ns) / (total / 1e9) if total else None,
+        "p50_us": percentile(latencies_ns, 50) / 1e3,
+        "p90_us": percentile(latencies_ns, 90) / 1e3,
+        "p99_us": percentile(latencies_ns, 99) / 1e3,
+        "max_us": max(latencies_ns) / 1e3,
+    }
+
+
+def benchmark_workload(n_accounts, n_ops, json_path = None):
+    '''
+    run a workload.Workload through the public methods of every engine, timing
+    every call, then process the payments still pending at the end in one go.
+    report ops/s and latency percentiles per operation, the peak memory of a
+    separate traced run, and the per-method breakdown of a run with
+    instrumentation enabled. the results are saved to json_path if given.
+    '''
+    load = workload.Workload(n_accounts, n_ops)
+    setup = list(load.setup_ops())
+    ops = list(load.ops())
+    end = 2 + n_ops + load.max_delay
+    report = {"workload": load.config(), "engines": {}}
+
+    def run(system, latencies = None):
+        clock = time.perf_counter_ns
+        for op in setup + ops:
+            method = getattr(system, op[0])
+            if latencies is None:
+                method(*op[1:])
+                continue
+            start = clock()
+            method(*op[1:])
+            latencies[op[0]].append(clock() - start)
+        pending = len(system.scheduled_payments)
+        start = clock()
+        system.process_payments(end)
+        return pending, clock() - start
+
+    for name, engine in ENGINES.items():
+        latencies = {op_name: [] for op_name in ["create_account", *load.mix]}
+        system = engine()
+        start = time.perf_counter()
+        pending, drain_ns = run(system, latencies)
+        elapsed = time.perf_counter() - start
+        result = {"total_ops": len(setup) + len(ops), "elapsed_s": elapsed, "operations": {}}
+        for op_name, values in latencies.items():
+            if values:
+                result["operations"][op_name] = latency_summary(values)
+        result["operations"]["process_payments"] = {
+            "count": pending, "ops_per_sec": pending / (drain_ns / 1e9) if drain_ns else None,
+        }
+
+        system = engine()
+        tracemalloc.start()
+        run(system)
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        system = engine()
+        probe = instrumentation.Instrumentation(system)
+        probe.enable()
+        start = time.perf_counter()
+        run(system)
+        result["instrumented_elapsed_s"] = time.perf_counter() - start
+        result["instrumentation"] = probe.stats()
+        report["engines"][name] = result
+
+        print(f"{name}: {result['total_ops'] / elapsed:.0f} ops/s, peak memory "
+              f"{result['peak_memory_bytes'] / 2**20:.1f} MiB, instrumented "
+              f"{result['instrumented_elapsed_s'] / elapsed:.2f}x time")
+        for op_name, summary in result["operations"].items():
+            line = f"    {op_name:16s} count={summary['count']:<10d} {summary['ops_per_sec'] or 0:12.0f} ops/s"
+            if "p50_us" in summary:
+                line += f" p50={summary['p50_us']:.1f}us p99={summary['p99_us']:.1f}us max={summary['max_us']:.1f}us"
+            print(line)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent = 2)
+    return report
+
+
+def benchmark_replay(n_accounts, n_ops):
+    '''
+    replay the same workload through every engine of replay.py, checking each
+    result against the reference, and report the throughput of each engine.
+    '''
+    load = workload.Workload(n_accounts, n_ops)
+    entries = ((op, None) for ops in (load.setup_ops(), load.ops()) for op in ops)
+    checked = replay.Replay(replay.ENGINES)
+    checked.run(entries)
+    print(checked.report())
+
+
+if __name__ == "__main__":
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else "memory"
+    args = sys.argv[2:]
+    json_path = None
+    if "--json" in args:
+        i = args.index("--json")
+        json_path = args[i + 1]
+        del args[i:i + 2]
+    sizes = [int(n) for n in args]
+
+    if benchmark == "memory":
+        for n in sizes or [1_000_000, 10_000_000]:
+            benchmark_memory(n)
+    elif benchmark == "recovery":
+        n_accounts, n_ops = sizes or [10_000_000, 100_000_000]
+        benchmark_recovery(n_accounts, n_ops)
+    elif benchmark == "scheduler":
+        for n in sizes or [1_000_000]:
+            benchmark_scheduler(n)
+    elif benchmark == "sharded":
+        n_ops, max_shards = sizes or [1_000_000, os.cpu_count()]
+        benchmark_sharded(n_ops, max_shards)
+    elif benchmark == "contention":
+        for n in sizes or [1_000_000]:
+            benchmark_contention(n)
+    elif benchmark == "history":
+        for n in sizes or [1_000, 10_000, 100_000, 1_000_000]:
+            benchmark_history(n)
+    elif benchmark == "service":
+        n_requests, n_clients = sizes or [100_000, 64]
+        benchmark_service(n_requests, n_clients)
+    elif benchmark == "workload":
+        n_accounts, n_ops = sizes or [100_000, 1_000_000]
+        benchmark_workload(n_accounts, n_ops, json_path)
+    elif benchmark == "replay":
+        n_accounts, n_ops = sizes or [10_000, 1_000_000]
+        benchmark_replay(n_accounts, n_ops)
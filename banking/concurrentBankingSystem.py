@@ -0,0 +1,114 @@
+'''
+Banking system that can be called from many threads at once.
+
+accounts are guarded by a fixed number of striped locks. a transfer takes the
+stripes of both accounts in stripe order, so two transfers can never wait on
+each other in a cycle. the spender ranking and the scheduled payments have a
+lock of their own, which is always taken after any account stripe.
+
+scheduled payments are drained under drain_lock. an operation at a timestamp
+past the last drained one drains first, and operations arriving meanwhile wait
+for the drain, so scheduled payments still run before any other operation at
+their timestamp. callers are expected to use non-decreasing timestamps.
+
+merges also take drain_lock, before any stripe. a payment taken from the
+scheduler is therefore performed before its account can be merged away, and
+the pending payments a merge moves to the merged account are never in flight,
+as in the single-threaded engine.
+'''
+
+import threading
+
+import bankingSystem
+
+
+class ConcurrentBankingSystem(bankingSystem.BankingSystem):
+
+
+    def __init__(self, account_dict = None, scheduler = None, n_stripes = 64):
+        super().__init__(account_dict, scheduler)
+        self.stripes = [threading.Lock() for _ in range(n_stripes)]
+        self.create_lock = threading.Lock()
+        self.ranking_lock = threading.Lock()
+        self.schedule_lock = threading.Lock()
+        self.drain_lock = threading.Lock()
+        # every payment due at or before drained_through has been performed
+        self.drained_through = float("-inf")
+
+    def stripe_of(self, account_id):
+        return hash(account_id) % len(self.stripes)
+
+    def process_payments(self, timestamp):
+        if timestamp <= self.drained_through:
+            return
+        with self.drain_lock:
+            if timestamp <= self.drained_through:
+                return
+            with self.schedule_lock:
+                due = list(self.scheduled_payments_queue.pop_due(timestamp))
+                for payment in due:
+                    self.forget_payment(payment)
+            for payment in due:
+                # no merge runs during the drain, so the account of the payment still exists
+                with self.stripes[self.stripe_of(payment.account_id)]:
+                    account = self.account_dict[payment.account_id]
+                    self.transfer_out(payment.payment_time, account, payment.amount)
+            self.drained_through = timestamp
+
+    def transfer_out(self, timestamp, account, amount):
+        # the caller holds the stripe of the account
+        if not account.transferOut(amount):
+            return False
+        with self.ranking_lock:
+            self.spender_ranking.update(account.account_id, account.get_outgoing())
+        self.record_balance(timestamp, account)
+        return True
+
+    def _create_account(self, timestamp, account_id):
+        with self.create_lock, self.ranking_lock:
+            return super()._create_account(timestamp, account_id)
+
+    def _deposit(self, timestamp, account_id, amount):
+        with self.stripes[self.stripe_of(account_id)]:
+            return super()._deposit(timestamp, account_id, amount)
+
+    def _transfer(self, timestamp, source_account_id, target_account_id, amount):
+        first, second = sorted((self.stripe_of(source_account_id), self.stripe_of(target_account_id)))
+        with self.stripes[first]:
+            if first == second:
+                return super()._transfer(timestamp, source_account_id, target_account_id, amount)
+            with self.stripes[second]:
+                return super()._transfer(timestamp, source_account_id, target_account_id, amount)
+
+    def _merge_accounts(self, timestamp, account_id_1, account_id_2):
+        first, second = sorted((self.stripe_of(account_id_1), self.stripe_of(account_id_2)))
+        with self.drain_lock, self.stripes[first]:
+            if first == second:
+                with self.schedule_lock, self.ranking_lock:
+                    return super()._merge_accounts(timestamp, account_id_1, account_id_2)
+            with self.stripes[second], self.schedule_lock, self.ranking_lock:
+                return super()._merge_accounts(timestamp, account_id_1, account_id_2)
+
+    def _get_balance(self, account_id, time_at):
+        with self.stripes[self.stripe_of(account_id)]:
+            return super()._get_balance(account_id, time_at)
+
+    def _get_outgoing(self, account_id, time_from, time_to):
+        with self.stripes[self.stripe_of(account_id)]:
+            return super()._get_outgoing(account_id, time_from, time_to)
+
+    def _top_spenders(self, n):
+        with self.ranking_lock:
+            return super()._top_spenders(n)
+
+    def _schedule_payment(self, timestamp, account_id, amount, delay):
+        # scheduling waits for a running drain, which may have passed the payment time
+        with self.drain_lock, self.schedule_lock:
+            payment_id = super()._schedule_payment(timestamp, account_id, amount, delay)
+            if payment_id and timestamp + delay <= self.drained_through:
+                self.drained_through = float("-inf")
+            return payment_id
+
+    def _cancel_payment(self, account_id, payment_id):
+        with self.schedule_lock:
+            return super()._cancel_payment(account_id, payment_id)
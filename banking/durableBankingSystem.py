@@ -0,0 +1,130 @@
+'''
+Banking system whose state survives restarts.
+
+every operation that changes the ledger is appended to a write-ahead log once it
+has been applied without raising, and a snapshot of the whole state is taken
+every snapshot_every logged operations. opening a DurableBankingSystem on an
+existing directory loads the latest snapshot and replays only the log records
+written after it. a logged operation that raises when replayed is skipped and
+kept in recovery_errors.
+
+top_spenders, get_balance and get_outgoing are not logged: the scheduled payments
+they process are due by their timestamp anyway and are processed again by the
+next logged operation.
+'''
+
+import bankingSystem
+import writeAheadLog
+
+
+class DurableBankingSystem(bankingSystem.BankingSystem):
+
+
+    def __init__(self, directory, account_dict = None, group_size = 256, fsync_every = 1, snapshot_every = 1_000_000):
+        super().__init__(account_dict)
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.wal = writeAheadLog.WriteAheadLog(directory, group_size, fsync_every)
+        # (sequence no, operation, error) of the log records that failed on recovery
+        self.recovery_errors = []
+        self.recover()
+
+    def recover(self):
+        '''
+        rebuild the ledger from the latest snapshot and the log tail after it.
+        '''
+        self.snapshot_sequence_no, state = writeAheadLog.load_snapshot(self.directory)
+        if state is not None:
+            self.restore_state(state)
+        records = self.wal.read(self.snapshot_sequence_no)
+        replayed = [None]
+
+        def tail():
+            for sequence_no, op in records:
+                replayed[0] = (sequence_no, op)
+                yield op
+
+        ops = tail()
+        while True:
+            # a failing operation has been taken from ops, the next batch resumes after it
+            try:
+                super().execute_batch(ops, results = False)
+                break
+            except Exception as e:
+                self.recovery_errors.append((*replayed[0], e))
+        self.wal.last_sequence_no = max(self.wal.last_sequence_no, self.snapshot_sequence_no)
+        self.wal.open()
+
+    def snapshot(self):
+        '''
+        write a snapshot of the current state and drop the log segments it covers.
+        '''
+        self.wal.commit()
+        writeAheadLog.write_snapshot(self.directory, self.wal.last_sequence_no, self.snapshot_state())
+        self.snapshot_sequence_no = self.wal.last_sequence_no
+        self.wal.rotate()
+
+    def maybe_snapshot(self):
+        if self.snapshot_every and self.wal.last_sequence_no - self.snapshot_sequence_no >= self.snapshot_every:
+            self.snapshot()
+
+    def commit(self):
+        self.wal.commit()
+
+    def close(self):
+        self.wal.close()
+
+    def create_account(self, timestamp, account_id):
+        result = super().create_account(timestamp, account_id)
+        self.wal.append(("create_account", timestamp, account_id))
+        self.maybe_snapshot()
+        return result
+
+    def deposit(self, timestamp, account_id, amount):
+        result = super().deposit(timestamp, account_id, amount)
+        self.wal.append(("deposit", timestamp, account_id, amount))
+        self.maybe_snapshot()
+        return result
+
+    def transfer(self, timestamp, source_account_id, target_account_id, amount):
+        result = super().transfer(timestamp, source_account_id, target_account_id, amount)
+        self.wal.append(("transfer", timestamp, source_account_id, target_account_id, amount))
+        self.maybe_snapshot()
+        return result
+
+    def schedule_payment(self, timestamp, account_id, amount, delay):
+        result = super().schedule_payment(timestamp, account_id, amount, delay)
+        self.wal.append(("schedule_payment", timestamp, account_id, amount, delay))
+        self.maybe_snapshot()
+        return result
+
+    def cancel_payment(self, timestamp, account_id, payment_id):
+        result = super().cancel_payment(timestamp, account_id, payment_id)
+        self.wal.append(("cancel_payment", timestamp, account_id, payment_id))
+        self.maybe_snapshot()
+        return result
+
+    def merge_accounts(self, timestamp, account_id_1, account_id_2):
+        result = super().merge_accounts(timestamp, account_id_1, account_id_2)
+        self.wal.append(("merge_accounts", timestamp, account_id_1, account_id_2))
+        self.maybe_snapshot()
+        return result
+
+    def execute_batch(self, ops, results = True, lazy = False):
+        return super().execute_batch(self._logged(ops), results, lazy)
+
+    def _logged(self, ops):
+        # resuming the generator means the previous operation has been applied,
+        # an operation that raises is never logged
+        applied = None
+        for op in ops:
+            if applied is not None:
+                self.wal.append(applied)
+                applied = None
+            self.maybe_snapshot()
+            if op[0] not in ("top_spenders", "get_balance", "get_outgoing"):
+                applied = op
+            yield op
+        if applied is not None:
+            self.wal.append(applied)
+        self.maybe_snapshot()
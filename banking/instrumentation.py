@@ -0,0 +1,81 @@
+'''
+Runtime call counters and timers for a banking system.
+
+Instrumentation wraps methods of one system instance while it is enabled and
+removes the wrappers again when disabled, so a system that is not instrumented
+runs its methods unchanged, without any check on the hot path:
+
+    probe = instrumentation.Instrumentation(system)
+    probe.enable()
+    ...
+    probe.disable()
+    print(probe.stats())
+
+only calls made through the instance are counted, which includes the calls the
+system makes on itself, e.g. transfer calling process_payments. times are
+inclusive, the time of process_payments is also part of the time of transfer.
+'''
+
+import time
+
+
+# public operations, payment processing and the cores they share with execute_batch
+DEFAULT_METHODS = (
+    "create_account", "deposit", "transfer", "top_spenders", "schedule_payment", "cancel_payment",
+    "merge_accounts", "get_balance", "get_outgoing", "execute_batch", "process_payments",
+    "_create_account", "_deposit", "_transfer", "_top_spenders", "_schedule_payment",
+    "_cancel_payment", "_merge_accounts", "_get_balance", "_get_outgoing", "transfer_out",
+)
+
+
+class Instrumentation:
+
+
+    def __init__(self, system, methods = DEFAULT_METHODS):
+        self.system = system
+        self.methods = [name for name in methods if hasattr(system, name)]
+        # method name -> [calls, total nanoseconds]
+        self.counters = {name: [0, 0] for name in self.methods}
+        self.enabled = False
+
+    def enable(self):
+        if self.enabled:
+            return
+        for name in self.methods:
+            setattr(self.system, name, self.wrap(getattr(self.system, name), self.counters[name]))
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for name in self.methods:
+            delattr(self.system, name)
+        self.enabled = False
+
+    def reset(self):
+        for counter in self.counters.values():
+            counter[0] = counter[1] = 0
+
+    @staticmethod
+    def wrap(method, counter):
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += clock() - start
+        return timed
+
+    def stats(self):
+        '''
+        return {method name: {"calls", "total_s", "mean_us"}} of the methods
+        called since the last reset.
+        '''
+        stats = {}
+        for name, (calls, total) in self.counters.items():
+            if calls:
+                stats[name] = {"calls": calls, "total_s": total / 1e9, "mean_us": total / calls / 1e3}
+        return stats
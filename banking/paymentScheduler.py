@@ -0,0 +1,174 @@
+'''
+Schedulers holding the pending scheduled payments of the banking system.
+
+both schedulers support the same operations:
+    - add(payment): schedule the payment at payment.payment_time
+    - cancel(payment): drop a pending payment
+    - pop_due(timestamp): remove and yield every pending payment due at or before
+      timestamp, ordered by payment time and then by order of creation.
+
+HeapScheduler keeps a single heap and leaves cancelled payments in it until they
+are popped. TimingWheelScheduler is a hierarchical timing wheel: adding and
+cancelling are O(1) and cancelled payments are removed right away.
+'''
+
+import heapq
+
+
+class HeapScheduler:
+
+
+    def __init__(self):
+        self.heap = []
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def add(self, payment):
+        heapq.heappush(self.heap, (payment.payment_time, payment.ordinal_no, payment))
+        self.pending += 1
+
+    def cancel(self, payment):
+        # the payment stays in the heap and is skipped once popped
+        payment.status = 0
+        self.pending -= 1
+
+    def pop_due(self, timestamp):
+        while self.heap and self.heap[0][0] <= timestamp:
+            payment = heapq.heappop(self.heap)[2]
+            if payment.status == 0:
+                continue
+            self.pending -= 1
+            yield payment
+
+
+class TimingWheelScheduler:
+    '''
+    each level of the wheel has 2 ** slot_bits slots. a slot at level k covers
+    2 ** (slot_bits * k) timestamps, and a payment is kept at the lowest level
+    whose slots share their higher-order bits with the current time of the
+    wheel. when the time moves into the range of a higher-level slot, the
+    payments of that slot are cascaded down to the lower levels.
+
+    the occupied slots of each level are tracked in a bitmap, so finding the
+    next pending payment never walks over empty timestamps. payment times must
+    be non-negative integers. payments too far ahead for the top level wait in
+    an overflow heap and join the wheel once the wheel is empty and time
+    reaches their block.
+    '''
+
+    def __init__(self, slot_bits = 8, levels = 8):
+        self.slot_bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels = levels
+        self.wheels = [[None] * (1 << slot_bits) for _ in range(levels)]
+        self.occupied = [0] * levels
+        # payments beyond the range of the top level, as a heap of (payment time,
+        # ordinal no, payment) and by ordinal no while they are pending
+        self.overflow = []
+        self.overflow_payments = {}
+        self.pending = 0
+        self.now = 0
+
+    def __len__(self):
+        return self.pending
+
+    def add(self, payment):
+        # payments due before the current time of the wheel go to the current slot
+        payment_time = max(payment.payment_time, self.now)
+        diff = payment_time ^ self.now
+        level = 0 if diff == 0 else (diff.bit_length() - 1) // self.slot_bits
+        if level >= self.levels:
+            heapq.heappush(self.overflow, (payment_time, payment.ordinal_no, payment))
+            self.overflow_payments[payment.ordinal_no] = payment
+            payment.wheel_location = None
+            self.pending += 1
+            return
+
+        slot = (payment_time >> (self.slot_bits * level)) & self.mask
+        bucket = self.wheels[level][slot]
+        if bucket is None:
+            bucket = self.wheels[level][slot] = {}
+            self.occupied[level] |= 1 << slot
+        bucket[payment.ordinal_no] = payment
+        payment.wheel_location = (level << self.slot_bits) | slot
+        self.pending += 1
+
+    def cancel(self, payment):
+        self.pending -= 1
+        if payment.wheel_location is None:
+            # left in the heap and skipped once it reaches the top
+            del self.overflow_payments[payment.ordinal_no]
+            return
+        level, slot = payment.wheel_location >> self.slot_bits, payment.wheel_location & self.mask
+        bucket = self.wheels[level][slot]
+        del bucket[payment.ordinal_no]
+        if not bucket:
+            self._clear(level, slot)
+
+    def _clear(self, level, slot):
+        bucket = self.wheels[level][slot]
+        self.wheels[level][slot] = None
+        self.occupied[level] &= ~(1 << slot)
+        return bucket
+
+    def pop_due(self, timestamp):
+        while self.pending:
+            # the earliest occupied slot of the current lowest-level block
+            current = self.now & self.mask
+            bits = self.occupied[0] >> current
+            if bits:
+                slot = current + (bits & -bits).bit_length() - 1
+                slot_time = (self.now & ~self.mask) | slot
+                if slot_time > timestamp:
+                    return
+                self.now = slot_time
+                bucket = self._clear(0, slot)
+                self.pending -= len(bucket)
+                # cascaded payments may have joined the slot after newer ones
+                yield from sorted(bucket.values(), key = lambda p: (p.payment_time, p.ordinal_no))
+                continue
+
+            # otherwise move to the next occupied slot of a higher level
+            for level in range(1, self.levels):
+                shift = self.slot_bits * level
+                current = (self.now >> shift) & self.mask
+                bits = self.occupied[level] >> (current + 1)
+                if bits:
+                    slot = current + (bits & -bits).bit_length()
+                    block = self.now >> (shift + self.slot_bits) << (shift + self.slot_bits)
+                    slot_time = block | (slot << shift)
+                    break
+            else:
+                if not self._enter_overflow(timestamp):
+                    return
+                continue
+
+            if slot_time > timestamp:
+                return
+            self.now = slot_time
+            bucket = self._clear(level, slot)
+            self.pending -= len(bucket)
+            for payment in bucket.values():
+                self.add(payment)
+
+    def _enter_overflow(self, timestamp):
+        '''
+        with the wheel empty, move the time of the wheel to the earliest overflow
+        payment and add the overflow payments now in range of the wheel. return
+        false if there is none due at or before timestamp.
+        '''
+        while self.overflow and self.overflow[0][1] not in self.overflow_payments:
+            heapq.heappop(self.overflow)
+        if not self.overflow or self.overflow[0][0] > timestamp:
+            return False
+        self.now = self.overflow[0][0]
+        range_bits = self.slot_bits * self.levels
+        while self.overflow and (self.overflow[0][0] ^ self.now) >> range_bits == 0:
+            payment = heapq.heappop(self.overflow)[2]
+            if self.overflow_payments.pop(payment.ordinal_no, None) is None:
+                continue
+            self.pending -= 1
+            self.add(payment)
+        return True
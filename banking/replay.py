@@ -0,0 +1,352 @@
+'''
+Deterministic replay of recorded operations through banking engines.
+
+a trace is a JSONL file with one operation per line in the execute_batch
+format, [name, timestamp, *args], or an object {"op": [...], "result": ...}
+holding the result recorded with it. replay streams a trace chunk by chunk
+through a reference BankingSystem, called one public method at a time, and
+through every engine under test, and compares the result of every operation
+with the reference, and with the recorded result if there is one. every
+engine runs the same trace from a fresh system, so a difference is a
+difference in behavior, and the time spent in each engine gives its
+throughput on that trace.
+
+a trace that makes an engine differ from the reference can be shrunk to a
+minimal one that still does: the trace is cut after the first difference and
+operations are then removed by delta debugging as long as the engine keeps
+differing on what is left.
+
+    python replay.py run trace.jsonl [--engines batch,columnar] [--shrink repro.jsonl]
+    python replay.py record trace.jsonl [--accounts N] [--ops N] [--seed N]
+    python replay.py edge_cases [--engines ...]
+'''
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+import bankingSystem
+import columnarStore
+import concurrentBankingSystem
+import durableBankingSystem
+import shardedBankingSystem
+import workload
+
+
+class MethodCalls:
+    '''
+    runs every operation through the public method of the same name, the way
+    the operations are called one at a time.
+    '''
+
+    def __init__(self, system):
+        self.system = system
+
+    def execute(self, ops):
+        return [getattr(self.system, op[0])(*op[1:]) for op in ops]
+
+    def close(self):
+        close = getattr(self.system, "close", None)
+        if close is not None:
+            close()
+
+
+class Batches(MethodCalls):
+    '''
+    runs the operations through execute_batch.
+    '''
+
+    def execute(self, ops):
+        return self.system.execute_batch(ops)
+
+
+class DurableBatches(Batches):
+    '''
+    runs the operations through execute_batch of a DurableBankingSystem logging
+    to a temporary directory, removed on close.
+    '''
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix = "banking-replay-")
+        super().__init__(durableBankingSystem.DurableBankingSystem(self.directory, fsync_every = 0))
+
+    def close(self):
+        super().close()
+        shutil.rmtree(self.directory)
+
+
+REFERENCE = lambda: MethodCalls(bankingSystem.BankingSystem())
+
+ENGINES = {
+    "batch": lambda: Batches(bankingSystem.BankingSystem()),
+    "columnar": lambda: Batches(bankingSystem.BankingSystem(columnarStore.ColumnarAccounts(), history_store = columnarStore.ColumnarHistories())),
+    "concurrent": lambda: MethodCalls(concurrentBankingSystem.ConcurrentBankingSystem()),
+    "durable": DurableBatches,
+    "sharded": lambda: Batches(shardedBankingSystem.ShardedBankingSystem(2)),
+}
+
+
+def read_trace(path):
+    '''
+    yield (op, recorded result or None) of every operation of a trace.
+    '''
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                op, recorded = entry["op"], entry.get("result")
+            else:
+                op, recorded = entry, None
+            if not isinstance(op, list) or len(op) < 2:
+                raise ValueError(f"{path}:{line_no}: expected [name, timestamp, *args], got {line.strip()}")
+            yield tuple(op), recorded
+
+
+def write_trace(path, ops, results = None):
+    '''
+    write ops to a trace, with the result of each of them if results is given.
+    '''
+    with open(path, "w") as f:
+        if results is None:
+            for op in ops:
+                f.write(json.dumps(list(op)) + "\n")
+        else:
+            for op, result in zip(ops, results):
+                f.write(json.dumps({"op": list(op), "result": result}) + "\n")
+
+
+def chunks(entries, chunk_size):
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Replay:
+    '''
+    replays a trace through the reference and the given engines, a dict of name
+    to a function creating an engine, and collects the differences.
+    '''
+
+    def __init__(self, engines, chunk_size = 10_000, max_diffs = 20, keep_ops = False):
+        self.engines = engines
+        self.chunk_size = chunk_size
+        self.max_diffs = max_diffs
+        # keep the operations up to the first difference of an engine, to shrink the trace
+        self.keep_ops = keep_ops
+        self.ops = []
+        # (engine name, op no, op, expected, actual) of the first max_diffs differences
+        self.diffs = []
+        self.n_diffs = {}
+        self.first_diff = {}
+        # engine name -> (seconds spent, operations run) and the exception that stopped an engine
+        self.timings = {}
+        self.errors = {}
+        self.n_ops = 0
+
+    def diff(self, name, op_no, op, expected, actual):
+        self.n_diffs[name] = self.n_diffs.get(name, 0) + 1
+        self.first_diff.setdefault(name, op_no)
+        if len(self.diffs) < self.max_diffs:
+            self.diffs.append((name, op_no, op, expected, actual))
+
+    def keep(self, ops):
+        first_diffs = [op_no for name, op_no in self.first_diff.items() if name in self.engines]
+        if not first_diffs:
+            self.ops.extend(ops)
+        else:
+            self.ops.extend(ops[:max(0, min(first_diffs) + 1 - len(self.ops))])
+
+    def run(self, entries):
+        '''
+        replay entries, (op, recorded result or None), and return whether every
+        engine gave the results of the reference.
+        '''
+        running = {"reference": REFERENCE()}
+        running.update((name, make()) for name, make in self.engines.items())
+        self.timings = {name: (0.0, 0) for name in running}
+        try:
+            for chunk in chunks(entries, self.chunk_size):
+                ops = [op for op, _ in chunk]
+                results = {}
+                for name, engine in list(running.items()):
+                    start = time.perf_counter()
+                    try:
+                        results[name] = engine.execute(ops)
+                    except Exception as e:
+                        # the failing operation is somewhere in the chunk
+                        self.errors[name] = (self.n_ops, e)
+                        self.first_diff.setdefault(name, self.n_ops + len(ops) - 1)
+                        engine.close()
+                        del running[name]
+                        continue
+                    elapsed, n = self.timings[name]
+                    self.timings[name] = (elapsed + time.perf_counter() - start, n + len(ops))
+
+                expected = results.pop("reference")
+                for i, (op, recorded) in enumerate(chunk):
+                    if recorded is not None and recorded != expected[i]:
+                        self.diff("recorded", self.n_ops + i, op, recorded, expected[i])
+                for name, actual in results.items():
+                    if actual != expected:
+                        for i, op in enumerate(ops):
+                            if actual[i] != expected[i]:
+                                self.diff(name, self.n_ops + i, op, expected[i], actual[i])
+                if self.keep_ops:
+                    self.keep(ops)
+                self.n_ops += len(ops)
+        finally:
+            for engine in running.values():
+                engine.close()
+        return not self.n_diffs and not self.errors
+
+    def report(self):
+        lines = [f"ops={self.n_ops}"]
+        for name, (elapsed, n) in self.timings.items():
+            rate = f"{n / elapsed:12.0f} ops/s" if elapsed else f"{'-':>12s} ops/s"
+            status = "ok"
+            if name in self.errors:
+                op_no, e = self.errors[name]
+                status = f"stopped in the chunk from op {op_no}: {type(e).__name__}: {e}"
+            elif name in self.n_diffs:
+                status = f"{self.n_diffs[name]} differences, first at op {self.first_diff[name]}"
+            lines.append(f"    {name:12s} {rate} {status}")
+        if "recorded" in self.n_diffs:
+            lines.append(f"    {'recorded':12s} {self.n_diffs['recorded']} differences from the reference, "
+                         f"first at op {self.first_diff['recorded']}")
+        for name, op_no, op, expected, actual in self.diffs:
+            lines.append(f"    {name} op {op_no} {list(op)}: expected {expected!r}, got {actual!r}")
+        return "\n".join(lines)
+
+
+def differs(make_engine, ops):
+    '''
+    return whether the engine gives other results than the reference on ops, or raises.
+    '''
+    reference = REFERENCE()
+    engine = make_engine()
+    try:
+        expected = reference.execute(ops)
+        try:
+            return engine.execute(ops) != expected
+        except Exception:
+            return True
+    finally:
+        reference.close()
+        engine.close()
+
+
+def shrink(make_engine, ops, max_runs = 10_000):
+    '''
+    return a minimal subsequence of ops on which the engine still differs from
+    the reference: no single chunk of operations removed by delta debugging,
+    down to single operations, leaves a trace on which it differs.
+    '''
+    ops = list(ops)
+    n = 2
+    runs = 0
+    while len(ops) >= 2 and runs < max_runs:
+        chunk = -(-len(ops) // n)
+        for start in range(0, len(ops), chunk):
+            candidate = ops[:start] + ops[start + chunk:]
+            runs += 1
+            if differs(make_engine, candidate):
+                ops = candidate
+                n = max(n - 1, 2)
+                break
+        else:
+            if n >= len(ops):
+                break
+            n = min(len(ops), 2 * n)
+    return ops
+
+
+def edge_cases():
+    '''
+    operations around the rules engines are most likely to get wrong: transfer
+    edge cases, several payments of an account due at the same timestamp, and
+    cancelling payments due at the timestamp of the cancel.
+    '''
+    return [
+        ("create_account", 1, "a"), ("create_account", 1, "b"), ("create_account", 1, "a"),
+        ("deposit", 2, "a", 100), ("deposit", 2, "missing", 5),
+        # transfers to the same account, from or to missing accounts, above and at the balance
+        ("transfer", 3, "a", "a", 10), ("transfer", 3, "a", "missing", 10), ("transfer", 3, "missing", "a", 10),
+        ("transfer", 3, "a", "b", 101), ("transfer", 3, "a", "b", 100), ("transfer", 3, "b", "a", 50),
+        # three payments of a due at 10, performed in order of creation while funds last
+        ("schedule_payment", 4, "a", 30, 6), ("schedule_payment", 5, "a", 30, 5), ("schedule_payment", 6, "a", 30, 4),
+        ("schedule_payment", 6, "b", 20, 4), ("schedule_payment", 7, "missing", 5, 1),
+        # payments due at 10 run before the cancel at 10, which no longer finds payment3
+        ("cancel_payment", 9, "a", "payment2"), ("cancel_payment", 9, "a", "payment2"),
+        ("cancel_payment", 9, "b", "payment1"), ("cancel_payment", 10, "a", "payment3"),
+        ("top_spenders", 10, 3), ("deposit", 10, "a", 0),
+        # a payment due right away runs before the next operation at the same timestamp
+        ("schedule_payment", 11, "b", 5, 0), ("transfer", 11, "b", "a", 1000), ("top_spenders", 11, 5),
+        # a payment scheduled and cancelled before it is due
+        ("schedule_payment", 12, "a", 1, 3), ("cancel_payment", 14, "a", "payment6"), ("deposit", 15, "a", 1),
+        ("merge_accounts", 16, "a", "b"), ("get_balance", 17, "b", 11), ("get_outgoing", 17, "a", 0, 17),
+        ("top_spenders", 17, 5),
+    ]
+
+
+def select_engines(names):
+    if not names:
+        return dict(ENGINES)
+    unknown = [name for name in names if name not in ENGINES]
+    if unknown:
+        raise ValueError(f"unknown engines {', '.join(unknown)}, known are {', '.join(ENGINES)}")
+    return {name: ENGINES[name] for name in names}
+
+
+def run_and_report(entries, engines, shrink_path = None, chunk_size = 10_000):
+    replay = Replay(engines, chunk_size, keep_ops = shrink_path is not None)
+    ok = replay.run(entries)
+    print(replay.report())
+    if not ok and shrink_path is not None:
+        name, op_no = min(((name, op_no) for name, op_no in replay.first_diff.items() if name in engines),
+                          key = lambda item: item[1], default = (None, None))
+        if name is not None:
+            ops = shrink(engines[name], replay.ops[:op_no + 1])
+            write_trace(shrink_path, ops)
+            print(f"shrunk the first {op_no + 1} ops to {len(ops)} on which {name} differs, written to {shrink_path}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "replay operation traces through banking engines and compare the results")
+    parser.add_argument("command", choices = ["run", "record", "edge_cases"])
+    parser.add_argument("trace", nargs = "?", help = "trace to replay or to write")
+    parser.add_argument("--engines", help = "comma separated engines to compare with the reference, default all")
+    parser.add_argument("--shrink", metavar = "PATH", help = "write a minimal trace reproducing the first difference")
+    parser.add_argument("--chunk-size", type = int, default = 10_000)
+    parser.add_argument("--accounts", type = int, default = 1_000)
+    parser.add_argument("--ops", type = int, default = 100_000)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    engines = select_engines(args.engines.split(",") if args.engines else [])
+
+    if args.command == "record":
+        if not args.trace:
+            parser.error("record needs the path of the trace to write")
+        load = workload.Workload(args.accounts, args.ops, seed = args.seed)
+        ops = list(load.setup_ops()) + list(load.ops())
+        write_trace(args.trace, ops, REFERENCE().execute(ops))
+        print(f"recorded {len(ops)} ops to {args.trace}")
+        return True
+    if args.command == "edge_cases":
+        return run_and_report(((op, None) for op in edge_cases()), engines, args.shrink, args.chunk_size)
+    if not args.trace:
+        parser.error("run needs the path of the trace to replay")
+    return run_and_report(read_trace(args.trace), engines, args.shrink, args.chunk_size)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
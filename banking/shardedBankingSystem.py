@@ -0,0 +1,388 @@
+'''
+Banking system partitioned across worker processes.
+
+accounts are assigned to shards by a crc32 hash of their id and every shard is a
+ShardLedger living in its own worker process. the coordinator keeps the set of
+existing account ids and the global payment ordinal, and streams each operation
+to the shard owning its account:
+
+    - deposits, intra-shard transfers, scheduling and cancelling payments are
+      queued on their shard and run in parallel with the other shards.
+    - top_spenders is queued on every shard and the per-shard top n lists are
+      merged once the results come back.
+    - a cross-shard transfer runs in two phases, both queued right away. the
+      source shard prepares the transfer, which debits the source if it has
+      sufficient funds, and sends the outcome to the inbox of the target shard.
+      outcomes are sent in bulk, at the end of a batch or before the shard
+      waits for an outcome itself.
+      the target shard commits the credit once the outcome has arrived, and
+      only if the prepare succeeded. both phases run after the scheduled
+      payments due at the timestamp.
+    - merging an account of another shard runs the same way. the shard of the
+      merged account detaches it after its due payments and sends its balance,
+      outgoing total, history and pending payments to the inbox of the shard
+      of the account it is merged into, which attaches them.
+
+the routed operations are sent to all shards at once, in rounds of at most
+chunk_size operations per shard. a commit waits at most for a prepare of the
+same round or an earlier one, which its source shard reaches without waiting
+for anything later, so the shards never wait on each other in a cycle and the
+coordinator never waits for a cross-shard transfer or merge.
+
+every shard sees its operations in the original order, so the results are the
+same as those of a single BankingSystem.
+'''
+
+import heapq
+import multiprocessing
+import zlib
+from collections import deque
+
+import account
+import bankingSystem
+
+
+def shard_of(account_id, n_shards):
+    return zlib.crc32(str(account_id).encode()) % n_shards
+
+
+class ShardLedger(bankingSystem.BankingSystem):
+
+
+    def __init__(self, shard = 0, inboxes = None):
+        super().__init__()
+        self.shard = shard
+        # one queue per shard receiving the outcomes of prepared transfers and
+        # detached accounts, the outcomes not sent yet per target shard, and the
+        # outcomes received ahead of their second phase, keyed by transfer no
+        self.inboxes = inboxes
+        self.outcomes = {}
+        self.received = {}
+
+    def run(self, ops):
+        '''
+        apply a list of routed operations in order and return their raw results.
+        '''
+        results = []
+        for op in ops:
+            name, timestamp = op[0], op[1]
+            if name == "schedule_payment":
+                account_id, amount, delay, ordinal_no = op[2:]
+                # the ordinal is numbered across all shards by the coordinator
+                self.scheduled_ordinal_no = ordinal_no
+                results.append(self._schedule_payment(timestamp, account_id, amount, delay))
+                continue
+
+            self.process_payments(timestamp)
+            if name == "create_account":
+                results.append(self._create_account(timestamp, op[2]))
+            elif name == "deposit":
+                results.append(self._deposit(timestamp, op[2], op[3]))
+            elif name == "transfer":
+                results.append(self._transfer(timestamp, op[2], op[3], op[4]))
+            elif name == "top_spenders":
+                results.append(self._top_spenders(op[2]))
+            elif name == "cancel_payment":
+                results.append(self._cancel_payment(op[2], op[3]))
+            elif name == "merge_accounts":
+                results.append(self._merge_accounts(timestamp, op[2], op[3]))
+            elif name == "get_balance":
+                results.append(self._get_balance(op[2], op[3]))
+            elif name == "get_outgoing":
+                results.append(self._get_outgoing(op[2], op[3], op[4]))
+            elif name == "prepare_transfer":
+                results.append(self.prepare_transfer(timestamp, *op[2:]))
+            elif name == "commit_transfer":
+                results.append(self.commit_transfer(timestamp, *op[2:]))
+            elif name == "detach_account":
+                results.append(self.detach_account(timestamp, *op[2:]))
+            elif name == "attach_account":
+                results.append(self.attach_account(timestamp, *op[2:]))
+            else:
+                raise ValueError(f"unknown operation {name}")
+        self.send_outcomes()
+        return results
+
+    def prepare_transfer(self, timestamp, source_account_id, amount, transfer_no, target_shard):
+        '''
+        first phase of a cross-shard transfer: debit the source account, tell the
+        target shard whether it was debited and return its new balance, or None if
+        it has insufficient funds.
+        '''
+        source_account = self.account_dict[source_account_id]
+        debited = source_account.get_balance() >= amount
+        self.outcomes.setdefault(target_shard, []).append((transfer_no, debited))
+        if not debited:
+            return None
+        self.transfer_out(timestamp, source_account, amount)
+        return source_account.get_balance()
+
+    def commit_transfer(self, timestamp, target_account_id, amount, transfer_no):
+        '''
+        second phase of a cross-shard transfer: credit the target account if the
+        source shard debited the source.
+        '''
+        if self.receive(transfer_no):
+            self._deposit(timestamp, target_account_id, amount)
+        return None
+
+    def detach_account(self, timestamp, account_id, transfer_no, target_shard):
+        '''
+        first phase of merging an account into one of another shard: remove the
+        account and its pending payments and send them to the target shard. the
+        history stays here as well, for get_balance of the removed account.
+        '''
+        removed_account = self.account_dict.pop(account_id)
+        payments = self.account_payments.pop(account_id, {})
+        for payment in payments.values():
+            self.scheduled_payments_queue.cancel(payment)
+            del self.scheduled_payments[payment.payment_id]
+        self.spender_ranking.remove(account_id)
+        history = self.account_history.pop(account_id)
+        self.closed_history[account_id].append((timestamp, history))
+        detached = (removed_account.get_balance(), removed_account.get_outgoing(), history, list(payments.values()))
+        self.outcomes.setdefault(target_shard, []).append((transfer_no, detached))
+        return None
+
+    def attach_account(self, timestamp, account_id_1, account_id_2, transfer_no):
+        '''
+        second phase of merging account_id_2 of another shard into account_id_1,
+        see BankingSystem._merge_accounts.
+        '''
+        balance, outgoing, removed_history, payments = self.receive(transfer_no)
+        removed_account = account.Account(account_id_2)
+        removed_account.balance = balance
+        removed_account.outgoing = outgoing
+        merged_account = self.account_dict[account_id_1]
+        merged_account.merge(removed_account)
+
+        for payment in payments:
+            payment.account_id = account_id_1
+            payment.status = 1
+            self.scheduled_payments[payment.payment_id] = payment
+            self.account_payments.setdefault(account_id_1, {})[payment.payment_id] = payment
+            self.scheduled_payments_queue.add(payment)
+
+        self.spender_ranking.update(account_id_1, merged_account.get_outgoing())
+        self.account_history[account_id_1].link_merged(timestamp, removed_history, outgoing)
+        self.record_balance(timestamp, merged_account)
+        return None
+
+    def send_outcomes(self):
+        for target_shard, outcomes in self.outcomes.items():
+            self.inboxes[target_shard].put(outcomes)
+        self.outcomes = {}
+
+    def receive(self, transfer_no):
+        if transfer_no not in self.received:
+            # the shard waited for may in turn wait for the outcomes of this one
+            self.send_outcomes()
+        while transfer_no not in self.received:
+            self.received.update(self.inboxes[self.shard].get())
+        return self.received.pop(transfer_no)
+
+
+def shard_worker(conn, shard, inboxes):
+    ledger = ShardLedger(shard, inboxes)
+    while True:
+        ops = conn.recv()
+        if ops is None:
+            break
+        conn.send(ledger.run(ops))
+    conn.close()
+
+
+class ShardedBankingSystem:
+
+
+    def __init__(self, n_shards, chunk_size = 4096):
+        self.n_shards = n_shards
+        self.chunk_size = chunk_size
+        self.account_ids = set()
+        self.scheduled_ordinal_no = 1
+        # numbers the cross-shard transfers and merges, to match their two phases
+        self.transfer_no = 0
+        self.inboxes = [multiprocessing.Queue() for _ in range(n_shards)]
+        self.connections = []
+        self.workers = []
+        for shard in range(n_shards):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target = shard_worker, args = (worker_conn, shard, self.inboxes), daemon = True)
+            worker.start()
+            worker_conn.close()
+            self.connections.append(conn)
+            self.workers.append(worker)
+
+    def close(self):
+        for conn, worker in zip(self.connections, self.workers):
+            conn.send(None)
+            worker.join()
+            conn.close()
+
+    def create_account(self, timestamp, account_id):
+        return self.execute_batch([("create_account", timestamp, account_id)])[0]
+
+    def deposit(self, timestamp, account_id, amount):
+        return self.execute_batch([("deposit", timestamp, account_id, amount)])[0]
+
+    def transfer(self, timestamp, source_account_id, target_account_id, amount):
+        return self.execute_batch([("transfer", timestamp, source_account_id, target_account_id, amount)])[0]
+
+    def top_spenders(self, timestamp, n):
+        return self.execute_batch([("top_spenders", timestamp, n)])[0]
+
+    def schedule_payment(self, timestamp, account_id, amount, delay):
+        return self.execute_batch([("schedule_payment", timestamp, account_id, amount, delay)])[0]
+
+    def cancel_payment(self, timestamp, account_id, payment_id):
+        return self.execute_batch([("cancel_payment", timestamp, account_id, payment_id)])[0]
+
+    def merge_accounts(self, timestamp, account_id_1, account_id_2):
+        return self.execute_batch([("merge_accounts", timestamp, account_id_1, account_id_2)])[0]
+
+    def get_balance(self, timestamp, account_id, time_at):
+        return self.execute_batch([("get_balance", timestamp, account_id, time_at)])[0]
+
+    def get_outgoing(self, timestamp, account_id, time_from, time_to):
+        return self.execute_batch([("get_outgoing", timestamp, account_id, time_from, time_to)])[0]
+
+    def execute_batch(self, ops, results = True, lazy = False):
+        '''
+        apply a timestamp-ordered iterable of operations, see
+        BankingSystem.execute_batch. the results are only known once every
+        operation has been applied, so with lazy the generator yields them from
+        the finished list.
+        '''
+        batch = self._execute_batch(ops)
+        if not results:
+            return None
+        if lazy:
+            return iter(batch)
+        return batch
+
+    def _execute_batch(self, ops):
+        ops = list(ops)
+        results = []
+        # per shard: routed operations not sent yet, the result index of each of
+        # them, and the result indexes of the batches sent but not received
+        pending = [[] for _ in range(self.n_shards)]
+        targets = [[] for _ in range(self.n_shards)]
+        in_flight = [deque() for _ in range(self.n_shards)]
+
+        def route(shard, op, target):
+            pending[shard].append(op)
+            targets[shard].append(target)
+            if len(pending[shard]) >= self.chunk_size:
+                send_round()
+
+        def send_round():
+            # one batch in flight per shard, so neither side can block on a full pipe,
+            # and every shard is sent its operations of the round, so the prepares
+            # the commits of the round wait for are sent along with them
+            for shard in range(self.n_shards):
+                while in_flight[shard]:
+                    receive(shard)
+            for shard in range(self.n_shards):
+                if pending[shard]:
+                    self.connections[shard].send(pending[shard])
+                    in_flight[shard].append(targets[shard])
+                    pending[shard] = []
+                    targets[shard] = []
+
+        def receive(shard):
+            for target, raw in zip(in_flight[shard].popleft(), self.connections[shard].recv()):
+                if target is None:
+                    continue
+                if ops[target][0] == "top_spenders":
+                    # the top n of one shard
+                    results[target].append(raw)
+                else:
+                    results[target] = raw
+
+        for op in ops:
+            name, timestamp = op[0], op[1]
+            index = len(results)
+            results.append(None)
+
+            if name == "create_account":
+                account_id = op[2]
+                results[index] = account_id not in self.account_ids
+                if results[index]:
+                    self.account_ids.add(account_id)
+                    route(shard_of(account_id, self.n_shards), op, None)
+
+            elif name == "deposit":
+                route(shard_of(op[2], self.n_shards), op, index)
+
+            elif name == "transfer":
+                source_account_id, target_account_id, amount = op[2:]
+                if source_account_id not in self.account_ids or target_account_id not in self.account_ids:
+                    continue
+                source_shard = shard_of(source_account_id, self.n_shards)
+                target_shard = shard_of(target_account_id, self.n_shards)
+                if source_shard == target_shard:
+                    route(source_shard, op, index)
+                    continue
+
+                self.transfer_no += 1
+                route(source_shard, ("prepare_transfer", timestamp, source_account_id, amount, self.transfer_no, target_shard), index)
+                route(target_shard, ("commit_transfer", timestamp, target_account_id, amount, self.transfer_no), None)
+
+            elif name == "top_spenders":
+                results[index] = []
+                for shard in range(self.n_shards):
+                    route(shard, op, index)
+
+            elif name == "schedule_payment":
+                account_id, amount, delay = op[2:]
+                if account_id not in self.account_ids:
+                    results[index] = ""
+                    continue
+                results[index] = f"payment{self.scheduled_ordinal_no}"
+                route(shard_of(account_id, self.n_shards), op + (self.scheduled_ordinal_no,), None)
+                self.scheduled_ordinal_no += 1
+
+            elif name == "cancel_payment":
+                account_id = op[2]
+                results[index] = False
+                if account_id in self.account_ids:
+                    route(shard_of(account_id, self.n_shards), op, index)
+
+            elif name == "merge_accounts":
+                account_id_1, account_id_2 = op[2:]
+                results[index] = False
+                if account_id_1 == account_id_2 or account_id_1 not in self.account_ids or account_id_2 not in self.account_ids:
+                    continue
+                results[index] = True
+                self.account_ids.remove(account_id_2)
+                shard = shard_of(account_id_1, self.n_shards)
+                removed_shard = shard_of(account_id_2, self.n_shards)
+                if shard == removed_shard:
+                    route(shard, op, None)
+                    continue
+
+                self.transfer_no += 1
+                route(removed_shard, ("detach_account", timestamp, account_id_2, self.transfer_no, shard), None)
+                route(shard, ("attach_account", timestamp, account_id_1, account_id_2, self.transfer_no), None)
+
+            elif name == "get_balance" or name == "get_outgoing":
+                route(shard_of(op[2], self.n_shards), op, index)
+
+            else:
+                raise ValueError(f"unknown operation {name}")
+
+        send_round()
+        for shard in range(self.n_shards):
+            while in_flight[shard]:
+                receive(shard)
+
+        # format raw results the way BankingSystem returns them
+        for index, op in enumerate(ops):
+            name = op[0]
+            if name in ("deposit", "transfer", "get_balance", "get_outgoing"):
+                results[index] = "" if results[index] is None else str(results[index])
+            elif name == "top_spenders":
+                n = op[2]
+                merged = heapq.merge(*results[index], key = lambda pair: (-pair[0], pair[1]))
+                results[index] = bankingSystem.BankingSystem.format_top_spenders([pair for pair, _ in zip(merged, range(n))])
+        return results
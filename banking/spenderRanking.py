@@ -0,0 +1,95 @@
+'''
+Ranking index over the total value of outgoing transactions of each account.
+
+accounts are kept ordered by (-outgoing, account_id), which is the order used by
+top_spenders: descending outgoing total, ties broken alphabetically by account id.
+
+the keys are stored in a list of small sorted buckets. locating a bucket is a
+binary search over the bucket maxima and the bucket itself never grows beyond
+2 * load keys, so add / remove / update cost O(log N) and reading the first n
+accounts costs O(n + log N).
+'''
+
+from bisect import bisect_left, insort
+
+
+class SpenderRanking:
+
+
+    def __init__(self, load = 512):
+        self.load = load
+        self.buckets = []
+        self.maxes = []
+        self.keys = {}
+        # bumped on every change of the ranking, lets readers cache top n results
+        self.version = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, account_id):
+        return account_id in self.keys
+
+    def add(self, account_id, outgoing):
+        '''
+        insert account_id into the ranking with the given outgoing total.
+        '''
+        key = (-outgoing, account_id)
+        self.keys[account_id] = key
+        self.version += 1
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            return
+
+        i = bisect_left(self.maxes, key)
+        if i == len(self.buckets):
+            i -= 1
+        bucket = self.buckets[i]
+        insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+
+        # split oversized buckets so that inserting into a bucket stays cheap
+        if len(bucket) > 2 * self.load:
+            half = bucket[self.load:]
+            del bucket[self.load:]
+            self.maxes[i] = bucket[-1]
+            self.buckets.insert(i + 1, half)
+            self.maxes.insert(i + 1, half[-1])
+
+    def remove(self, account_id):
+        '''
+        drop account_id from the ranking.
+        '''
+        key = self.keys.pop(account_id)
+        self.version += 1
+        i = bisect_left(self.maxes, key)
+        bucket = self.buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self.maxes[i] = bucket[-1]
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+
+    def update(self, account_id, outgoing):
+        '''
+        move account_id to the position matching its new outgoing total.
+        '''
+        if self.keys[account_id] == (-outgoing, account_id):
+            return
+        self.remove(account_id)
+        self.add(account_id, outgoing)
+
+    def top(self, n):
+        '''
+        return [account_id, outgoing] pairs of the first n accounts in ranking order.
+        if less than n accounts are ranked, all of them are returned.
+        '''
+        top_n = []
+        for bucket in self.buckets:
+            for out_balance, account_id in bucket:
+                if len(top_n) >= n:
+                    return top_n
+                top_n.append([-out_balance, account_id])
+        return top_n
@@ -0,0 +1,91 @@
+'''
+Reproducible workloads for the banking system.
+
+a workload is a stream of operations in the execute_batch format, (name,
+timestamp, *args), drawn from a seeded random generator, so the same parameters
+always produce the same operations. setup_ops creates and funds the accounts at
+timestamp 1, ops then yields one operation per timestamp from 2 onwards:
+
+    load = workload.Workload(n_accounts = 10_000, n_ops = 1_000_000)
+    system.execute_batch(load.setup_ops(), results = False)
+    system.execute_batch(load.ops(), results = False)
+
+mix maps operation names to relative weights. cancel_payment picks one of the
+payments scheduled earlier in the workload, which may already have been
+performed or cancelled.
+'''
+
+import random
+
+
+DEFAULT_MIX = {
+    "deposit": 35, "transfer": 35, "top_spenders": 5, "schedule_payment": 15, "cancel_payment": 10,
+}
+
+
+class Workload:
+
+
+    def __init__(self, n_accounts, n_ops, mix = None, max_delay = 1_000, initial_balance = 1_000,
+                 max_amount = 100, top_n = 10, seed = 0):
+        self.n_accounts = n_accounts
+        self.n_ops = n_ops
+        self.mix = dict(DEFAULT_MIX if mix is None else mix)
+        self.max_delay = max_delay
+        self.initial_balance = initial_balance
+        self.max_amount = max_amount
+        self.top_n = top_n
+        self.seed = seed
+
+    def config(self):
+        '''
+        return the parameters of the workload as a dict, e.g. to store with results.
+        '''
+        return {
+            "n_accounts": self.n_accounts, "n_ops": self.n_ops, "mix": self.mix,
+            "max_delay": self.max_delay, "initial_balance": self.initial_balance,
+            "max_amount": self.max_amount, "top_n": self.top_n, "seed": self.seed,
+        }
+
+    def account_id(self, i):
+        return f"account{i}"
+
+    def setup_ops(self):
+        for i in range(self.n_accounts):
+            yield ("create_account", 1, self.account_id(i))
+            if self.initial_balance:
+                yield ("deposit", 1, self.account_id(i), self.initial_balance)
+
+    def ops(self, timestamp = 2):
+        '''
+        yield n_ops operations, one per timestamp starting at timestamp.
+        payment ids assume the accounts of setup_ops exist and that no payment was
+        scheduled before the workload.
+        '''
+        rng = random.Random(self.seed)
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        # (payment id, account id) of every payment scheduled so far
+        scheduled = []
+        n = self.n_accounts
+
+        for timestamp in range(timestamp, timestamp + self.n_ops):
+            name = rng.choices(names, weights)[0]
+            if name == "cancel_payment" and not scheduled:
+                name = "schedule_payment"
+            source = self.account_id(rng.randrange(n))
+
+            if name == "deposit":
+                yield ("deposit", timestamp, source, rng.randint(1, self.max_amount))
+            elif name == "transfer":
+                yield ("transfer", timestamp, source, self.account_id(rng.randrange(n)), rng.randint(1, self.max_amount))
+            elif name == "top_spenders":
+                yield ("top_spenders", timestamp, self.top_n)
+            elif name == "schedule_payment":
+                scheduled.append((f"payment{len(scheduled) + 1}", source))
+                yield ("schedule_payment", timestamp, source, rng.randint(1, self.max_amount), rng.randint(0, self.max_delay))
+            elif name == "cancel_payment":
+                payment_id, account_id = scheduled[rng.randrange(len(scheduled))]
+                yield ("cancel_payment", timestamp, account_id, payment_id)
+            else:
+                raise ValueError(f"unsupported operation {name}")
@@ -0,0 +1,199 @@
+'''
+Write-ahead log and snapshots for the banking system.
+
+the log is a sequence of append-only segment files wal-<first sequence no>.log.
+every record is a header (payload length, crc32 of the payload, sequence number)
+followed by the pickled operation tuple. records are written in groups of
+group_size and the file is fsynced after every fsync_every groups, so a crash
+loses at most the operations that were not yet synced. a torn record at the
+end of the last segment is cut off when the log is reopened.
+
+snapshots snapshot-<sequence no>.snap hold the pickled ledger state as of that
+sequence number and are written through a memory-mapped file.
+'''
+
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+
+RECORD_HEADER = struct.Struct("<IIQ")
+SNAPSHOT_HEADER = struct.Struct("<8sQQI")
+SNAPSHOT_MAGIC = b"BANKSNAP"
+
+
+def segment_name(sequence_no):
+    return f"wal-{sequence_no:020d}.log"
+
+
+def snapshot_name(sequence_no):
+    return f"snapshot-{sequence_no:020d}.snap"
+
+
+def list_files(directory, prefix):
+    '''
+    return (sequence no, path) pairs of the files named prefix-<sequence no>.*,
+    in sequence order.
+    '''
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix + "-") and not name.endswith(".tmp"):
+            sequence_no = int(name[len(prefix) + 1:].split(".")[0])
+            found.append((sequence_no, os.path.join(directory, name)))
+    found.sort()
+    return found
+
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+
+
+    def __init__(self, directory, group_size = 256, fsync_every = 1):
+        self.directory = directory
+        self.group_size = group_size
+        self.fsync_every = fsync_every
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.unsynced_groups = 0
+        self.last_sequence_no = 0
+        self.file = None
+        os.makedirs(directory, exist_ok = True)
+
+    def read(self, after_sequence_no = 0):
+        '''
+        yield (sequence no, operation) for every record logged after the given
+        sequence number. a torn or corrupt record ends its segment; the rest of
+        that segment is discarded.
+        '''
+        for _, path in list_files(self.directory, "wal"):
+            with open(path, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                length, crc, sequence_no = RECORD_HEADER.unpack_from(data, offset)
+                start = offset + RECORD_HEADER.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                offset = start + length
+                self.last_sequence_no = max(self.last_sequence_no, sequence_no)
+                if sequence_no > after_sequence_no:
+                    yield sequence_no, pickle.loads(payload)
+            if offset < len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+
+    def open(self):
+        '''
+        open the latest segment for appending, or start the first one.
+        '''
+        segments = list_files(self.directory, "wal")
+        if segments:
+            path = segments[-1][1]
+        else:
+            path = os.path.join(self.directory, segment_name(self.last_sequence_no + 1))
+        self.file = open(path, "ab")
+
+    def append(self, op):
+        '''
+        add op to the log and return its sequence number. the record reaches the
+        file once a full group has been buffered, or on commit.
+        '''
+        self.last_sequence_no += 1
+        payload = pickle.dumps(op, protocol = pickle.HIGHEST_PROTOCOL)
+        self.buffer += RECORD_HEADER.pack(len(payload), zlib.crc32(payload), self.last_sequence_no)
+        self.buffer += payload
+        self.buffered += 1
+        if self.buffered >= self.group_size:
+            self.flush()
+        return self.last_sequence_no
+
+    def flush(self, sync = False):
+        '''
+        write the buffered group to the segment file. the file is fsynced when sync
+        is true or when fsync_every groups have been written since the last fsync.
+        fsync_every = 0 leaves syncing to the operating system.
+        '''
+        if self.buffered:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+            self.buffered = 0
+            self.unsynced_groups += 1
+        if self.unsynced_groups and (sync or (self.fsync_every and self.unsynced_groups >= self.fsync_every)):
+            os.fsync(self.file.fileno())
+            self.unsynced_groups = 0
+
+    def commit(self):
+        self.flush(sync = True)
+
+    def rotate(self):
+        '''
+        start a new segment after a snapshot and delete the segments it covers.
+        '''
+        self.commit()
+        self.file.close()
+        path = os.path.join(self.directory, segment_name(self.last_sequence_no + 1))
+        # with nothing logged since the last rotation, the new segment is the current one
+        old_segments = [old_path for _, old_path in list_files(self.directory, "wal") if old_path != path]
+        self.file = open(path, "ab")
+        for old_path in old_segments:
+            os.remove(old_path)
+        fsync_directory(self.directory)
+
+    def close(self):
+        if self.file:
+            self.commit()
+            self.file.close()
+            self.file = None
+
+
+def write_snapshot(directory, sequence_no, state):
+    '''
+    write state as of sequence_no to a new snapshot through a memory-mapped file
+    and remove the older snapshots.
+    '''
+    payload = pickle.dumps(state, protocol = pickle.HIGHEST_PROTOCOL)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, sequence_no, len(payload), zlib.crc32(payload))
+    size = len(header) + len(payload)
+
+    path = os.path.join(directory, snapshot_name(sequence_no))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w+b") as f:
+        f.truncate(size)
+        with mmap.mmap(f.fileno(), size) as m:
+            m[:len(header)] = header
+            m[len(header):] = payload
+            m.flush()
+    os.replace(tmp_path, path)
+    fsync_directory(directory)
+
+    for old_sequence_no, old_path in list_files(directory, "snapshot"):
+        if old_sequence_no < sequence_no:
+            os.remove(old_path)
+
+
+def load_snapshot(directory):
+    '''
+    return (sequence no, state) of the latest valid snapshot, or (0, None) if
+    there is none.
+    '''
+    for sequence_no, path in reversed(list_files(directory, "snapshot")):
+        if os.path.getsize(path) < SNAPSHOT_HEADER.size:
+            continue
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+            magic, header_sequence_no, length, crc = SNAPSHOT_HEADER.unpack_from(m)
+            payload = m[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + length]
+        if magic != SNAPSHOT_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+            continue
+        return header_sequence_no, pickle.loads(payload)
+    return 0, None
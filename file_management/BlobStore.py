@@ -0,0 +1,106 @@
+# Content-addressed store for CAD drawings
+#
+# every drawing is stored once under the sha256 of its bytes, in
+# <directory>/<first 2 hex digits>/<remaining hex digits>, so the same drawing
+# uploaded for several versions or stations takes the disk space of one copy.
+# designs keep the hash and read the bytes through a memory map when needed.
+# results derived from a blob, e.g. decoded or thumbnailed drawings, can be kept
+# in an LRU cache limited to cache_bytes.
+
+import hashlib
+import mmap
+import os
+import tempfile
+from collections import OrderedDict
+
+class BlobStore:
+
+    def __init__(self, directory, cache_bytes = 64 * 2**20):
+        self.directory = directory
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.cache = OrderedDict()
+        os.makedirs(directory, exist_ok = True)
+
+    # get the path of the blob with the given hash
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    # store data, bytes or the path of a file, and return its hash.
+    # data already in the store is not written again
+    def put(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            key = hashlib.sha256(data).hexdigest()
+            if key not in self:
+                self.write(key, [data])
+            return key
+
+        digest = hashlib.sha256()
+        with open(data, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        key = digest.hexdigest()
+        if key not in self:
+            with open(data, "rb") as f:
+                self.write(key, iter(lambda: f.read(2**20), b""))
+        return key
+
+    # write the blob to a temporary file first and rename it into place, so a
+    # blob file is always complete
+    def write(self, key, blocks):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for block in blocks:
+                    f.write(block)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # map the blob into memory. pages are only read when they are accessed
+    def open(self, key):
+        with open(self.path(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ))
+
+    # get the bytes of a blob
+    def read(self, key):
+        return self.cached(key, "bytes", bytes)
+
+    # get transform(memory map of the blob), computing it only if it is not cached.
+    # transform must return bytes or an object with a len, which is what the
+    # cached result is counted as against cache_bytes
+    def cached(self, key, name, transform):
+        cache_key = (key, name)
+        if cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            return self.cache[cache_key]
+
+        view = self.open(key)
+        try:
+            value = transform(view)
+        finally:
+            view.release()
+        size = len(value)
+        if size <= self.cache_bytes:
+            self.cache[cache_key] = value
+            self.cached_bytes += size
+            while self.cached_bytes > self.cache_bytes:
+                _, evicted = self.cache.popitem(last = False)
+                self.cached_bytes -= len(evicted)
+        return value
+
+    # total size of the stored blobs
+    def disk_bytes(self):
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
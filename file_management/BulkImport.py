@@ -0,0 +1,249 @@
+# Bulk import of delivery stations and designs from manifests
+#
+# a station manifest has one station per row with the columns key, address,
+# latitude, longitude, city and state. key is any identifier of the station
+# unique within the manifest, design manifests refer to stations by it. a design
+# manifest has one design per row with the columns station_key, drawing_file,
+# designer, uploader and optionally create_time and comments. manifests ending
+# in .jsonl hold one JSON object per line, any other manifest is read as csv.
+#
+# manifests are read as a stream and applied in batches of batch_size rows:
+# station ids are reserved a batch at a time, and the drawings of a batch are
+# hashed and copied into the blob store of the system by a pool of threads.
+# the designs and revisions of a batch share one revision timestamp.
+#
+# with a storage that supports mark_import_progress, e.g. SQLiteStore, every
+# batch is saved together with the number of manifest rows done and the ids of
+# the new stations, so an import that is interrupted can be run again and
+# continues after the last saved batch.
+#
+#     python BulkImport.py --db ds.db [--blobs DIR] stations.csv [designs.csv]
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import CADDesign
+import RevisionEvent
+
+class BulkImporter:
+
+    # progress is called with (manifest, rows done) after every batch
+    def __init__(self, system, batch_size = 1000, workers = 8, progress = None, max_bad_rows = 1000):
+        self.system = system
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress = progress
+        self.max_bad_rows = max_bad_rows
+        # station key -> ds id of the stations imported from station manifests
+        self.station_keys = {}
+        # (path, size, mtime) -> hash of the drawing files stored so far, so a file
+        # referenced by many designs is only hashed once
+        self.stored_files = {}
+        # rows skipped as (manifest, line no, row, reason)
+        self.bad_rows = []
+        self.no_bad_rows = 0
+
+    def resumable(self):
+        return hasattr(self.system.storage, "mark_import_progress")
+
+    def skip_row(self, manifest, line_no, row, reason):
+        self.no_bad_rows += 1
+        if len(self.bad_rows) < self.max_bad_rows:
+            self.bad_rows.append((manifest, line_no, row, reason))
+
+    # yield (line no, row dict) of a manifest
+    @staticmethod
+    def read_manifest(path):
+        with open(path, newline = "") as f:
+            if path.endswith(".jsonl"):
+                for line_no, line in enumerate(f, 1):
+                    if line.strip():
+                        yield line_no, line
+            else:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    yield reader.line_num, row
+
+    # yield lists of up to batch_size (line no, row) of a manifest, after the first rows_done rows
+    def read_batches(self, path, rows_done):
+        batch = []
+        rows = 0
+        for line_no, row in self.read_manifest(path):
+            rows += 1
+            if rows <= rows_done:
+                continue
+            batch.append((line_no, row))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def parse_row(row):
+        if isinstance(row, str):
+            row = json.loads(row)
+            if not isinstance(row, dict):
+                raise ValueError("expected a JSON object")
+        return row
+
+    @staticmethod
+    def optional_float(value):
+        if value is None or value == "":
+            return None
+        return float(value)
+
+    # import the stations of a manifest and return the number of rows done
+    def import_stations(self, path):
+        manifest = os.path.abspath(path)
+        rows_done = 0
+        if self.resumable():
+            rows_done, keys = self.system.storage.load_import_progress(manifest)
+            self.station_keys.update(keys)
+
+        for batch in self.read_batches(path, rows_done):
+            stations = []
+            # keys of the rows of the batch, added to station_keys once the batch is applied
+            batch_keys = set()
+            for line_no, row in batch:
+                try:
+                    row = self.parse_row(row)
+                    key = str(row.get("key") or "")
+                    if not key:
+                        raise ValueError("missing key")
+                    if key in self.station_keys or key in batch_keys:
+                        raise ValueError("duplicate key " + key)
+                    stations.append((key, row.get("address"), self.optional_float(row.get("latitude")),
+                                     self.optional_float(row.get("longitude")), row.get("city"), row.get("state")))
+                    batch_keys.add(key)
+                except (ValueError, TypeError, AttributeError) as e:
+                    self.skip_row(manifest, line_no, row, str(e))
+
+            new_keys = {}
+            ds_id = self.system.reserve_ds_ids(len(stations))
+            for key, address, latitude, longitude, city, state in stations:
+                self.system.add_ds_with_id(ds_id, address, latitude, longitude, city, state)
+                new_keys[key] = ds_id
+                self.station_keys[key] = ds_id
+                ds_id += 1
+            rows_done += len(batch)
+            self.save(manifest, rows_done, new_keys)
+        return rows_done
+
+    # import the designs of a manifest and return the number of rows done
+    def import_designs(self, path):
+        manifest = os.path.abspath(path)
+        rows_done = 0
+        if self.resumable():
+            rows_done, _ = self.system.storage.load_import_progress(manifest)
+
+        blob_store = self.system.blob_store
+        with ThreadPoolExecutor(self.workers) as pool:
+            for batch in self.read_batches(path, rows_done):
+                designs = []
+                for line_no, row in batch:
+                    try:
+                        row = self.parse_row(row)
+                        key = str(row.get("station_key") or "")
+                        if key not in self.station_keys:
+                            raise ValueError("unknown station " + key)
+                        ds = self.system.get_ds(self.station_keys[key])
+                        drawing_file = row.get("drawing_file")
+                        if not drawing_file:
+                            raise ValueError("missing drawing_file")
+                        designs.append((line_no, ds, drawing_file, row.get("designer"), row.get("uploader"),
+                                        self.optional_float(row.get("create_time")), row.get("comments") or None))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        self.skip_row(manifest, line_no, row, str(e))
+
+                # hash and copy the drawings in parallel, a missing file is skipped
+                def store(design):
+                    ds, drawing_file = design[1], design[2]
+                    if blob_store is None or ds.delta_history is not None:
+                        return None
+                    try:
+                        stat = os.stat(drawing_file)
+                        file_key = (drawing_file, stat.st_size, stat.st_mtime_ns)
+                        if file_key not in self.stored_files:
+                            self.stored_files[file_key] = blob_store.put(drawing_file)
+                        return self.stored_files[file_key]
+                    except OSError as e:
+                        return e
+                hashes = list(pool.map(store, designs))
+
+                batch_time = time.time()
+                for (line_no, ds, drawing_file, designer, uploader, create_time, comments), drawing_hash in zip(designs, hashes):
+                    if isinstance(drawing_hash, OSError):
+                        self.skip_row(manifest, line_no, drawing_file, str(drawing_hash))
+                        continue
+                    if ds.delta_history is not None:
+                        ds.upload_new_design(drawing_file, designer, uploader, create_time or batch_time, comments)
+                        continue
+                    self.add_design(ds, drawing_file, drawing_hash, designer, uploader, create_time or batch_time,
+                                    batch_time, comments)
+                rows_done += len(batch)
+                self.save(manifest, rows_done, {})
+        return rows_done
+
+    # add a design and its revision to a station, as upload_new_design does
+    def add_design(self, ds, drawing_file, drawing_hash, designer, uploader, create_time, revision_time, comments):
+        version_no = ds.latest_cad_version_no + 1
+        design = CADDesign.CADDesign(ds.id, drawing_file, designer, uploader, create_time)
+        design.set_version_no(version_no)
+        if drawing_hash is not None:
+            design.set_drawing_blob(self.system.blob_store, drawing_hash)
+        revision_no = ds.last_revision_no + 1
+        revision = RevisionEvent.Revision(ds.id, revision_time, drawing_file, uploader, comments)
+        revision.set_revision_no(revision_no)
+        ds.update_design(design, version_no, revision, revision_no)
+
+    def save(self, manifest, rows_done, new_keys):
+        if self.resumable():
+            self.system.storage.mark_import_progress(manifest, rows_done, new_keys)
+        self.system.save()
+        if self.progress is not None:
+            self.progress(manifest, rows_done)
+
+    # import a station manifest and then a design manifest, either may be None
+    def run(self, stations_path = None, designs_path = None):
+        if stations_path:
+            self.import_stations(stations_path)
+        if designs_path:
+            self.import_designs(designs_path)
+        return self.no_bad_rows, self.bad_rows
+
+
+def main():
+    import BlobStore
+    import DSSystem
+    import SQLiteStore
+
+    parser = argparse.ArgumentParser(description = "import delivery stations and designs from manifests")
+    parser.add_argument("--db", required = True, help = "sqlite database of the system, imports into it resume")
+    parser.add_argument("--blobs", help = "directory of the blob store the drawings are copied to")
+    parser.add_argument("--batch-size", type = int, default = 1000)
+    parser.add_argument("--workers", type = int, default = 8)
+    parser.add_argument("stations", help = "station manifest, csv or jsonl")
+    parser.add_argument("designs", nargs = "?", help = "design manifest, csv or jsonl")
+    args = parser.parse_args()
+
+    blob_store = BlobStore.BlobStore(args.blobs) if args.blobs else None
+    system = DSSystem.DSSystem(blob_store, storage = SQLiteStore.SQLiteStore(args.db))
+
+    def progress(manifest, rows_done):
+        print(os.path.basename(manifest) + ": " + str(rows_done) + " rows", flush = True)
+
+    importer = BulkImporter(system, args.batch_size, args.workers, progress)
+    no_bad_rows, bad_rows = importer.run(args.stations, args.designs)
+    print("Rows skipped: ", no_bad_rows)
+    for manifest, line_no, row, reason in bad_rows:
+        print(os.path.basename(manifest), line_no, reason, row)
+    system.storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ import time
 
 class CADDesign:
 
+    __slots__ = ("ds_id", "version_no", "drawing_file", "create_time", "designer", "uploader", "no_shelving_units",
+                 "no_conveyor_system", "drawing_hash", "blob_store", "delta_history", "content_hash")
+
     def __init__(self, ds_id, drawing_file, designer, uploader, create_time = time.time()):
         self.ds_id = ds_id
         self.version_no = None
@@ -13,6 +16,13 @@ class CADDesign:
         self.uploader = uploader
         self.no_shelving_units = 0
         self.no_conveyor_system = 0
+        # hash of the drawing in the blob store, None if the drawing was not stored
+        self.drawing_hash = None
+        self.blob_store = None
+        # DeltaHistory.DeltaHistory holding the drawing under the version no, if any
+        self.delta_history = None
+        # sha256 of the drawing, None until it is known
+        self.content_hash = None
     
     # set version no of the cad design
     def set_version_no(self, no):
@@ -23,5 +33,25 @@ class CADDesign:
     
     def set_conveyor_units(self, num):
         self.no_conveyor_system = num
-    
 
+    # reference the drawing stored in a blob store by its hash
+    def set_drawing_blob(self, blob_store, drawing_hash):
+        self.blob_store = blob_store
+        self.drawing_hash = drawing_hash
+
+    # reference the drawing stored in a delta history under the version no
+    def set_drawing_delta(self, delta_history):
+        self.delta_history = delta_history
+
+    # set the sha256 of the drawing
+    def set_content_hash(self, content_hash):
+        self.content_hash = content_hash
+
+    # get the bytes of the drawing, read from where it was stored if it was stored
+    def get_drawing(self):
+        if self.delta_history is not None:
+            return self.delta_history.read(self.version_no)
+        if self.drawing_hash is not None:
+            return self.blob_store.read(self.drawing_hash)
+        with open(self.drawing_file, "rb") as f:
+            return f.read()
@@ -0,0 +1,98 @@
+# Change feed of the delivery station system
+#
+# the stations, projects and the system emit an event for every change made to
+# them. an event is a tuple (seq, time, kind, ds id, data), seq numbers the
+# events from 1. the kinds and their data are
+#     station          (state, city) of a new station
+#     region           ((old state, old city), (state, city)) of a moved station
+#     design           (version no, revision no) of a new latest design
+#     metrics          (no_shelving_units, no_conveyor_system) of the latest design
+#     project_added    (project id, status) of a project added to the station
+#     project_removed  (project id,) of a project removed from the station
+#     active_project   (project id, active) when a project becomes (in)active at the station
+#     project_status   (project id, old status, new status), ds id is None
+#
+# subscribers are called with every event as it is emitted, after the change is
+# made. a subscriber that raises is logged and skipped, the change stands. other
+# consumers read the events after the last seq they have seen, see read() and
+# follow(). the feed keeps the last capacity events, reading events that are no
+# longer kept raises a ValueError, after which a consumer has to start over from
+# the current state of the system.
+#
+# a feed is kept in memory only. a storage, e.g. SQLiteStore, keeps its last seq
+# and resumes the numbering after it when the system is opened again. the events
+# before are no longer kept, and a seq past the last one, e.g. seen before a
+# crash, raises a ValueError as well.
+
+import contextlib
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+class ChangeFeed:
+
+    def __init__(self, capacity = 1000000):
+        self.capacity = capacity
+        self.events = []
+        # seq of events[0] and of the last event
+        self.first_seq = 1
+        self.last_seq = 0
+        self.subscribers = []
+        self.pause_depth = 0
+
+    def emit(self, kind, ds_id, data):
+        if self.pause_depth:
+            return
+        self.last_seq += 1
+        event = (self.last_seq, time.time(), kind, ds_id, data)
+        self.events.append(event)
+        # drop the oldest events in bulk, once twice capacity are kept
+        if self.capacity is not None and len(self.events) >= 2 * self.capacity:
+            del self.events[:len(self.events) - self.capacity]
+            self.first_seq = self.last_seq - len(self.events) + 1
+        for subscriber in self.subscribers:
+            try:
+                subscriber(event)
+            except Exception:
+                log.exception("change feed subscriber %r failed on event %r", subscriber, event)
+
+    # continue the numbering after last_seq, e.g. the last seq of the feed before a restart
+    def resume(self, last_seq):
+        self.events = []
+        self.first_seq = last_seq + 1
+        self.last_seq = last_seq
+
+    # call subscriber with every event emitted from now on
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    # changes made within the block emit no events, e.g. while loading the system
+    @contextlib.contextmanager
+    def paused(self):
+        self.pause_depth += 1
+        try:
+            yield self
+        finally:
+            self.pause_depth -= 1
+
+    # get up to limit events after seq after_seq
+    def read(self, after_seq = 0, limit = None):
+        if after_seq + 1 < self.first_seq:
+            raise ValueError("events after " + str(after_seq) + " are no longer kept, the oldest kept is " +
+                             str(self.first_seq))
+        if after_seq > self.last_seq:
+            raise ValueError("seq " + str(after_seq) + " is past the last event " + str(self.last_seq))
+        start = after_seq + 1 - self.first_seq
+        end = len(self.events) if limit is None else start + limit
+        return self.events[start:end]
+
+    # yield the events after seq after_seq up to the last one, read batch_size at a time
+    def follow(self, after_seq = 0, batch_size = 1000):
+        events = self.read(after_seq, batch_size)
+        while events:
+            yield from events
+            events = self.read(events[-1][0], batch_size)
@@ -0,0 +1,271 @@
+# Columnar design and revision logs of a delivery station
+#
+# a station used to keep one CADDesign and one Revision object per upload in
+# dicts keyed by version no and revision no. the logs below keep the fields of
+# every entry in append-only columns instead: numbers in arrays, designer,
+# uploader and revisor names as indexes into a shared string table, and other
+# values in plain lists. versions and revisions are numbered 1..n, so entry no
+# is at index no - 1.
+#
+# the logs support the dict operations the stations use. reading an entry
+# returns a small view, a CADDesign or Revision whose fields read and write the
+# columns, so design.set_shelving_units(n) changes the log.
+#
+# the fields are not validated, as on CADDesign and Revision. a value an array
+# column cannot hold as it is, e.g. a string, a float count or an int time,
+# turns that column of the log into a list, so every value reads back as it
+# was set. a log has a fixed cost of about 700 bytes for its columns, so the logs
+# take less memory than dicts of CADDesign and Revision objects from about 4
+# uploads per station on, and under a third from a few hundred on, see
+# benchmark.py logs.
+
+import math
+from array import array
+
+import CADDesign
+import RevisionEvent
+
+class StringTable:
+
+    def __init__(self):
+        # index 0 is None
+        self.strings = [None]
+        self.indexes = {None: 0}
+
+    def intern(self, s):
+        index = self.indexes.get(s)
+        if index is None:
+            index = len(self.strings)
+            self.indexes[s] = index
+            self.strings.append(s)
+        return index
+
+    def __getitem__(self, index):
+        return self.strings[index]
+
+# names of designers, uploaders and revisors of every log
+STRINGS = StringTable()
+
+# float column values, None is stored as nan
+def to_float(value):
+    return math.nan if value is None else value
+
+def from_float(value):
+    return None if value != value else value
+
+# the type of the values each array column holds
+COLUMN_TYPES = {'q': int, 'd': float, 'I': int}
+
+# set entry index of column name of log to value, turning an array column that
+# cannot hold value as it is into a list
+def set_value(log, name, index, value):
+    column = getattr(log, name)
+    if type(column) is array:
+        if type(value) is COLUMN_TYPES[column.typecode]:
+            try:
+                column[index] = value
+                return
+            except OverflowError:
+                pass
+        column = column.tolist()
+        setattr(log, name, column)
+    column[index] = value
+
+class EntryLog:
+
+    __slots__ = ("ds_id", "strings")
+
+    def __init__(self, ds_id, strings = None):
+        self.ds_id = ds_id
+        self.strings = STRINGS if strings is None else strings
+
+    def __contains__(self, no):
+        return isinstance(no, int) and 1 <= no <= len(self)
+
+    def __iter__(self):
+        return iter(range(1, len(self) + 1))
+
+    def keys(self):
+        return range(1, len(self) + 1)
+
+    def values(self):
+        for no in self.keys():
+            yield self[no]
+
+    def items(self):
+        for no in self.keys():
+            yield no, self[no]
+
+    def get(self, no, default = None):
+        if no not in self:
+            return default
+        return self[no]
+
+    def __getitem__(self, no):
+        if no not in self:
+            raise KeyError(no)
+        return self.view_class(self, no - 1)
+
+    # entries are appended as no len + 1, or overwrite an existing entry
+    def __setitem__(self, no, entry):
+        if no == len(self) + 1:
+            self.append(entry)
+        elif no in self:
+            self.write(no - 1, entry)
+        else:
+            raise KeyError("entries of a log are numbered 1..n, cannot set " + str(no))
+
+class DesignLog(EntryLog):
+
+    __slots__ = ("drawing_files", "create_times", "designers", "uploaders", "shelving_units", "conveyor_units",
+                 "drawing_hashes", "content_hashes", "in_delta_history", "blob_store", "delta_history")
+
+    def __init__(self, ds_id, strings = None):
+        super().__init__(ds_id, strings)
+        self.drawing_files = []
+        self.create_times = array('d')
+        self.designers = array('I')
+        self.uploaders = array('I')
+        self.shelving_units = array('q')
+        self.conveyor_units = array('q')
+        self.drawing_hashes = []
+        self.content_hashes = []
+        # 1 for the designs whose drawing is in delta_history
+        self.in_delta_history = bytearray()
+        self.blob_store = None
+        self.delta_history = None
+
+    def __len__(self):
+        return len(self.drawing_files)
+
+    def append(self, design):
+        self.drawing_files.append(None)
+        self.create_times.append(0.0)
+        self.designers.append(0)
+        self.uploaders.append(0)
+        self.shelving_units.append(0)
+        self.conveyor_units.append(0)
+        self.drawing_hashes.append(None)
+        self.content_hashes.append(None)
+        self.in_delta_history.append(0)
+        self.write(len(self) - 1, design)
+
+    def write(self, index, design):
+        self.drawing_files[index] = design.drawing_file
+        set_value(self, "create_times", index, to_float(design.create_time))
+        self.designers[index] = self.strings.intern(design.designer)
+        self.uploaders[index] = self.strings.intern(design.uploader)
+        set_value(self, "shelving_units", index, design.no_shelving_units)
+        set_value(self, "conveyor_units", index, design.no_conveyor_system)
+        self.drawing_hashes[index] = design.drawing_hash
+        self.content_hashes[index] = design.content_hash
+        if design.blob_store is not None:
+            self.blob_store = design.blob_store
+        if design.delta_history is not None:
+            self.delta_history = design.delta_history
+            self.in_delta_history[index] = 1
+
+class RevisionLog(EntryLog):
+
+    __slots__ = ("revise_times", "new_designs", "revisors", "comments")
+
+    def __init__(self, ds_id, strings = None):
+        super().__init__(ds_id, strings)
+        self.revise_times = array('d')
+        self.new_designs = []
+        self.revisors = array('I')
+        self.comments = []
+
+    def __len__(self):
+        return len(self.new_designs)
+
+    def append(self, revision):
+        self.revise_times.append(0.0)
+        self.new_designs.append(None)
+        self.revisors.append(0)
+        self.comments.append(None)
+        self.write(len(self) - 1, revision)
+
+    def write(self, index, revision):
+        set_value(self, "revise_times", index, to_float(revision.revise_time))
+        self.new_designs[index] = revision.new_design
+        self.revisors[index] = self.strings.intern(revision.revisor)
+        self.comments[index] = revision.comment
+
+# property reading and writing column name of the log of a view, with the given
+# conversions between field values and column values
+def column_property(name, load = None, store = None):
+    def get(view):
+        value = getattr(view.log, name)[view.index]
+        return value if load is None else load(view, value)
+
+    def set(view, value):
+        set_value(view.log, name, view.index, value if store is None else store(view, value))
+    return property(get, set)
+
+def string_property(name):
+    return column_property(name, lambda view, value: view.log.strings[value],
+                           lambda view, value: view.log.strings.intern(value))
+
+def float_property(name):
+    return column_property(name, lambda view, value: from_float(value), lambda view, value: to_float(value))
+
+def read_only(get):
+    def set(view, value):
+        if value != get(view):
+            raise AttributeError("cannot change the number of a log entry")
+    return property(get, set)
+
+class DesignView(CADDesign.CADDesign):
+
+    __slots__ = ("log", "index")
+
+    def __init__(self, log, index):
+        self.log = log
+        self.index = index
+
+    ds_id = read_only(lambda view: view.log.ds_id)
+    version_no = read_only(lambda view: view.index + 1)
+    drawing_file = column_property("drawing_files")
+    create_time = float_property("create_times")
+    designer = string_property("designers")
+    uploader = string_property("uploaders")
+    no_shelving_units = column_property("shelving_units")
+    no_conveyor_system = column_property("conveyor_units")
+    drawing_hash = column_property("drawing_hashes")
+    content_hash = column_property("content_hashes")
+
+    @property
+    def blob_store(self):
+        return self.log.blob_store
+
+    @blob_store.setter
+    def blob_store(self, blob_store):
+        self.log.blob_store = blob_store
+
+    @property
+    def delta_history(self):
+        return self.log.delta_history if self.log.in_delta_history[self.index] else None
+
+    @delta_history.setter
+    def delta_history(self, delta_history):
+        self.log.delta_history = delta_history
+        self.log.in_delta_history[self.index] = delta_history is not None
+
+class RevisionView(RevisionEvent.Revision):
+
+    __slots__ = ("log", "index")
+
+    def __init__(self, log, index):
+        self.log = log
+        self.index = index
+
+    ds_id = read_only(lambda view: view.log.ds_id)
+    revision_no = read_only(lambda view: view.index + 1)
+    revise_time = float_property("revise_times")
+    new_design = column_property("new_designs")
+    revisor = string_property("revisors")
+    comment = column_property("comments")
+
+DesignLog.view_class = DesignView
+RevisionLog.view_class = RevisionView
@@ -1,32 +1,296 @@
 # Delivery Station System
 
+import ChangeFeed
 import DeliveryStation
+import DeltaHistory
+import MetricsHistory
 import Project
-from IPython.display import display, Image
+import RevisionIndex
+import SpatialIndex
+import base64
+import csv
 import datetime
-import pandas as pd
+import time
 
 class DSSystem:
 
-    def __init__(self) -> None:
+    # drawings of new designs are stored in blob_store, a BlobStore.BlobStore, if given.
+    # with a delta_keyframe_interval, every station instead keeps its drawings as
+    # deltas in a DeltaHistory.DeltaHistory with a keyframe every that many versions.
+    # with a storage, e.g. a SQLiteStore.SQLiteStore, the stations and projects it
+    # holds are loaded and the changes are written to it by save().
+    # with previews, a Previews.PreviewStore, a thumbnail of every new design is
+    # rendered when it is uploaded and the designs are displayed by their thumbnails
+    def __init__(self, blob_store = None, delta_keyframe_interval = None, storage = None, previews = None) -> None:
+        self.blob_store = blob_store
+        self.delta_keyframe_interval = delta_keyframe_interval
         self.no_of_stations = 0
         self.ds_id= {}
+        # state -> city -> {ds id: ds}
         self.ds_by_region = {}
+        self.spatial_index = SpatialIndex.SpatialIndex()
+        # history of the key metric updates of every station
+        self.metrics_history = MetricsHistory.MetricsHistory()
+        # revisions of every station by time, revisor, station and comment words
+        self.revision_index = RevisionIndex.RevisionIndex()
         self.no_of_projects = 0
         self.project_list = {}
+        # status -> {project id: project}, kept up to date by the projects
+        self.projects_by_status = {}
+        # events of every change to the stations and projects, see ChangeFeed
+        self.change_feed = ChangeFeed.ChangeFeed()
+        self.previews = previews
+        if previews is not None:
+            self.change_feed.subscribe(self.preview_new_design)
+            previews.set_storage(storage)
+        self.storage = storage
+        if storage is not None:
+            with self.change_feed.paused():
+                storage.load(self)
 
     def get_no_stations(self):
         return self.no_of_stations
     
     def get_ds(self, id):
         return self.ds_id[id]
-    
+
+    # the methods below take their arguments directly and neither prompt nor
+    # print, so they can be used from batch jobs without a notebook.
+    # the interactive methods further down prompt for the same arguments.
+
+    # write the changes made since the last save to the storage
+    def save(self):
+        if self.storage is not None:
+            self.storage.commit()
+
+    # get up to limit change events after seq after_seq, see ChangeFeed
+    def changes(self, after_seq = 0, limit = None):
+        return self.change_feed.read(after_seq, limit)
+
+    # add a delivery station and return it
+    def add_ds(self, address = None, latitude = None, longitude = None, city = None, state = None):
+        return self.add_ds_with_id(self.reserve_ds_ids(1), address, latitude, longitude, city, state)
+
+    # reserve a block of n station ids and return the first one
+    def reserve_ds_ids(self, n):
+        first_id = self.no_of_stations + 1
+        self.no_of_stations += n
+        return first_id
+
+    # add a delivery station under an id reserved with reserve_ds_ids and return it
+    def add_ds_with_id(self, ds_id, address = None, latitude = None, longitude = None, city = None, state = None):
+        new_ds = self.make_ds(ds_id, latitude, longitude, address, city, state)
+        self.register_ds(new_ds)
+        self.change_feed.emit("station", ds_id, (state, city))
+        if self.storage is not None:
+            new_ds.set_storage(self.storage)
+            self.storage.mark_station(new_ds)
+        return new_ds
+
+    # create a delivery station object using the drawing stores of the system
+    def make_ds(self, ds_id, latitude = None, longitude = None, address = None, city = None, state = None):
+        delta_history = None
+        if self.delta_keyframe_interval:
+            delta_history = DeltaHistory.DeltaHistory(self.delta_keyframe_interval)
+        return DeliveryStation.DeliveryStation(ds_id, latitude, longitude, address, city, state,
+                                               self.blob_store, delta_history)
+
+    # add a delivery station object to the system and its indexes
+    def register_ds(self, ds):
+        self.ds_id[ds.id] = ds
+        self.no_of_stations = max(self.no_of_stations, ds.id)
+        ds.set_spatial_index(self.spatial_index)
+        ds.set_metrics_history(self.metrics_history)
+        ds.set_revision_index(self.revision_index)
+        ds.set_change_feed(self.change_feed)
+        self.ds_by_region.setdefault(ds.state, {}).setdefault(ds.city, {})[ds.id] = ds
+
+    # set the location of a delivery station
+    def set_ds_location(self, ds_id, latitude, longitude):
+        self.get_ds(ds_id).set_location(longitude, latitude)
+
+    # move a delivery station to another city and state
+    def set_ds_region(self, ds_id, city, state):
+        ds = self.get_ds(ds_id)
+        old_region = (ds.state, ds.city)
+        cities = self.ds_by_region[ds.state]
+        del cities[ds.city][ds_id]
+        if not cities[ds.city]:
+            del cities[ds.city]
+            if not cities:
+                del self.ds_by_region[ds.state]
+        ds.city = city
+        ds.state = state
+        self.ds_by_region.setdefault(state, {}).setdefault(city, {})[ds_id] = ds
+        self.metrics_history.move_station(ds_id, state, city)
+        self.change_feed.emit("region", ds_id, (old_region, (state, city)))
+        if self.storage is not None:
+            self.storage.mark_station(ds)
+
+    # get the delivery stations of a state, or of a city of the state
+    def ds_in_region(self, state, city = None):
+        cities = self.ds_by_region.get(state, {})
+        if city is not None:
+            return list(cities.get(city, {}).values())
+        return [ds for stations in cities.values() for ds in stations.values()]
+
+    # get [(distance km, ds)] of the k delivery stations nearest to a location
+    def nearest_ds(self, latitude, longitude, k = 1):
+        return [(d, self.ds_id[ds_id]) for d, ds_id in self.spatial_index.nearest(latitude, longitude, k)]
+
+    # get [(distance km, ds)] of the delivery stations within radius_km of a location, nearest first
+    def ds_within_radius(self, latitude, longitude, radius_km):
+        return [(d, self.ds_id[ds_id]) for d, ds_id in self.spatial_index.within_radius(latitude, longitude, radius_km)]
+
+    # get the delivery stations inside a latitude / longitude box
+    def ds_within_box(self, min_lat, min_lon, max_lat, max_lon):
+        return [self.ds_id[ds_id] for ds_id in self.spatial_index.within_box(min_lat, min_lon, max_lat, max_lon)]
+
+    # set the address of a delivery station and return the old address
+    def set_ds_address(self, ds_id, address):
+        ds = self.get_ds(ds_id)
+        old_address = ds.get_address()
+        ds.set_address(address)
+        return old_address
+
+    # upload a new design for a delivery station and return it
+    def upload_ds_design(self, ds_id, drawing_file, designer, uploader, create_time = None, comments = None):
+        return self.get_ds(ds_id).upload_new_design(drawing_file, designer, uploader, create_time, comments)
+
+    # get the latest design of a delivery station, None if no design was uploaded
+    def ds_latest_design(self, ds_id):
+        return self.get_ds(ds_id).get_latest_design()
+
+    # get a past design of a delivery station by version no, or all of them by version no
+    def ds_past_designs(self, ds_id, version_no = None):
+        return self.get_ds(ds_id).get_past_design(version_no)
+
+    # start rendering the preview of a new design, called with the events of the change feed
+    def preview_new_design(self, event):
+        _, _, kind, ds_id, data = event
+        if kind == "design":
+            self.previews.submit(self.ds_id[ds_id].cad_file_log[data[0]])
+
+    # get [(version no, PNG bytes or None)] of the previews of all designs of a ds
+    def ds_design_previews(self, ds_id):
+        return self.previews.gallery(self.ds_past_designs(ds_id).values())
+
+    # yield the revisions of the delivery stations by revisor, of a station, whose
+    # comment contains every word of text, made from time_from to time_to, or any
+    # combination of those, oldest first or newest first
+    def find_revisions(self, revisor = None, ds_id = None, text = None, time_from = None, time_to = None,
+                       newest_first = False):
+        for hit_ds_id, revision_no, _, _ in self.revision_index.search(revisor, ds_id, text, time_from, time_to,
+                                                                        newest_first):
+            yield self.ds_id[hit_ds_id].revision_logs[revision_no]
+
+    # get a page of up to page_size revisions of find_revisions, starting after
+    # cursor, and the cursor of the next page, None after the last page
+    def find_revisions_page(self, page_size = 100, cursor = None, revisor = None, ds_id = None, text = None,
+                            time_from = None, time_to = None, newest_first = False):
+        hits, next_cursor = self.revision_index.page(page_size, cursor, revisor, ds_id, text, time_from, time_to,
+                                                     newest_first)
+        return [self.ds_id[hit_ds_id].revision_logs[revision_no] for hit_ds_id, revision_no, _, _ in hits], next_cursor
+
+    # create a project over the given delivery stations and return it
+    def add_project(self, name, ds_ids, manager = None):
+        new_project_id = self.no_of_projects + 1
+        new_project = Project.Project(new_project_id, name, manager)
+        new_project.set_status_index(self.projects_by_status)
+        new_project.change_feed = self.change_feed
+        if self.storage is not None:
+            new_project.storage = self.storage
+            self.storage.mark_project(new_project)
+        for ds_id in ds_ids:
+            ds = self.ds_id[ds_id]
+            new_project.add_ds(ds)
+            ds.add_new_project(new_project)
+        self.project_list[new_project_id] = new_project
+        self.no_of_projects += 1
+        return new_project
+
+    # get all active projects
+    def active_projects(self):
+        return list(self.projects_by_status.get(1, {}).values())
+
+    # get the ids of all active projects
+    def active_project_ids(self):
+        return list(self.projects_by_status.get(1, {}))
+
+    # get active projects of a specific ds
+    def ds_active_projects(self, ds_id):
+        return self.ds_id[ds_id].get_active_project_list()
+
+    # get the ids of the active projects of a specific ds
+    def ds_active_project_ids(self, ds_id):
+        return self.ds_id[ds_id].get_active_project_ids()
+
+    # get the ids of the projects of a specific ds which have not been cancelled
+    def ds_project_ids(self, ds_id):
+        return list(self.ds_id[ds_id].get_project_list())
+
+    # set the status of a project, 1 for active and 0 for cancelled
+    def set_project_status(self, project_id, status):
+        self.project_list[project_id].update_project_status(status)
+
+    # get key metrics of the latest design of a ds
+    def ds_key_metrics(self, ds_id):
+        return self.ds_id[ds_id].get_key_metrics()
+
+    # get [(bucket start time, count, sum, min, max, last)] of a key metric of a ds
+    # per hour, day or month from time_from to time_to
+    def ds_metrics_window(self, ds_id, time_from, time_to, granularity = "day", metric = "no_conveyor_system"):
+        series = self.get_ds(ds_id).get_metrics_history()
+        if series is None:
+            return []
+        return series.window(time_from, time_to, granularity, metric)
+
+    # same for the total of a key metric over all delivery stations, or over the
+    # stations of a state or of a city of the state
+    def region_metrics_window(self, time_from, time_to, granularity = "day", metric = "no_conveyor_system",
+                              state = None, city = None):
+        return self.metrics_history.region_window(time_from, time_to, granularity, metric, state, city)
+
+    # get {state: {metric: total}} of the current key metrics
+    def key_metrics_by_state(self):
+        return self.metrics_history.totals_by_state()
+
+    # get {(state, city): {metric: total}} of the current key metrics, of one state if given
+    def key_metrics_by_city(self, state = None):
+        return self.metrics_history.totals_by_city(state)
+
+    # get [(value, ds)] of the k delivery stations with the highest current value of a key metric
+    def top_ds_by_key_metric(self, k, metric = "no_conveyor_system"):
+        return [(value, self.ds_id[ds_id]) for value, ds_id in self.metrics_history.top_stations(k, metric)]
+
+    # display a design in the notebook. IPython is only imported here, so it is
+    # not loaded unless something is rendered
+    def render_design(self, design, width = 500, height = 500):
+        from IPython.display import display, Image
+        preview = self.previews.get(design) if self.previews is not None else None
+        if preview is not None:
+            display(Image(data = preview))
+        elif design.drawing_hash is not None or design.delta_history is not None:
+            display(Image(data = design.get_drawing(), width = width, height = height))
+        else:
+            display(Image(design.drawing_file, width = width, height = height))
+
+    # display the previews of designs side by side in the notebook, without reading their drawings
+    def render_gallery(self, designs):
+        from IPython.display import display, HTML
+        figures = []
+        for version_no, preview in self.previews.gallery(designs):
+            if preview is None:
+                image = "no preview"
+            else:
+                image = '<img src="data:image/png;base64,' + base64.b64encode(preview).decode() + '"/>'
+            figures.append('<figure style="display: inline-block; margin: 4px">' + image +
+                           "<figcaption>version " + str(version_no) + "</figcaption></figure>")
+        display(HTML("".join(figures)))
+
     def create_new_ds(self):
         addr = input("Please enter the address of the delivery station: ")
-        new_ds_id = self.no_of_stations + 1
-        new_ds = DeliveryStation.DeliveryStation(new_ds_id, address = addr)
-        self.ds_id[new_ds_id] = new_ds
-        self.no_of_stations += 1
+        new_ds = self.add_ds(address = addr)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("A new delivery station has been created in the system.")
         print("The id of the new delivery station is: ", new_ds.id)
@@ -34,22 +298,16 @@ class DSSystem:
         return new_ds
     
     def create_ds_list(self):
-        new_ds_id = self.no_of_stations + 1
-        new_ds = DeliveryStation.DeliveryStation(new_ds_id)
-        self.ds_id[new_ds_id] = new_ds
-        self.no_of_stations += 1
-        return new_ds
+        return self.add_ds()
 
     def set_ds_cat(self, ds_id, cat):
-        ds = self.ds_id[ds_id]
-        new_design = ds.upload_new_design(cat, "emp1", "emp2")
+        self.upload_ds_design(ds_id, cat, "emp1", "emp2")
 
     
     def update_ds_address_info(self):
         ds_id = int(input("Please enter the id of the delivery station that you want to update information for: "))
-        old_address = self.get_ds(ds_id).get_address()
         new_address = input("Please enter the new address of the delivery station: ")
-        self.get_ds(ds_id).set_address(new_address)
+        old_address = self.set_ds_address(ds_id, new_address)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("The old address of the ds station is: ", old_address)
         print("The new address of the ds station is: ", new_address)
@@ -57,8 +315,7 @@ class DSSystem:
 
     def get_ds_latest_design(self):
         ds_id = int(input("Please enter the id of the delivery station: "))
-        ds = self.get_ds(ds_id)
-        latest_design = ds.get_latest_design()
+        latest_design = self.ds_latest_design(ds_id)
         if not latest_design:
             print("------- ------ ------- ------ ------- ------ ------- ------")
             print("No design file has been uploaded for the DS")
@@ -67,16 +324,14 @@ class DSSystem:
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("The latest design version of the DS is: ", latest_design.version_no)
         print("The latest design of the DS: ")
-        im = Image(latest_design.drawing_file, width = 500, height = 500)
-        display(im)
+        self.render_design(latest_design)
 
     def update_ds_latest_design(self):
         ds_id = int(input("Please enter the id of the delivery station: "))
-        ds = self.get_ds(ds_id)
         new_design_input = input("Please upload the new design: ")
         designer = input("Please enter the name of the designer: ")
         uploader = input("Please enter the name of the uploader: ")
-        new_design = ds.upload_new_design(new_design_input, designer, uploader)
+        new_design = self.upload_ds_design(ds_id, new_design_input, designer, uploader)
         new_design_version_no = new_design.version_no
 
         print("------- ------ ------- ------ ------- ------ ------- ------")
@@ -86,25 +341,24 @@ class DSSystem:
         print("The design was uploaded at: ", datetime.datetime.fromtimestamp(new_design.create_time).strftime('%Y-%m-%d %H:%M:%S'))
         print("The version no of the latest design is: ", new_design_version_no)
         print("The latest design of the DS is:" )
-        im = Image(new_design.drawing_file, width = 500, height = 500)
-        display(im)
+        self.render_design(new_design)
 
     def get_ds_all_past_design(self):
         ds_id = int(input("Please enter the id of the delivery station: "))
-        ds = self.get_ds(ds_id)
-        past_design = ds.get_past_design()
+        past_design = self.ds_past_designs(ds_id)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Past Designs for DS ", ds_id, ": ")
         print("Design Version No\t\t Design Doc\t\t\t\t\t\t  Upload Time")
         for v_no in past_design.keys():
             d = past_design[v_no]
             print(v_no, '\t\t', d.drawing_file, '\t\t', datetime.datetime.fromtimestamp(d.create_time).strftime('%Y-%m-%d %H:%M:%S'))
+        if self.previews is not None:
+            self.render_gallery(past_design.values())
 
     def get_ds_specific_past_design(self):
         ds_id = int(input("Please enter the id of the delivery station: "))
-        ds = self.get_ds(ds_id)
         v_no = int(input("Please enter the design version no: "))
-        past_design = ds.get_past_design()[v_no]
+        past_design = self.ds_past_designs(ds_id, v_no)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Design Version" + str(v_no) + "for DS ", str(ds_id), ": ")
 
@@ -112,32 +366,20 @@ class DSSystem:
         print("The uploader is: ", past_design.uploader)
         print("The design was uploaded at: ", datetime.datetime.fromtimestamp(past_design.create_time).strftime('%Y-%m-%d %H:%M:%S'))
         print("The design of the DS is:" )
-        im = Image(past_design.drawing_file, width = 500, height = 500)
-        display(im)
+        self.render_design(past_design)
 
     def create_project(self):
-        new_project_id = self.no_of_projects + 1
         name = input("Please enter the name of the project: ")
         ds_list_input = input("Please enter delivery station ids included in this project: ").strip()
-        new_project = Project.Project(new_project_id, name)
-        for i in ds_list_input.split(" "):
-            ds_id = int(i)
-            ds = self.ds_id[ds_id]
-            new_project.add_ds(ds)
-            ds.add_new_project(new_project)
-        self.project_list[new_project_id] = new_project
-        self.no_of_projects += 1
+        new_project = self.add_project(name, [int(i) for i in ds_list_input.split(" ")])
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("The new project, ", name, "has been created in the system.")
-        print("The project id is ", new_project_id)
+        print("The project id is ", new_project.project_id)
         print("DS included in the projects are:", new_project.get_ds_list())
 
     # get all active projects
     def get_active_project_list(self):
-        active_list = []
-        for project in self.project_list.values():
-            if project.get_project_status() == 1:
-                active_list.append(project)
+        active_list = self.active_projects()
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Current Active Projects:")
         print("Project ID\t\t   Project Name")
@@ -147,8 +389,7 @@ class DSSystem:
     # get active projects of a specific ds
     def get_ds_active_project_list(self):
         ds_id = int(input("Please enter the id of the delivery station: "))
-        ds = self.ds_id[ds_id]
-        active_list = ds.get_active_project_list()
+        active_list = self.ds_active_projects(ds_id)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Current Active Projects of DS ", ds_id, ":")
         print("Project ID\t\t   Project Name")
@@ -161,37 +402,98 @@ class DSSystem:
         new_status_input = input("Please enter the new status of the project: ")
         if new_status_input == 'cancelled':
             new_status = 0
-        project = self.project_list[project_id]
-        project.update_project_status(new_status)
+        self.set_project_status(project_id, new_status)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Project ", project_id, "status changed")
     
 
     def get_ds_key_metrics(self):
         ds_id = int(input("Please enter the id of the delivery station: "))
-        ds = self.ds_id[ds_id]
-        key_metrics = ds.get_key_metrics()
+        key_metrics = self.ds_key_metrics(ds_id)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Key Metrics of DS ", ds_id, ":")
         for k, v in key_metrics.items():
             print(k, ": ", v)       
 
 
-    def update_ds_key_metrics_from_csv(self, csv_file):
-        metric_df = pd.read_csv(csv_file)
-        metric_df.apply(lambda row: self.update_metric_helper(row), axis = 1)
+    # update key metrics of the latest designs from a csv file with the columns
+    # ds_id, no_shelving_units and no_conveyor_system.
+    # the file is read in chunks of chunk_size rows, within a chunk only the last
+    # row of each ds is applied. rows that cannot be applied are skipped and
+    # returned as (line no, row, reason), at most max_bad_rows of them are kept.
+    # the updates are recorded in the metrics history as of timestamp, default now
+    def update_ds_key_metrics_from_csv(self, csv_file, chunk_size = 10000, max_bad_rows = 1000, timestamp = None):
+        no_bad_rows, bad_rows = self.load_ds_key_metrics(csv_file, chunk_size, max_bad_rows, timestamp)
         print("------- ------ ------- ------ ------- ------ ------- ------")
         print("Key metrics have been updated")
-    
-    def update_metric_helper(self, row): 
-        ds_id = row["ds_id"]
-        shelving_unit = row["no_shelving_units"]
-        conveyor_unit = row['no_conveyor_system']
-        ds = self.get_ds(ds_id)
-        cad = ds.get_latest_design()
-        cad.set_shelving_units(shelving_unit)
-        cad.set_conveyor_units(conveyor_unit)
-    
-    
+        print("Rows skipped: ", no_bad_rows)
+        return bad_rows
+
+    # headless version of update_ds_key_metrics_from_csv, returns the number of
+    # skipped rows and the first max_bad_rows of them
+    def load_ds_key_metrics(self, csv_file, chunk_size = 10000, max_bad_rows = 1000, timestamp = None):
+        if timestamp is None:
+            timestamp = time.time()
+        bad_rows = []
+        no_bad_rows = 0
+        with self.metrics_history.batch():
+            for chunk, chunk_bad_rows in self.read_metric_chunks(csv_file, chunk_size):
+                for bad_row in chunk_bad_rows:
+                    no_bad_rows += 1
+                    if len(bad_rows) < max_bad_rows:
+                        bad_rows.append(bad_row)
+                for ds_id, (line_no, row, shelving_unit, conveyor_unit) in chunk.items():
+                    ds = self.ds_id.get(ds_id)
+                    if ds is None or not ds.get_latest_design():
+                        no_bad_rows += 1
+                        if len(bad_rows) < max_bad_rows:
+                            reason = "unknown delivery station" if ds is None else "no design uploaded"
+                            bad_rows.append((line_no, row, reason))
+                        continue
+                    try:
+                        ds.update_key_metrics(shelving_unit, conveyor_unit, timestamp)
+                    except ValueError as e:
+                        # an update older than the last one of the station
+                        no_bad_rows += 1
+                        if len(bad_rows) < max_bad_rows:
+                            bad_rows.append((line_no, row, str(e)))
+        return no_bad_rows, bad_rows
+
+    # read the metric csv in chunks of {ds_id: (line no, row, shelving units, conveyor units)}
+    # and the rows of the chunk that could not be parsed as (line no, row, reason)
+    def read_metric_chunks(self, csv_file, chunk_size):
+        if isinstance(csv_file, str):
+            with open(csv_file, newline = "") as f:
+                yield from self.read_metric_chunks(f, chunk_size)
+            return
 
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [c.strip() for c in header]
+        missing = [c for c in ("ds_id", "no_shelving_units", "no_conveyor_system") if c not in columns]
+        if missing:
+            raise ValueError("missing columns in metric csv: " + ", ".join(missing))
+        ds_col = columns.index("ds_id")
+        shelving_col = columns.index("no_shelving_units")
+        conveyor_col = columns.index("no_conveyor_system")
 
+        chunk = {}
+        bad_rows = []
+        for row in reader:
+            if not row:
+                continue
+            try:
+                if len(row) != len(columns):
+                    raise ValueError("expected " + str(len(columns)) + " fields, got " + str(len(row)))
+                ds_id = int(row[ds_col])
+                chunk[ds_id] = (reader.line_num, row, int(row[shelving_col]), int(row[conveyor_col]))
+            except ValueError as e:
+                bad_rows.append((reader.line_num, row, str(e)))
+            if len(chunk) + len(bad_rows) >= chunk_size:
+                yield chunk, bad_rows
+                chunk = {}
+                bad_rows = []
+        if chunk or bad_rows:
+            yield chunk, bad_rows
@@ -1,25 +1,79 @@
 # Digital Twins Delivery Station
 
 import CADDesign
+import ColumnarLog
+import hashlib
+import os
 import time
 import RevisionEvent
 import Project
 
 class DeliveryStation:
 
-    def __init__(self, id, latitude = None, longitude = None, address = None, city = None, state = None):
+    def __init__(self, id, latitude = None, longitude = None, address = None, city = None, state = None, blob_store = None,
+                 delta_history = None):
         self.id = id
         self.latitude = latitude
         self.longitude = longitude
         self.address = address
         self.city = city
         self.state = state
-        self.cad_file_log = {}
+        # version no -> design and revision no -> revision, see ColumnarLog
+        self.cad_file_log = ColumnarLog.DesignLog(id)
         self.latest_cad = None
         self.latest_cad_version_no = 0
-        self.revision_logs = {}
+        self.revision_logs = ColumnarLog.RevisionLog(id)
         self.last_revision_no = 0
         self.project_list = {}
+        # the projects of project_list with status 1
+        self.active_projects = {}
+        # BlobStore.BlobStore the drawings of new designs are stored in, if any
+        self.blob_store = blob_store
+        # DeltaHistory.DeltaHistory the drawings of new designs are stored in as
+        # deltas, if any. takes precedence over blob_store
+        self.delta_history = delta_history
+        # SpatialIndex.SpatialIndex kept up to date with the location of the station, if any
+        self.spatial_index = None
+        # MetricsHistory.MetricsHistory the key metric updates of the station are recorded in, if any
+        self.metrics_history = None
+        # RevisionIndex.RevisionIndex the new revisions of the station are added to, if any
+        self.revision_index = None
+        # ChangeFeed.ChangeFeed the changes of the station are emitted to, if any
+        self.change_feed = None
+        # storage the changes of the station are recorded in, see SQLiteStore
+        self.storage = None
+
+    # fields read from the storage when first used by a station loaded without them
+    LAZY_FIELDS = ("cad_file_log", "latest_cad", "revision_logs")
+
+    # only called for attributes that are not set, i.e. the lazy fields of a
+    # station whose designs have not been read yet
+    def __getattr__(self, name):
+        storage = self.__dict__.get("storage")
+        if name not in DeliveryStation.LAZY_FIELDS or storage is None:
+            raise AttributeError(name)
+        storage.load_designs(self)
+        return self.__dict__[name]
+
+    # record the changes of the station in storage. a station loaded from storage
+    # without its designs and revisions reads them when they are first used
+    def set_storage(self, storage, loaded = True):
+        self.storage = storage
+        if not loaded:
+            for name in DeliveryStation.LAZY_FIELDS:
+                del self.__dict__[name]
+
+    # record the key metric updates of the station in metrics_history
+    def set_metrics_history(self, metrics_history):
+        self.metrics_history = metrics_history
+
+    # add the new revisions of the station to revision_index
+    def set_revision_index(self, revision_index):
+        self.revision_index = revision_index
+
+    # emit the changes of the station to change_feed
+    def set_change_feed(self, change_feed):
+        self.change_feed = change_feed
 
     # get id of the delivery station
     def get_id(self):
@@ -32,11 +86,23 @@ class DeliveryStation:
     # get address of the delivery station
     def set_address(self, addr):
         self.address = addr
+        if self.storage is not None:
+            self.storage.mark_station(self)
 
     # set location of the delivery station
     def set_location(self, long, lat):
         self.longitude = long
         self.latitude = lat
+        if self.spatial_index is not None:
+            self.spatial_index.add(self.id, lat, long)
+        if self.storage is not None:
+            self.storage.mark_station(self)
+
+    # index the location of the station in spatial_index, now and whenever it is set
+    def set_spatial_index(self, spatial_index):
+        self.spatial_index = spatial_index
+        if self.latitude is not None and self.longitude is not None:
+            spatial_index.add(self.id, self.latitude, self.longitude)
     
     # get the latest design of the delivery station
     def get_latest_design(self):
@@ -51,15 +117,38 @@ class DeliveryStation:
             return self.cad_file_log[version_no]
         return self.cad_file_log
     
-    # upload a new cad design file
+    # upload a new cad design file.
+    # with a delta history or a blob store, the drawing is stored in it when
+    # new_design is the bytes of the drawing or the path of an existing file
     def upload_new_design(self, new_design, designer, uploader, create_time = None, comments = None):
         # create a cad design instance
         if not create_time:
             create_time = time.time()
+        new_cad_version_no = self.latest_cad_version_no + 1
+        storable = isinstance(new_design, bytes) or (isinstance(new_design, str) and os.path.isfile(new_design))
+        drawing_hash = None
+        content_hash = None
+        if self.delta_history is not None and storable:
+            if isinstance(new_design, bytes):
+                data = new_design
+                new_design = None
+            else:
+                with open(new_design, "rb") as f:
+                    data = f.read()
+            self.delta_history.append(new_cad_version_no, data)
+            content_hash = hashlib.sha256(data).hexdigest()
+        elif self.blob_store is not None and storable:
+            drawing_hash = self.blob_store.put(new_design)
+            if isinstance(new_design, bytes):
+                new_design = drawing_hash
         new_cad = CADDesign.CADDesign(self.id, new_design, designer, uploader, create_time)
+        if drawing_hash is not None:
+            new_cad.set_drawing_blob(self.blob_store, drawing_hash)
+        elif self.delta_history is not None and storable:
+            new_cad.set_drawing_delta(self.delta_history)
+            new_cad.set_content_hash(content_hash)
 
         # update cad version no
-        new_cad_version_no = self.latest_cad_version_no + 1
         new_cad.set_version_no(new_cad_version_no)
 
         # create revision instance
@@ -71,16 +160,25 @@ class DeliveryStation:
         revision.set_revision_no(revision_no)
         
         self.update_design(new_cad, new_cad_version_no, revision, revision_no)
-        return new_cad
+        return self.latest_cad
 
     # update design
+    # the logs keep the fields of new_cad and revision, the latest design is the entry of the log
     def update_design(self, new_cad, new_cad_version_no, revision, revision_no):
-        self.latest_cad = new_cad
-        self.latest_cad_version_no = new_cad_version_no
         self.cad_file_log[new_cad_version_no] = new_cad
+        self.latest_cad = self.cad_file_log[new_cad_version_no]
+        self.latest_cad_version_no = new_cad_version_no
 
         self.last_revision_no = revision_no
         self.revision_logs[revision_no] = revision
+        if self.revision_index is not None:
+            self.revision_index.add(self.id, revision_no, revision.revise_time, revision.revisor, revision.comment)
+        if self.change_feed is not None:
+            self.change_feed.emit("design", self.id, (new_cad_version_no, revision_no))
+        if self.storage is not None:
+            self.storage.mark_station(self)
+            self.storage.mark_design(self.id, self.latest_cad)
+            self.storage.mark_revision(self.id, self.revision_logs[revision_no])
     
     # get certain projects
     def get_project(self, project_no):
@@ -92,19 +190,39 @@ class DeliveryStation:
 
     # get all active projects
     def get_active_project_list(self):
-        active_list = []
-        for project in self.project_list.values():
-            if project.get_project_status() == 1:
-                active_list.append(project)
-        return active_list
+        return list(self.active_projects.values())
+
+    # get the ids of all active projects
+    def get_active_project_ids(self):
+        return list(self.active_projects)
 
     # add new projects to the delivery station
     def add_new_project(self, project: Project.Project):
         self.project_list[project.get_project_id()] = project
+        if self.change_feed is not None:
+            self.change_feed.emit("project_added", self.id, (project.get_project_id(), project.get_project_status()))
+        self.update_project_status(project)
 
     # remove projects
     def remove_project(self, project_id):
         del self.project_list[project_id]
+        was_active = self.active_projects.pop(project_id, None) is not None
+        if self.change_feed is not None:
+            self.change_feed.emit("project_removed", self.id, (project_id,))
+            if was_active:
+                self.change_feed.emit("active_project", self.id, (project_id, False))
+
+    # move a project of the station in or out of the active projects after a status change
+    def update_project_status(self, project):
+        project_id = project.get_project_id()
+        was_active = project_id in self.active_projects
+        if project_id in self.project_list and project.get_project_status() == 1:
+            self.active_projects[project_id] = project
+        else:
+            self.active_projects.pop(project_id, None)
+        is_active = project_id in self.active_projects
+        if self.change_feed is not None and is_active != was_active:
+            self.change_feed.emit("active_project", self.id, (project_id, is_active))
 
     # get key metrics
     def get_key_metrics(self):
@@ -113,6 +231,27 @@ class DeliveryStation:
         key_metrics['no_conveyor_system'] = self.latest_cad.no_conveyor_system
         return key_metrics
 
+    # set the key metrics of the latest design, as of timestamp (default now).
+    # an update older than the last one recorded raises a ValueError and changes nothing
+    def update_key_metrics(self, no_shelving_units, no_conveyor_system, timestamp = None):
+        cad = self.latest_cad
+        if self.metrics_history is not None:
+            if timestamp is None:
+                timestamp = time.time()
+            self.metrics_history.record(self, timestamp, self.latest_cad_version_no, (no_shelving_units, no_conveyor_system))
+        cad.set_shelving_units(no_shelving_units)
+        cad.set_conveyor_units(no_conveyor_system)
+        if self.storage is not None:
+            self.storage.mark_design(self.id, cad)
+        if self.change_feed is not None:
+            self.change_feed.emit("metrics", self.id, (no_shelving_units, no_conveyor_system))
+
+    # get the MetricSeries of the key metric updates of the station, None if there were none
+    def get_metrics_history(self):
+        if self.metrics_history is None:
+            return None
+        return self.metrics_history.series(self.id)
+
 
 
 
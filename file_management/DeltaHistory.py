@@ -0,0 +1,166 @@
+# Delta-compressed drawing history of a delivery station
+#
+# versions are appended in order. every keyframe_interval-th version is stored in
+# full, zlib compressed, and every other version as a delta against the version
+# before it, so rebuilding a version applies at most keyframe_interval - 1 deltas
+# to a keyframe. recently rebuilt versions are kept in an LRU cache limited to
+# cache_bytes, and rebuilding starts from the closest cached version.
+#
+# a delta is a list of copy and insert operations found by block matching, in the
+# spirit of xdelta: the base is indexed by its aligned blocks of block_size bytes,
+# the new version is scanned for those blocks and every match is extended as far
+# as the bytes agree. bytes without a match are inserted literally.
+
+import struct
+import zlib
+from collections import OrderedDict
+
+COPY = struct.Struct("<BQI")
+INSERT = struct.Struct("<BI")
+
+class DeltaHistory:
+
+    def __init__(self, keyframe_interval = 16, block_size = 64, cache_bytes = 16 * 2**20):
+        self.keyframe_interval = keyframe_interval
+        self.block_size = block_size
+        self.cache_bytes = cache_bytes
+        # version no -> (base version no or None for a keyframe, compressed payload)
+        self.versions = {}
+        self.last_version_no = None
+        self.since_keyframe = 0
+        self.cached_bytes = 0
+        self.cache = OrderedDict()
+        # number of deltas applied by the last read
+        self.last_applications = 0
+
+    def __contains__(self, version_no):
+        return version_no in self.versions
+
+    # store the drawing of a new version, version numbers must increase
+    def append(self, version_no, data):
+        data = bytes(data)
+        base_no = self.last_version_no
+        if base_no is None or self.since_keyframe + 1 >= self.keyframe_interval:
+            self.store_keyframe(version_no, data)
+        else:
+            delta = zlib.compress(self.encode_delta(self.read(base_no), data))
+            full = zlib.compress(data)
+            # a delta larger than the whole version is not worth applying
+            if len(delta) < len(full):
+                self.versions[version_no] = (base_no, delta)
+                self.since_keyframe += 1
+            else:
+                self.versions[version_no] = (None, full)
+                self.since_keyframe = 0
+        self.last_version_no = version_no
+        self.cache_version(version_no, data)
+
+    # add a version read back from storage, with the base and payload it was
+    # stored with. versions are restored in order, after any appended before
+    def restore(self, version_no, base_no, payload):
+        if version_no in self.versions:
+            return
+        self.versions[version_no] = (base_no, payload)
+        if self.last_version_no is None or version_no > self.last_version_no:
+            self.last_version_no = version_no
+            self.since_keyframe = 0 if base_no is None else self.since_keyframe + 1
+
+    def store_keyframe(self, version_no, data):
+        self.versions[version_no] = (None, zlib.compress(data))
+        self.since_keyframe = 0
+
+    # rebuild the drawing of a version
+    def read(self, version_no):
+        if version_no in self.cache:
+            self.cache.move_to_end(version_no)
+            self.last_applications = 0
+            return self.cache[version_no]
+
+        # walk back to a keyframe or a cached version, then apply the deltas forward
+        chain = []
+        current = version_no
+        while current not in self.cache:
+            base_no, payload = self.versions[current]
+            if base_no is None:
+                break
+            chain.append(payload)
+            current = base_no
+        if current in self.cache:
+            data = self.cache[current]
+        else:
+            data = zlib.decompress(self.versions[current][1])
+        for payload in reversed(chain):
+            data = self.apply_delta(data, zlib.decompress(payload))
+        self.last_applications = len(chain)
+        self.cache_version(version_no, data)
+        return data
+
+    def cache_version(self, version_no, data):
+        if len(data) > self.cache_bytes or version_no in self.cache:
+            return
+        self.cache[version_no] = data
+        self.cached_bytes += len(data)
+        while self.cached_bytes > self.cache_bytes:
+            _, evicted = self.cache.popitem(last = False)
+            self.cached_bytes -= len(evicted)
+
+    # compressed size of all stored versions
+    def stored_bytes(self):
+        return sum(len(payload) for _, payload in self.versions.values())
+
+    # encode target as copy and insert operations against base
+    def encode_delta(self, base, target):
+        size = self.block_size
+        index = {}
+        for offset in range(0, len(base) - size + 1, size):
+            index.setdefault(base[offset:offset + size], offset)
+
+        out = bytearray()
+        literal_start = 0
+        i = 0
+        # common prefix, most edits leave the start of a drawing untouched
+        while i + size <= len(target) and base[i:i + size] == target[i:i + size]:
+            i += size
+        if i:
+            out += COPY.pack(0, 0, i)
+            literal_start = i
+
+        end = len(target) - size
+        while i <= end:
+            offset = index.get(target[i:i + size])
+            if offset is None:
+                i += 1
+                continue
+            if literal_start < i:
+                out += INSERT.pack(1, i - literal_start)
+                out += target[literal_start:i]
+            length = size
+            while (i + length + size <= len(target) and
+                   base[offset + length:offset + length + size] == target[i + length:i + length + size]):
+                length += size
+            while (i + length < len(target) and offset + length < len(base) and
+                   base[offset + length] == target[i + length]):
+                length += 1
+            out += COPY.pack(0, offset, length)
+            i += length
+            literal_start = i
+        if literal_start < len(target):
+            out += INSERT.pack(1, len(target) - literal_start)
+            out += target[literal_start:]
+        return bytes(out)
+
+    @staticmethod
+    def apply_delta(base, delta):
+        out = bytearray()
+        position = 0
+        while position < len(delta):
+            if delta[position] == 0:
+                _, offset, length = COPY.unpack_from(delta, position)
+                position += COPY.size
+                out += base[offset:offset + length]
+            else:
+                _, length = INSERT.unpack_from(delta, position)
+                position += INSERT.size
+                out += delta[position:position + length]
+                position += length
+        return bytes(out)
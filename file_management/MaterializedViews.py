@@ -0,0 +1,153 @@
+# Materialized views over the change feed of a DSSystem
+#
+# a view is built from the current state of the system and then kept up to date
+# by the events of system.change_feed after it, instead of being computed from
+# every station and project on each read. a subscribed view applies events as
+# they are emitted. a view created with subscribe = False is brought up to date
+# by catch_up(), which reads the events after the last one it applied, or
+# rebuilds the view if the feed no longer keeps them.
+#
+# events are applied by the on_<kind> method of a view, if it has one, called
+# with the seq, ds id and data of the event. see ChangeFeed for the kinds.
+
+class MaterializedView:
+
+    def __init__(self, system, subscribe = True):
+        self.system = system
+        self.feed = system.change_feed
+        self.subscribed = False
+        self.rebuild()
+        if subscribe:
+            self.feed.subscribe(self.apply)
+            self.subscribed = True
+
+    # build the view from the current state of the system
+    def rebuild(self):
+        self.seq = self.feed.last_seq
+        self.build()
+
+    def build(self):
+        raise NotImplementedError
+
+    def apply(self, event):
+        seq, _, kind, ds_id, data = event
+        if seq <= self.seq:
+            return
+        handler = getattr(self, "on_" + kind, None)
+        if handler is not None:
+            handler(seq, ds_id, data)
+        self.seq = seq
+
+    # apply the events emitted since the last one applied
+    def catch_up(self):
+        if self.seq + 1 < self.feed.first_seq or self.seq > self.feed.last_seq:
+            self.rebuild()
+            return
+        for event in self.feed.follow(self.seq):
+            self.apply(event)
+
+    def close(self):
+        if self.subscribed:
+            self.feed.unsubscribe(self.apply)
+            self.subscribed = False
+
+class ActiveProjectsByRegion(MaterializedView):
+
+    def build(self):
+        # ds id -> (state, city) and ds id -> ids of the active projects of the station
+        self.regions = {}
+        self.active = {}
+        # (state, city) -> {project id: number of its stations in the city}, and the same by state
+        self.by_city = {}
+        self.by_state = {}
+        for ds in self.system.ds_id.values():
+            self.regions[ds.id] = (ds.state, ds.city)
+            for project_id in ds.active_projects:
+                self.activate(ds.id, project_id)
+
+    @staticmethod
+    def count(counts, key, project_id, n):
+        projects = counts.setdefault(key, {})
+        projects[project_id] = projects.get(project_id, 0) + n
+        if not projects[project_id]:
+            del projects[project_id]
+            if not projects:
+                del counts[key]
+
+    def add_station(self, region, project_id, n):
+        self.count(self.by_city, region, project_id, n)
+        self.count(self.by_state, region[0], project_id, n)
+
+    def activate(self, ds_id, project_id):
+        active = self.active.setdefault(ds_id, set())
+        if project_id not in active:
+            active.add(project_id)
+            self.add_station(self.regions[ds_id], project_id, 1)
+
+    def deactivate(self, ds_id, project_id):
+        active = self.active.get(ds_id, set())
+        if project_id in active:
+            active.remove(project_id)
+            self.add_station(self.regions[ds_id], project_id, -1)
+
+    def on_station(self, seq, ds_id, data):
+        self.regions[ds_id] = data
+
+    def on_region(self, seq, ds_id, data):
+        old_region, region = data
+        for project_id in self.active.get(ds_id, ()):
+            self.add_station(old_region, project_id, -1)
+            self.add_station(region, project_id, 1)
+        self.regions[ds_id] = region
+
+    def on_active_project(self, seq, ds_id, data):
+        project_id, active = data
+        if active:
+            self.activate(ds_id, project_id)
+        else:
+            self.deactivate(ds_id, project_id)
+
+    # number of active projects with a station in the state, or in a city of the state
+    def active_projects(self, state, city = None):
+        if city is None:
+            return len(self.by_state.get(state, {}))
+        return len(self.by_city.get((state, city), {}))
+
+    # get {state: number of active projects with a station in the state}
+    def counts_by_state(self):
+        return {state: len(projects) for state, projects in self.by_state.items()}
+
+    # get {(state, city): number of active projects with a station in the city}
+    def counts_by_city(self):
+        return {region: len(projects) for region, projects in self.by_city.items()}
+
+class LatestDesignChanges(MaterializedView):
+
+    def build(self):
+        # ds id -> (seq, version no) of the last design change, oldest change first
+        self.changes = {}
+        # changes are known for the seqs after complete_from, those the feed still keeps
+        self.complete_from = self.feed.first_seq - 1
+        for event in self.feed.follow(self.complete_from):
+            seq, _, kind, ds_id, data = event
+            if kind == "design":
+                self.on_design(seq, ds_id, data)
+
+    def on_design(self, seq, ds_id, data):
+        self.changes.pop(ds_id, None)
+        self.changes[ds_id] = (seq, data[0])
+
+    # get [(ds id, version no)] of the stations whose latest design changed after
+    # seq, most recent change first
+    def changed_since(self, seq):
+        if seq < self.complete_from:
+            raise ValueError("changes after " + str(seq) + " are no longer kept, the oldest kept is " +
+                             str(self.complete_from + 1))
+        if seq > self.feed.last_seq:
+            raise ValueError("seq " + str(seq) + " is past the last event " + str(self.feed.last_seq))
+        changed = []
+        for ds_id, (change_seq, version_no) in reversed(self.changes.items()):
+            if change_seq <= seq:
+                break
+            changed.append((ds_id, version_no))
+        return changed
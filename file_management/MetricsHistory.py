@@ -0,0 +1,283 @@
+# Key metrics history of the delivery stations
+#
+# every update of the key metrics of a station is appended to the MetricSeries of
+# the station: array columns of the update time, the design version and the value
+# of each metric. a series also keeps rollups by hour, day and month (UTC): per
+# time bucket the number of updates and the sum, min, max and last value of each
+# metric, updated as values are appended, so a windowed query reads one entry
+# per bucket instead of every update.
+#
+# MetricsHistory keeps the series of the stations, the latest values of every
+# station in array columns, and the running totals of the fleet, of every state
+# and of every city, each with rollups of its own. fleet and regional windows
+# read those rollups, totals by region read the running totals and the
+# top stations are selected from the latest value columns.
+#
+# updates of one station must be recorded in time order. an update out of order,
+# or with a value the series of the station cannot hold, raises a ValueError and
+# leaves the history as it was.
+
+import calendar
+import contextlib
+import heapq
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+METRICS = ("no_shelving_units", "no_conveyor_system")
+GRANULARITIES = ("hour", "day", "month")
+
+def bucket_of(timestamp, granularity):
+    if granularity == "hour":
+        return int(timestamp // 3600)
+    if granularity == "day":
+        return int(timestamp // 86400)
+    t = time.gmtime(timestamp)
+    return t.tm_year * 12 + t.tm_mon - 1
+
+# start time of a bucket
+def bucket_start(bucket, granularity):
+    if granularity == "hour":
+        return bucket * 3600
+    if granularity == "day":
+        return bucket * 86400
+    return calendar.timegm((bucket // 12, bucket % 12 + 1, 1, 0, 0, 0))
+
+class Rollup:
+
+    def __init__(self, granularity):
+        self.granularity = granularity
+        self.buckets = array('q')
+        # per bucket the count and, per metric, the sum, min, max and last value
+        self.stride = 1 + 4 * len(METRICS)
+        self.stats = array('q')
+        # time range of the last bucket
+        self.bucket_from = 0
+        self.bucket_to = 0
+        self.last_time = None
+
+    def add(self, timestamp, values):
+        self.last_time = timestamp
+        stats = self.stats
+        if self.bucket_from <= timestamp < self.bucket_to:
+            i = len(stats) - self.stride
+            stats[i] += 1
+            for value in values:
+                stats[i + 1] += value
+                if value < stats[i + 2]:
+                    stats[i + 2] = value
+                if value > stats[i + 3]:
+                    stats[i + 3] = value
+                stats[i + 4] = value
+                i += 4
+            return
+        bucket = bucket_of(timestamp, self.granularity)
+        self.buckets.append(bucket)
+        self.bucket_from = bucket_start(bucket, self.granularity)
+        self.bucket_to = bucket_start(bucket + 1, self.granularity)
+        stats.append(1)
+        for value in values:
+            stats.extend((value, value, value, value))
+
+    # [(bucket start time, count, sum, min, max, last)] of a metric over the
+    # buckets overlapping time_from .. time_to
+    def window(self, time_from, time_to, metric):
+        m = 1 + 4 * METRICS.index(metric)
+        i = bisect_left(self.buckets, bucket_of(time_from, self.granularity))
+        j = bisect_right(self.buckets, bucket_of(time_to, self.granularity))
+        stats = self.stats
+        stride = self.stride
+        return [(bucket_start(self.buckets[k], self.granularity), stats[k * stride]) + tuple(stats[k * stride + m:k * stride + m + 4])
+                for k in range(i, j)]
+
+def make_rollups():
+    return tuple(Rollup(granularity) for granularity in GRANULARITIES)
+
+class MetricSeries:
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.version_nos = array('q')
+        self.values = [array('q') for _ in METRICS]
+        self.rollups = make_rollups()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # append the metric values at timestamp, which must not be before the last one
+    def append(self, timestamp, values, version_no = 0):
+        if len(values) != len(METRICS):
+            raise ValueError("expected " + str(len(METRICS)) + " metric values, got " + str(len(values)))
+        n = len(self.timestamps)
+        try:
+            self.timestamps.append(timestamp)
+            self.version_nos.append(version_no)
+            for column, value in zip(self.values, values):
+                column.append(value)
+        except (TypeError, OverflowError) as e:
+            # drop the fields appended before the one that did not fit, so the columns keep the same length
+            self.truncate(n)
+            raise ValueError("metric update does not fit the history: " + str(e)) from e
+        if n and timestamp < self.timestamps[n - 1]:
+            self.truncate(n)
+            raise ValueError("metrics must be recorded in time order, got " + str(timestamp) +
+                             " after " + str(self.timestamps[n - 1]))
+        try:
+            for rollup in self.rollups:
+                rollup.add(timestamp, values)
+        except OverflowError as e:
+            # a sum of a bucket overflowed partway, the rollups are rebuilt from the earlier updates
+            self.truncate(n)
+            self.rollups = make_rollups()
+            for k in range(n):
+                for rollup in self.rollups:
+                    rollup.add(self.timestamps[k], [column[k] for column in self.values])
+            raise ValueError("metric values overflow the rollups of the series: " + str(e)) from e
+
+    # drop the updates after the first n
+    def truncate(self, n):
+        for column in (self.timestamps, self.version_nos, *self.values):
+            del column[n:]
+
+    # get {metric: value} of the last update, None if there was none
+    def latest(self):
+        if not self.timestamps:
+            return None
+        return {metric: column[-1] for metric, column in zip(METRICS, self.values)}
+
+    # get [(time, version no, {metric: value})] of the updates from time_from to time_to
+    def between(self, time_from, time_to):
+        i = bisect_left(self.timestamps, time_from)
+        j = bisect_right(self.timestamps, time_to)
+        return [(self.timestamps[k], self.version_nos[k], {metric: column[k] for metric, column in zip(METRICS, self.values)})
+                for k in range(i, j)]
+
+    # get [(time, {metric: value})] of the updates made to a design version
+    def by_version(self, version_no):
+        return [(self.timestamps[k], {metric: column[k] for metric, column in zip(METRICS, self.values)})
+                for k in range(len(self)) if self.version_nos[k] == version_no]
+
+    def window(self, time_from, time_to, granularity = "day", metric = "no_conveyor_system"):
+        return self.rollups[GRANULARITIES.index(granularity)].window(time_from, time_to, metric)
+
+class MetricsHistory:
+
+    def __init__(self):
+        # ds id -> MetricSeries
+        self.stations = {}
+        # latest values of every station with metrics, one slot per station
+        self.slots = {}
+        self.ds_ids = array('q')
+        self.latest = [array('q') for _ in METRICS]
+        self.regions = []
+        # ("fleet",), ("state", state) or ("city", state, city) -> [totals of the metrics, rollups of the totals]
+        self.groups = {}
+        # group key -> time of the changes of its totals not rolled up yet, see batch()
+        self.changed_groups = {}
+        self.batch_depth = 0
+
+    @staticmethod
+    def group_keys(state, city):
+        return [("fleet",), ("state", state), ("city", state, city)]
+
+    # add the change of the metric totals of a group at timestamp
+    def add_to_group(self, key, timestamp, deltas):
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [[0] * len(METRICS), make_rollups()]
+        totals = group[0]
+        for m, delta in enumerate(deltas):
+            totals[m] += delta
+        if timestamp > self.changed_groups.get(key, timestamp - 1):
+            self.changed_groups[key] = timestamp
+        if not self.batch_depth:
+            self.roll_up_groups()
+
+    # add the current totals of the changed groups to their rollups
+    def roll_up_groups(self):
+        for key, timestamp in self.changed_groups.items():
+            totals, rollups = self.groups[key]
+            # groups get updates of many stations, which may be slightly out of order
+            last_time = rollups[0].last_time
+            if last_time is not None and timestamp < last_time:
+                timestamp = last_time
+            for rollup in rollups:
+                rollup.add(timestamp, totals)
+        self.changed_groups = {}
+
+    # within the block, the totals of the groups are rolled up once at the end
+    # rather than after every update, e.g. for the rows of a metric csv
+    @contextlib.contextmanager
+    def batch(self):
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth:
+                self.roll_up_groups()
+
+    # record new metric values of a station
+    def record(self, ds, timestamp, version_no, values):
+        series = self.stations.get(ds.id)
+        if series is None:
+            series = self.stations[ds.id] = MetricSeries()
+        series.append(timestamp, values, version_no)
+
+        slot = self.slots.get(ds.id)
+        if slot is None:
+            slot = self.slots[ds.id] = len(self.ds_ids)
+            self.ds_ids.append(ds.id)
+            for column in self.latest:
+                column.append(0)
+            self.regions.append((ds.state, ds.city))
+        deltas = [value - column[slot] for value, column in zip(values, self.latest)]
+        for column, value in zip(self.latest, values):
+            column[slot] = value
+        state, city = self.regions[slot]
+        for key in self.group_keys(state, city):
+            self.add_to_group(key, timestamp, deltas)
+
+    # move the latest values of a station to the totals of its new region
+    def move_station(self, ds_id, state, city, timestamp = None):
+        slot = self.slots.get(ds_id)
+        if slot is None:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        values = [column[slot] for column in self.latest]
+        old_state, old_city = self.regions[slot]
+        self.regions[slot] = (state, city)
+        for key in self.group_keys(old_state, old_city)[1:]:
+            self.add_to_group(key, timestamp, [-value for value in values])
+        for key in self.group_keys(state, city)[1:]:
+            self.add_to_group(key, timestamp, values)
+
+    def series(self, ds_id):
+        return self.stations.get(ds_id)
+
+    # get {state: {metric: total}} of the latest values of the stations
+    def totals_by_state(self):
+        return {key[1]: dict(zip(METRICS, totals)) for key, (totals, _) in self.groups.items() if key[0] == "state"}
+
+    # get {(state, city): {metric: total}}, of the cities of one state if given
+    def totals_by_city(self, state = None):
+        return {(key[1], key[2]): dict(zip(METRICS, totals)) for key, (totals, _) in self.groups.items()
+                if key[0] == "city" and (state is None or key[1] == state)}
+
+    # get [(value, ds id)] of the k stations with the highest latest value of a metric
+    def top_stations(self, k, metric = "no_conveyor_system"):
+        return heapq.nlargest(k, zip(self.latest[METRICS.index(metric)], self.ds_ids))
+
+    # rollup window of the fleet, of a state or of a city of a state
+    def region_window(self, time_from, time_to, granularity = "day", metric = "no_conveyor_system", state = None, city = None):
+        if state is None:
+            key = ("fleet",)
+        elif city is None:
+            key = ("state", state)
+        else:
+            key = ("city", state, city)
+        group = self.groups.get(key)
+        if group is None:
+            return []
+        return group[1][GRANULARITIES.index(granularity)].window(time_from, time_to, metric)
@@ -0,0 +1,184 @@
+# Thumbnails of CAD drawings
+#
+# a PreviewStore renders the drawing of a design as a PNG thumbnail of at most
+# size x size pixels in a pool of worker processes, and keeps it on disk in
+# <directory>/<key[:2]>/<key>-<size>.png, where key is the sha256 of the drawing,
+# the blob store hash of a drawing stored there. a directory shared by several
+# systems, or kept across a rebuilt one, so never serves the preview of another
+# drawing. previews are served from an LRU cache limited to cache_bytes, so
+# browsing the versions of a station neither decodes the drawings nor reads the
+# preview files again.
+#
+# the key of a design is its blob store hash or its content_hash. a drawing
+# without either, e.g. a file uploaded without a store, is hashed the first time
+# its preview is asked for and the hash is kept as the content_hash of the
+# design, and saved to the storage given to set_storage. listing the previews of
+# designs whose key is known never reads their drawings, also after a restart.
+#
+# a DSSystem with a preview store submits the design of every upload to it, see
+# DSSystem.preview_new_design. designs without a preview, e.g. uploaded before,
+# are rendered when their preview is first asked for. a drawing that cannot be
+# rendered has no preview, and is not tried again while the store is open.
+#
+# rendering uses PIL, which is only imported by the worker processes. another
+# renderer can be given as render, a module level function
+# render(source, path, size) writing the preview of source, the bytes or the
+# path of a drawing, to path.
+
+import hashlib
+import io
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+def render_preview(source, path, size):
+    from PIL import Image
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        # decoders that support it, e.g. jpeg, decode at a reduced scale
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        if image.mode not in ("1", "L", "LA", "RGB", "RGBA"):
+            image = image.convert("RGBA")
+        write_file(path, lambda f: image.save(f, "PNG"))
+
+# write a file through a temporary file renamed into place, so a preview file is always complete
+def write_file(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# get the key of the drawing of a design and the bytes or path it is rendered
+# from. a drawing in a blob store is read by the worker, others are read here to hash them
+def drawing_source(design):
+    if design.delta_history is None and design.drawing_hash is not None:
+        return design.drawing_hash, design.blob_store.path(design.drawing_hash)
+    data = design.get_drawing()
+    return hashlib.sha256(data).hexdigest(), data
+
+class PreviewStore:
+
+    def __init__(self, directory, size = 256, workers = None, cache_bytes = 32 * 2**20, render = render_preview):
+        self.directory = directory
+        self.size = size
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.render = render
+        self.pool = None
+        # storage the content hashes found for designs are saved to, if any
+        self.storage = None
+        # key -> future of the preview being rendered
+        self.pending = {}
+        # keys of the drawings that could not be read or rendered
+        self.failed = set()
+        self.cached_bytes = 0
+        self.cache = OrderedDict()
+        os.makedirs(directory, exist_ok = True)
+
+    # save the content hashes found for designs to storage, see SQLiteStore.mark_design
+    def set_storage(self, storage):
+        self.storage = storage
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + "-" + str(self.size) + ".png")
+
+    # get the key of the drawing of a design, and the source to render it from if
+    # it was read to find the key. None if the drawing cannot be read
+    def key_of(self, design):
+        if design.delta_history is None and design.drawing_hash is not None:
+            return design.drawing_hash, None
+        if design.content_hash is not None:
+            return design.content_hash, None
+        try:
+            key, source = drawing_source(design)
+        except OSError:
+            return None, None
+        design.set_content_hash(key)
+        if self.storage is not None:
+            self.storage.mark_design(design.ds_id, design)
+        return key, source
+
+    # start rendering the preview of a design, unless it exists or is being rendered
+    def submit(self, design):
+        key, source = self.key_of(design)
+        if key is None or key in self.pending or key in self.cache or key in self.failed:
+            return
+        path = self.path(key)
+        if os.path.exists(path):
+            return
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        if source is None:
+            try:
+                _, source = drawing_source(design)
+            except OSError:
+                self.failed.add(key)
+                return
+        future = self.pool.submit(self.render, source, path, self.size)
+        self.pending[key] = future
+        future.add_done_callback(lambda future: self.rendered(key, future))
+
+    # called when a preview is rendered, or failed to
+    def rendered(self, key, future):
+        if future.exception() is not None:
+            self.failed.add(key)
+        self.pending.pop(key, None)
+
+    # get the PNG bytes of the preview of a design, None if it cannot be rendered
+    def get(self, design):
+        key, _ = self.key_of(design)
+        if key is None:
+            return None
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.submit(design)
+        future = self.pending.get(key)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                self.failed.add(key)
+        if key in self.failed:
+            return None
+        with open(self.path(key), "rb") as f:
+            data = f.read()
+        self.add_to_cache(key, data)
+        return data
+
+    # get [(version no, PNG bytes or None)] of the previews of designs, rendering
+    # the missing ones in parallel
+    def gallery(self, designs):
+        designs = list(designs)
+        for design in designs:
+            self.submit(design)
+        return [(design.version_no, self.get(design)) for design in designs]
+
+    def add_to_cache(self, key, data):
+        if len(data) > self.cache_bytes:
+            return
+        self.cache[key] = data
+        self.cached_bytes += len(data)
+        while self.cached_bytes > self.cache_bytes:
+            _, evicted = self.cache.popitem(last = False)
+            self.cached_bytes -= len(evicted)
+
+    # wait for the previews being rendered
+    def wait(self):
+        for key, future in list(self.pending.items()):
+            try:
+                future.result()
+            except Exception:
+                self.failed.add(key)
+
+    def close(self):
+        self.wait()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -9,6 +9,12 @@ class Project:
         self.manager = manager
         self.name = name
         self.ds_list = set()
+        # status -> {project id: project} index shared with the system, if any
+        self.status_index = None
+        # storage the changes of the project are recorded in, see SQLiteStore
+        self.storage = None
+        # ChangeFeed.ChangeFeed the status changes of the project are emitted to, if any
+        self.change_feed = None
     
     def get_project_status(self):
         return self.status
@@ -25,11 +31,28 @@ class Project:
             ds_id_list.append(ds.id)
         return ds_id_list
     
+    # add the project to a status index, status -> {project id: project},
+    # which is kept up to date on every status change
+    def set_status_index(self, status_index):
+        self.status_index = status_index
+        status_index.setdefault(self.status, {})[self.project_id] = self
+
     def update_project_status(self, new_status):
+        old_status = self.status
         self.status = new_status
+        if self.status_index is not None and old_status != new_status:
+            del self.status_index[old_status][self.project_id]
+            self.status_index.setdefault(new_status, {})[self.project_id] = self
+        if self.storage is not None:
+            self.storage.mark_project(self)
+        if self.change_feed is not None:
+            self.change_feed.emit("project_status", None, (self.project_id, old_status, new_status))
         if self.status == 0:
             for ds in self.ds_list:
                 ds.remove_project(self.project_id)
+        else:
+            for ds in self.ds_list:
+                ds.update_project_status(self)
     
     def set_manager(self, m):
         self.manager = m
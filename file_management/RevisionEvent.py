@@ -2,6 +2,8 @@
 
 class Revision:
 
+    __slots__ = ("ds_id", "revise_time", "new_design", "revisor", "comment", "revision_no")
+
     def __init__(self, ds_id, revise_time, new_design, revisor, comments = None) -> None:
         self.ds_id = ds_id 
         self.revise_time = revise_time
@@ -0,0 +1,210 @@
+# Fleet-wide index of the revisions of the delivery stations
+#
+# every revision added to a station is appended to the index as an entry: array
+# columns of the revision time, the station id, the revision no and the revisor,
+# with the entries in time order. postings, arrays of entries in time order,
+# index the revisions by revisor, by station and by the lowercase words of
+# their comments.
+#
+# search() streams the (ds id, revision no, revise time, revisor) of the
+# revisions matching a revisor, a station, words of the comment and a time
+# window, oldest or newest first. the time window is a range of entries found
+# by bisection and the shortest of the postings is walked. its entries are
+# checked against the revisor and station columns and looked up in the other
+# word postings, by bisection or, for short postings, in a set. page() returns one page of
+# results and a cursor to get the next page with, pages() yields every page.
+#
+# revisions are expected in time order. an older revision is appended as well,
+# and the entries are sorted again before the next search, which renumbers them
+# and so invalidates the cursors handed out before.
+#
+# an index can be given a loader, e.g. by SQLiteStore, which adds the revisions
+# kept elsewhere the first time the index is searched. revisions added before
+# then are added after those of the loader.
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+import ColumnarLog
+
+WORD = re.compile(r"\w+")
+NO_ENTRIES = array('q')
+BLOCK_SIZE = 256
+
+# the distinct lowercase words of a comment
+def words(text):
+    if not text:
+        return set()
+    return set(WORD.findall(text.lower()))
+
+def contains(entries, entry):
+    i = bisect_left(entries, entry)
+    return i < len(entries) and entries[i] == entry
+
+class RevisionIndex:
+
+    def __init__(self, strings = None):
+        self.strings = ColumnarLog.STRINGS if strings is None else strings
+        self.times = array('d')
+        self.ds_ids = array('q')
+        self.revision_nos = array('q')
+        self.revisors = array('I')
+        # revisor string index -> entries, ds id -> entries and word -> entries
+        self.by_revisor = {}
+        self.by_ds = {}
+        self.by_word = {}
+        self.in_order = True
+        # function called with the index to add the stored revisions, until it is called
+        self.loader = None
+        # revisions added while the loader has not been called
+        self.deferred = []
+
+    def __len__(self):
+        if self.loader is not None:
+            self.load()
+        return len(self.times)
+
+    # add the stored revisions with loader the first time the index is searched
+    def set_loader(self, loader):
+        self.loader = loader
+
+    def load(self):
+        loader = self.loader
+        self.loader = None
+        loader(self)
+        deferred = self.deferred
+        self.deferred = []
+        for revision in deferred:
+            self.add(*revision)
+
+    # add a revision of a station, unless it or a later revision of the station is indexed already
+    def add(self, ds_id, revision_no, revise_time, revisor, comment = None):
+        if self.loader is not None:
+            self.deferred.append((ds_id, revision_no, revise_time, revisor, comment))
+            return
+        station_entries = self.by_ds.get(ds_id)
+        if station_entries is None:
+            station_entries = self.by_ds[ds_id] = array('q')
+        elif revision_no <= self.revision_nos[station_entries[-1]]:
+            return
+        if revise_time is None:
+            revise_time = 0.0
+        entry = len(self.times)
+        if entry and revise_time < self.times[-1]:
+            self.in_order = False
+        revisor_index = self.strings.intern(revisor)
+        self.times.append(revise_time)
+        self.ds_ids.append(ds_id)
+        self.revision_nos.append(revision_no)
+        self.revisors.append(revisor_index)
+        station_entries.append(entry)
+        entries = self.by_revisor.get(revisor_index)
+        if entries is None:
+            entries = self.by_revisor[revisor_index] = array('q')
+        entries.append(entry)
+        for word in words(comment):
+            entries = self.by_word.get(word)
+            if entries is None:
+                entries = self.by_word[word] = array('q')
+            entries.append(entry)
+
+    # sort the entries by time and renumber the postings
+    def sort(self):
+        order = sorted(range(len(self.times)), key = self.times.__getitem__)
+        new_entries = array('q', [0]) * len(order)
+        for new_entry, entry in enumerate(order):
+            new_entries[entry] = new_entry
+        self.times = array('d', [self.times[i] for i in order])
+        self.ds_ids = array('q', [self.ds_ids[i] for i in order])
+        self.revision_nos = array('q', [self.revision_nos[i] for i in order])
+        self.revisors = array('I', [self.revisors[i] for i in order])
+        for postings in (self.by_revisor, self.by_ds, self.by_word):
+            for key, entries in postings.items():
+                postings[key] = array('q', sorted([new_entries[entry] for entry in entries]))
+        self.in_order = True
+
+    # get (ds id, revision no, revise time, revisor) of an entry
+    def hit(self, entry):
+        return self.ds_ids[entry], self.revision_nos[entry], self.times[entry], self.strings[self.revisors[entry]]
+
+    # yield the entries of the revisions matching every condition given. text
+    # matches the comments containing all of its words. the entries are
+    # yielded oldest first, or newest first, starting after cursor if given
+    def entries(self, revisor = None, ds_id = None, text = None, time_from = None, time_to = None,
+                newest_first = False, cursor = None):
+        if self.loader is not None:
+            self.load()
+        if not self.in_order:
+            self.sort()
+        first = 0 if time_from is None else bisect_left(self.times, time_from)
+        last = len(self.times) if time_to is None else bisect_right(self.times, time_to, first)
+        if cursor is not None:
+            if newest_first:
+                last = min(last, cursor)
+            else:
+                first = max(first, cursor + 1)
+
+        # (entries, column, value) of every condition, word conditions have no column
+        conditions = []
+        if revisor is not None:
+            revisor_index = self.strings.indexes.get(revisor)
+            conditions.append((self.by_revisor.get(revisor_index, NO_ENTRIES), self.revisors, revisor_index))
+        if ds_id is not None:
+            conditions.append((self.by_ds.get(ds_id, NO_ENTRIES), self.ds_ids, ds_id))
+        for word in words(text):
+            conditions.append((self.by_word.get(word, NO_ENTRIES), None, None))
+
+        if not conditions:
+            yield from range(last - 1, first - 1, -1) if newest_first else range(first, last)
+            return
+        # walk the shortest postings, check the others on the columns or by bisection
+        conditions.sort(key = lambda condition: len(condition[0]))
+        walked = conditions[0][0]
+        column_checks = [(column, value) for _, column, value in conditions[1:] if column is not None]
+        word_postings = [entries for entries, column, _ in conditions[1:] if column is None]
+        walked = walked[bisect_left(walked, first):bisect_left(walked, last)]
+        if newest_first:
+            walked.reverse()
+        # word postings up to a few times longer than the walked ones are looked up as sets
+        word_sets = [set(entries) for entries in word_postings if len(entries) <= 4 * len(walked)]
+        word_postings = [entries for entries in word_postings if len(entries) > 4 * len(walked)]
+        # filter a block of entries at a time, so the first page does not filter them all
+        for start in range(0, len(walked), BLOCK_SIZE):
+            block = walked[start:start + BLOCK_SIZE]
+            for column, value in column_checks:
+                block = [entry for entry in block if column[entry] == value]
+            for entries in word_sets:
+                block = [entry for entry in block if entry in entries]
+            for entries in word_postings:
+                block = [entry for entry in block if contains(entries, entry)]
+            yield from block
+
+    # yield (ds id, revision no, revise time, revisor) of the matching revisions, see entries
+    def search(self, revisor = None, ds_id = None, text = None, time_from = None, time_to = None, newest_first = False):
+        for entry in self.entries(revisor, ds_id, text, time_from, time_to, newest_first):
+            yield self.hit(entry)
+
+    # get a page of up to page_size hits of search after cursor, and the cursor
+    # of the next page, None after the last page
+    def page(self, page_size = 100, cursor = None, revisor = None, ds_id = None, text = None, time_from = None,
+             time_to = None, newest_first = False):
+        entries = []
+        for entry in self.entries(revisor, ds_id, text, time_from, time_to, newest_first, cursor):
+            entries.append(entry)
+            if len(entries) == page_size:
+                break
+        next_cursor = entries[-1] if len(entries) == page_size else None
+        return [self.hit(entry) for entry in entries], next_cursor
+
+    # yield the hits of search in pages of up to page_size
+    def pages(self, page_size = 100, revisor = None, ds_id = None, text = None, time_from = None, time_to = None,
+              newest_first = False):
+        page = []
+        for entry in self.entries(revisor, ds_id, text, time_from, time_to, newest_first):
+            page.append(self.hit(entry))
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
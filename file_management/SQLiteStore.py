@@ -0,0 +1,254 @@
+# SQLite persistence for the delivery station system
+#
+# a DSSystem created with a storage loads the stations and projects it holds and
+# records every change to them. changes are buffered and written by commit() in
+# one transaction with executemany, DSSystem.save() commits its storage.
+#
+# the designs and revisions of a station are not read when the system is opened.
+# a station loaded from storage reads them the first time one of cad_file_log,
+# latest_cad or revision_logs is used, see DeliveryStation.__getattr__. the
+# revision index of the system is filled from the revisions table the first
+# time it is searched, so opening reads only the stations and projects.
+#
+# any object with the methods of SQLiteStore can be used as the storage of a DSSystem:
+#     load(system), load_designs(ds), mark_station(ds), mark_design(ds_id, design),
+#     mark_revision(ds_id, revision), mark_project(project), commit()
+# and, to resume bulk imports, mark_import_progress and load_import_progress
+#
+# the last seq of the change feed of the system is written by every commit, and
+# the feed of a system opened again continues after it, see ChangeFeed.
+#
+# drawings are persisted as their file name or blob store hash, with their sha256
+# once it is known. drawings kept in a
+# DeltaHistory are persisted as its compressed keyframes and deltas, in the
+# drawing_deltas table, and read back into the delta history of the station
+# with its designs.
+
+import sqlite3
+
+import CADDesign
+import ColumnarLog
+import DeltaHistory
+import Project
+import RevisionEvent
+
+SCHEMA = """
+create table if not exists stations (
+    id integer primary key,
+    latitude real, longitude real, address text, city text, state text,
+    latest_cad_version_no integer not null default 0,
+    last_revision_no integer not null default 0
+);
+create index if not exists stations_region on stations (state, city);
+create table if not exists designs (
+    ds_id integer not null, version_no integer not null,
+    drawing_file, drawing_hash text, create_time real, designer text, uploader text,
+    no_shelving_units integer, no_conveyor_system integer, content_hash text,
+    primary key (ds_id, version_no)
+) without rowid;
+create table if not exists revisions (
+    ds_id integer not null, revision_no integer not null,
+    revise_time real, new_design, revisor text, comment text,
+    primary key (ds_id, revision_no)
+) without rowid;
+create table if not exists drawing_deltas (
+    ds_id integer not null, version_no integer not null,
+    base_version_no integer, payload blob not null,
+    primary key (ds_id, version_no)
+) without rowid;
+create table if not exists projects (
+    id integer primary key, name text, manager text, status integer not null
+);
+create index if not exists projects_status on projects (status);
+create table if not exists project_stations (
+    project_id integer not null, ds_id integer not null,
+    primary key (project_id, ds_id)
+) without rowid;
+create index if not exists project_stations_ds on project_stations (ds_id);
+create table if not exists change_feed (
+    id integer primary key check (id = 0), last_seq integer not null
+);
+create table if not exists import_progress (
+    manifest text primary key, rows_done integer not null
+);
+create table if not exists import_keys (
+    manifest text not null, key text not null, ds_id integer not null,
+    primary key (manifest, key)
+) without rowid;
+"""
+
+class SQLiteStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("pragma journal_mode = wal")
+        self.connection.execute("pragma synchronous = normal")
+        self.connection.executescript(SCHEMA)
+        # databases created before designs had a content hash
+        columns = [row[1] for row in self.connection.execute("pragma table_info(designs)")]
+        if "content_hash" not in columns:
+            self.connection.execute("alter table designs add column content_hash text")
+        self.blob_store = None
+        # revision index of the system, filled when it is first searched
+        self.revision_index = None
+        # change feed of the system, whose last seq is written by commit
+        self.change_feed = None
+        # changes not yet written, keyed so that repeated changes are written once
+        self.stations = {}
+        self.designs = {}
+        self.revisions = {}
+        self.projects = {}
+        # manifest -> (rows done, {station key: ds id} of the new stations)
+        self.import_progress = {}
+
+    def close(self):
+        self.commit()
+        # the revision index of the system is filled while the revisions can still be read
+        if self.revision_index is not None and self.revision_index.loader == self.load_revision_index:
+            self.revision_index.load()
+        self.connection.close()
+
+    # read the stations and projects into system, leaving designs and revisions to be read lazily
+    def load(self, system):
+        self.blob_store = system.blob_store
+        self.change_feed = system.change_feed
+        row = self.connection.execute("select last_seq from change_feed").fetchone()
+        if row is not None:
+            self.change_feed.resume(row[0])
+        rows = self.connection.execute(
+            "select id, latitude, longitude, address, city, state, latest_cad_version_no, last_revision_no from stations")
+        for ds_id, latitude, longitude, address, city, state, latest_cad_version_no, last_revision_no in rows:
+            ds = system.make_ds(ds_id, latitude, longitude, address, city, state)
+            ds.latest_cad_version_no = latest_cad_version_no
+            ds.last_revision_no = last_revision_no
+            ds.set_storage(self, loaded = False)
+            system.register_ds(ds)
+        if self.connection.execute("select exists (select 1 from revisions)").fetchone()[0]:
+            self.revision_index = system.revision_index
+            self.revision_index.set_loader(self.load_revision_index)
+
+        for project_id, name, manager, status in self.connection.execute("select id, name, manager, status from projects"):
+            project = Project.Project(project_id, name, manager)
+            project.status = status
+            project.storage = self
+            project.change_feed = system.change_feed
+            project.set_status_index(system.projects_by_status)
+            system.project_list[project_id] = project
+            system.no_of_projects = max(system.no_of_projects, project_id)
+        for project_id, ds_id in self.connection.execute("select project_id, ds_id from project_stations"):
+            project = system.project_list[project_id]
+            ds = system.ds_id[ds_id]
+            project.add_ds(ds)
+            # cancelled projects are not in the project list of their stations
+            if project.status != 0:
+                ds.add_new_project(project)
+
+    # add the stored revisions to a RevisionIndex, without reading the designs of the stations
+    def load_revision_index(self, revision_index):
+        rows = self.connection.execute(
+            "select ds_id, revision_no, revise_time, revisor, comment from revisions order by revise_time, ds_id, revision_no")
+        for ds_id, revision_no, revise_time, revisor, comment in rows:
+            revision_index.add(ds_id, revision_no, revise_time, revisor, comment)
+
+    # read the designs and revisions of a station
+    def load_designs(self, ds):
+        # a system opened without delta_keyframe_interval still reads the drawings stored as deltas
+        delta_history = ds.delta_history if ds.delta_history is not None else DeltaHistory.DeltaHistory()
+        rows = self.connection.execute(
+            "select version_no, base_version_no, payload from drawing_deltas where ds_id = ? order by version_no", (ds.id,))
+        for version_no, base_version_no, payload in rows:
+            delta_history.restore(version_no, base_version_no, payload)
+
+        cad_file_log = ColumnarLog.DesignLog(ds.id)
+        rows = self.connection.execute(
+            "select version_no, drawing_file, drawing_hash, create_time, designer, uploader, no_shelving_units, "
+            "no_conveyor_system, content_hash from designs where ds_id = ? order by version_no", (ds.id,))
+        for version_no, drawing_file, drawing_hash, create_time, designer, uploader, shelving, conveyor, content_hash in rows:
+            design = CADDesign.CADDesign(ds.id, drawing_file, designer, uploader, create_time)
+            design.set_version_no(version_no)
+            design.no_shelving_units = shelving
+            design.no_conveyor_system = conveyor
+            design.set_content_hash(content_hash)
+            if drawing_hash is not None:
+                design.set_drawing_blob(self.blob_store, drawing_hash)
+            elif version_no in delta_history:
+                design.set_drawing_delta(delta_history)
+            cad_file_log[version_no] = design
+
+        revision_logs = ColumnarLog.RevisionLog(ds.id)
+        rows = self.connection.execute(
+            "select revision_no, revise_time, new_design, revisor, comment from revisions where ds_id = ? order by revision_no",
+            (ds.id,))
+        for revision_no, revise_time, new_design, revisor, comment in rows:
+            revision = RevisionEvent.Revision(ds.id, revise_time, new_design, revisor, comment)
+            revision.set_revision_no(revision_no)
+            revision_logs[revision_no] = revision
+
+        ds.cad_file_log = cad_file_log
+        ds.latest_cad = cad_file_log.get(ds.latest_cad_version_no)
+        ds.revision_logs = revision_logs
+
+    def mark_station(self, ds):
+        self.stations[ds.id] = ds
+
+    def mark_design(self, ds_id, design):
+        self.designs[(ds_id, design.version_no)] = design
+
+    def mark_revision(self, ds_id, revision):
+        self.revisions[(ds_id, revision.revision_no)] = revision
+
+    def mark_project(self, project):
+        self.projects[project.project_id] = project
+
+    # record the progress of a bulk import, written by the same commit as the
+    # imported rows. keys maps the keys of newly imported stations to their ids
+    def mark_import_progress(self, manifest, rows_done, keys):
+        _, pending_keys = self.import_progress.get(manifest, (0, {}))
+        pending_keys.update(keys)
+        self.import_progress[manifest] = (rows_done, pending_keys)
+
+    # get (rows done, {station key: ds id}) of a manifest imported before
+    def load_import_progress(self, manifest):
+        row = self.connection.execute("select rows_done from import_progress where manifest = ?", (manifest,)).fetchone()
+        keys = dict(self.connection.execute("select key, ds_id from import_keys where manifest = ?", (manifest,)))
+        return (row[0] if row else 0), keys
+
+    # write every change since the last commit in one transaction
+    def commit(self):
+        with self.connection:
+            self.connection.executemany(
+                "insert or replace into stations values (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(ds.id, ds.latitude, ds.longitude, ds.address, ds.city, ds.state, ds.latest_cad_version_no,
+                  ds.last_revision_no) for ds in self.stations.values()])
+            self.connection.executemany(
+                "insert or replace into designs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(ds_id, version_no, d.drawing_file, d.drawing_hash, d.create_time, d.designer, d.uploader,
+                  d.no_shelving_units, d.no_conveyor_system, d.content_hash) for (ds_id, version_no), d in self.designs.items()])
+            self.connection.executemany(
+                "insert or replace into drawing_deltas values (?, ?, ?, ?)",
+                [(ds_id, version_no) + d.delta_history.versions[version_no]
+                 for (ds_id, version_no), d in self.designs.items() if d.delta_history is not None])
+            self.connection.executemany(
+                "insert or replace into revisions values (?, ?, ?, ?, ?, ?)",
+                [(ds_id, revision_no, r.revise_time, r.new_design, r.revisor, r.comment)
+                 for (ds_id, revision_no), r in self.revisions.items()])
+            self.connection.executemany(
+                "insert or replace into projects values (?, ?, ?, ?)",
+                [(p.project_id, p.name, p.manager, p.status) for p in self.projects.values()])
+            self.connection.executemany(
+                "insert or ignore into project_stations values (?, ?)",
+                [(p.project_id, ds.id) for p in self.projects.values() for ds in p.ds_list])
+            if self.change_feed is not None:
+                self.connection.execute("insert or replace into change_feed values (0, ?)", (self.change_feed.last_seq,))
+            self.connection.executemany(
+                "insert or replace into import_progress values (?, ?)",
+                [(manifest, rows_done) for manifest, (rows_done, _) in self.import_progress.items()])
+            self.connection.executemany(
+                "insert or replace into import_keys values (?, ?, ?)",
+                [(manifest, key, ds_id) for manifest, (_, keys) in self.import_progress.items() for key, ds_id in keys.items()])
+        self.stations = {}
+        self.designs = {}
+        self.revisions = {}
+        self.projects = {}
+        self.import_progress = {}
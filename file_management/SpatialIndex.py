@@ -0,0 +1,138 @@
+# Spatial index over the locations of delivery stations
+#
+# stations are bucketed in a grid of cell_degrees x cell_degrees latitude /
+# longitude cells, wrapping around the antimeridian. radius and bounding box
+# queries only look at the cells overlapping the query area, nearest-k queries
+# search a growing radius until k stations are found. distances are great-circle
+# distances in km, computed by haversine_km with numpy over the stations of all
+# the cells of a query at once. each cell keeps numpy arrays of the locations of
+# its stations, rebuilt when a station of the cell is added or removed. numpy is
+# only imported by the distance queries.
+
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+HALF_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+
+# numpy array of the great-circle distances in km from (lat, lon) to every
+# (lats[i], lons[i]), where lats and lons are numpy arrays or sequences of degrees
+def haversine_km(lat, lon, lats, lons):
+    import numpy as np
+    lat1 = math.radians(lat)
+    lats = np.radians(np.asarray(lats, dtype = float))
+    dlons = np.radians(np.asarray(lons, dtype = float)) - math.radians(lon)
+    a = np.sin((lats - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lats) * np.sin(dlons / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class SpatialIndex:
+
+    def __init__(self, cell_degrees = 0.5):
+        self.cell_degrees = cell_degrees
+        self.lon_cells = max(1, round(360 / cell_degrees))
+        # cell -> {ds id: (lat, lon)}
+        self.cells = {}
+        # cell -> ([ds id], lats, lons) of the stations of the cell, see cell_arrays
+        self.arrays = {}
+        self.locations = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, ds_id):
+        return ds_id in self.locations
+
+    def cell_of(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor((lon + 180) / self.cell_degrees) % self.lon_cells)
+
+    # add a station or move it to a new location
+    def add(self, ds_id, lat, lon):
+        if ds_id in self.locations:
+            self.remove(ds_id)
+        self.locations[ds_id] = (lat, lon)
+        cell_key = self.cell_of(lat, lon)
+        self.cells.setdefault(cell_key, {})[ds_id] = (lat, lon)
+        self.arrays.pop(cell_key, None)
+
+    def remove(self, ds_id):
+        lat, lon = self.locations.pop(ds_id)
+        cell_key = self.cell_of(lat, lon)
+        cell = self.cells[cell_key]
+        del cell[ds_id]
+        if not cell:
+            del self.cells[cell_key]
+        self.arrays.pop(cell_key, None)
+
+    # get ([ds id], lats, lons) of the stations of a cell, the locations as numpy arrays
+    def cell_arrays(self, cell_key):
+        arrays = self.arrays.get(cell_key)
+        if arrays is None:
+            import numpy as np
+            cell = self.cells[cell_key]
+            lats, lons = zip(*cell.values())
+            arrays = self.arrays[cell_key] = (list(cell), np.array(lats), np.array(lons))
+        return arrays
+
+    def get_location(self, ds_id):
+        return self.locations.get(ds_id)
+
+    # keys of the stations' cells overlapping the latitude range and the longitude
+    # range, which may wrap around the antimeridian when min_lon > max_lon
+    def cells_in(self, min_lat, max_lat, min_lon, max_lon, all_lons = False):
+        c = self.cell_degrees
+        first_row = math.floor(max(min_lat, -90) / c)
+        last_row = math.floor(min(max_lat, 90) / c)
+        if all_lons:
+            columns = range(self.lon_cells)
+        else:
+            first_column = math.floor((min_lon + 180) / c)
+            last_column = math.floor((max_lon + 180) / c)
+            # a crossing box may start and end in the same column, and then spans them all
+            if min_lon > max_lon:
+                last_column += self.lon_cells
+            columns = [j % self.lon_cells for j in range(first_column, min(last_column, first_column + self.lon_cells - 1) + 1)]
+        for i in range(first_row, last_row + 1):
+            for j in columns:
+                if (i, j) in self.cells:
+                    yield i, j
+
+    # [(distance km, ds id)] of the stations within radius_km of (lat, lon), nearest first
+    def within_radius(self, lat, lon, radius_km):
+        dlat = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(89.9, abs(lat) + dlat)))
+        dlon = radius_km / (KM_PER_DEGREE * cos_lat) if lat + dlat < 90 and lat - dlat > -90 else 360
+        cells = [self.cell_arrays(cell_key) for cell_key in self.cells_in(lat - dlat, lat + dlat, lon - dlon, lon + dlon,
+                                                                          all_lons = dlon >= 180)]
+        if not cells:
+            return []
+        import numpy as np
+        ds_ids = []
+        for cell_ds_ids, _, _ in cells:
+            ds_ids.extend(cell_ds_ids)
+        distances = haversine_km(lat, lon, np.concatenate([cell[1] for cell in cells]),
+                                 np.concatenate([cell[2] for cell in cells]))
+        inside = np.flatnonzero(distances <= radius_km)
+        return sorted(zip(distances[inside].tolist(), [ds_ids[i] for i in inside.tolist()]))
+
+    # [(distance km, ds id)] of the k stations nearest to (lat, lon), nearest first
+    def nearest(self, lat, lon, k):
+        k = min(k, len(self.locations))
+        if k <= 0:
+            return []
+        radius = self.cell_degrees * KM_PER_DEGREE
+        while True:
+            found = self.within_radius(lat, lon, radius)
+            # every station closer than the k-th found one is within the radius
+            if len(found) >= k or radius >= HALF_CIRCUMFERENCE_KM:
+                return found[:k]
+            radius *= 2
+
+    # ds ids of the stations inside the box. min_lon > max_lon is a box crossing the antimeridian
+    def within_box(self, min_lat, min_lon, max_lat, max_lon):
+        found = []
+        crosses = min_lon > max_lon
+        for cell_key in self.cells_in(min_lat, max_lat, min_lon, max_lon):
+            for ds_id, (lat, lon) in self.cells[cell_key].items():
+                if min_lat <= lat <= max_lat and ((min_lon <= lon or lon <= max_lon) if crosses else min_lon <= lon <= max_lon):
+                    found.append(ds_id)
+        return found
@@ -0,0 +1,694 @@
+# Benchmarks for the delivery station system
+#
+# run from this directory:
+#
+#     python benchmark.py csv [n_rows ...]
+#     python benchmark.py import [n_runs]
+#     python benchmark.py blobs [n_designs n_distinct]
+#     python benchmark.py deltas [n_versions drawing_bytes]
+#     python benchmark.py spatial [n_stations ...]
+#     python benchmark.py projects [n_projects ...]
+#     python benchmark.py sqlite [n_stations ...]
+#     python benchmark.py import_manifest [n_stations designs_per_station]
+#     python benchmark.py logs [n_revisions]
+#     python benchmark.py metrics [n_stations ...]
+#     python benchmark.py revisions [n_revisions]
+#     python benchmark.py views [n_stations ...]
+#     python benchmark.py previews [n_versions pixels]
+
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+import BlobStore
+import BulkImport
+import CADDesign
+import DeliveryStation
+import RevisionEvent
+import RevisionIndex
+import DeltaHistory
+import DSSystem
+import MaterializedViews
+import Previews
+import SpatialIndex
+import SQLiteStore
+
+
+# write a metric csv of n_rows rows over n_stations stations
+def write_metric_csv(path, n_rows, n_stations, seed = 0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write("ds_id,no_shelving_units,no_conveyor_system\n")
+        for _ in range(n_rows):
+            f.write(str(rng.randint(1, n_stations)) + "," + str(rng.randint(0, 500)) + "," + str(rng.randint(0, 50)) + "\n")
+
+
+# ingest a csv of n_rows rows and report the time and the peak memory of the ingestion
+def benchmark_csv(n_rows, n_stations = 1000):
+    system = DSSystem.DSSystem()
+    for i in range(n_stations):
+        system.create_ds_list()
+        system.set_ds_cat(i + 1, "design.png")
+
+    fd, path = tempfile.mkstemp(suffix = ".csv")
+    os.close(fd)
+    try:
+        write_metric_csv(path, n_rows, n_stations)
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        system.update_ds_key_metrics_from_csv(path)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        system.update_ds_key_metrics_from_csv(path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        os.remove(path)
+    print("rows=" + str(n_rows), "file=" + format(size / 2**20, ".1f") + "MiB",
+          format(n_rows / elapsed, ".0f") + " rows/s", "peak=" + format(peak / 2**20, ".2f") + "MiB")
+
+
+# time of importing the given modules and the peak rss of a fresh interpreter that imports them
+IMPORT_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss]))
+"""
+
+
+# import DSSystem headless, and together with the notebook dependencies it used to
+# load eagerly, in fresh interpreters. report the median import time and rss
+def benchmark_import(n_runs = 10):
+    cases = {
+        "headless": ["DSSystem"],
+        "with IPython.display": ["DSSystem", "IPython.display"],
+    }
+    for name, modules in cases.items():
+        times = []
+        rss = []
+        for _ in range(n_runs):
+            out = subprocess.run([sys.executable, "-c", IMPORT_PROBE] + modules, capture_output = True, text = True,
+                                 check = True, cwd = os.path.dirname(os.path.abspath(__file__)))
+            elapsed, maxrss = json.loads(out.stdout)
+            times.append(elapsed)
+            rss.append(maxrss)
+        times.sort()
+        rss.sort()
+        print(format(name, "22s"), "import=" + format(times[n_runs // 2] * 1e3, ".1f") + "ms",
+              "rss=" + format(rss[n_runs // 2] / 1024, ".1f") + "MiB")
+
+
+# upload n_designs drawings of drawing_bytes bytes, n_distinct different ones, over
+# n_stations stations and report the disk space used and the time of cold and cached reads
+def benchmark_blobs(n_designs, n_distinct, n_stations = 100, drawing_bytes = 2**20):
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(n_distinct):
+            paths.append(os.path.join(directory, "drawing" + str(i) + ".png"))
+            with open(paths[-1], "wb") as f:
+                f.write(random.Random(i).randbytes(drawing_bytes))
+
+        store = BlobStore.BlobStore(os.path.join(directory, "blobs"))
+        system = DSSystem.DSSystem(store)
+        for _ in range(n_stations):
+            system.add_ds()
+        start = time.perf_counter()
+        designs = []
+        for i in range(n_designs):
+            designs.append(system.upload_ds_design(i % n_stations + 1, paths[i % n_distinct], "designer", "uploader"))
+        upload = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for design in designs:
+            design.get_drawing()
+        reads = time.perf_counter() - start
+        print("designs=" + str(n_designs), "distinct=" + str(n_distinct),
+              "logical=" + format(n_designs * drawing_bytes / 2**20, ".0f") + "MiB",
+              "stored=" + format(store.disk_bytes() / 2**20, ".0f") + "MiB",
+              "upload=" + format(upload / n_designs * 1e3, ".2f") + "ms/design",
+              "read=" + format(reads / n_designs * 1e3, ".3f") + "ms/design",
+              "cached=" + format(store.cached_bytes / 2**20, ".0f") + "MiB")
+    finally:
+        shutil.rmtree(directory)
+
+
+# synthetic drawing history: a drawing of drawing_bytes bytes, compressible like
+# vector drawings are, with a few small replacements, insertions and deletions
+# per version
+def drawing_history(n_versions, drawing_bytes, edits = 3, seed = 0):
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randint(4, 12)) for _ in range(256)]
+    data = bytearray()
+    while len(data) < drawing_bytes:
+        data += rng.choice(words)
+    versions = []
+    for _ in range(n_versions):
+        for _ in range(edits):
+            position = rng.randrange(len(data))
+            kind = rng.randrange(3)
+            if kind == 0:
+                data[position:position + 32] = rng.randbytes(32)
+            elif kind == 1:
+                data[position:position] = b"".join(rng.choice(words) for _ in range(rng.randint(1, 40)))
+            else:
+                del data[position:position + rng.randint(1, 400)]
+        versions.append(bytes(data))
+    return versions
+
+
+# store a synthetic drawing history in full and as deltas with several keyframe
+# intervals, and report the stored size and the latency of rebuilding a version
+# with an empty cache
+def benchmark_deltas(n_versions, drawing_bytes):
+    versions = drawing_history(n_versions, drawing_bytes)
+    raw = sum(len(v) for v in versions)
+    compressed = sum(len(zlib.compress(v)) for v in versions)
+    print("versions=" + str(n_versions), "raw=" + format(raw / 2**20, ".1f") + "MiB",
+          "zlib per version=" + format(compressed / 2**20, ".1f") + "MiB")
+    for interval in [1, 8, 16, 32]:
+        history = DeltaHistory.DeltaHistory(interval)
+        start = time.perf_counter()
+        for version_no, data in enumerate(versions, 1):
+            history.append(version_no, data)
+        append = time.perf_counter() - start
+
+        latencies = []
+        applications = 0
+        for version_no in range(1, n_versions + 1):
+            history.cache.clear()
+            history.cached_bytes = 0
+            start = time.perf_counter()
+            history.read(version_no)
+            latencies.append(time.perf_counter() - start)
+            applications = max(applications, history.last_applications)
+        latencies.sort()
+        print("    keyframe interval=" + format(interval, "<3d"),
+              "stored=" + format(history.stored_bytes() / 2**20, ".2f") + "MiB",
+              "ratio=" + format(raw / history.stored_bytes(), ".1f") + "x",
+              "append=" + format(append / n_versions * 1e3, ".1f") + "ms",
+              "rebuild p50=" + format(latencies[len(latencies) // 2] * 1e3, ".1f") + "ms",
+              "max=" + format(latencies[-1] * 1e3, ".1f") + "ms",
+              "max deltas=" + str(applications))
+
+
+# place n_stations stations at random over the contiguous US and report the
+# latency of nearest-10 and 50 km radius queries with the spatial index and with
+# a scan over every station
+def benchmark_spatial(n_stations, n_queries = 1000):
+    rng = random.Random(0)
+    system = DSSystem.DSSystem()
+    for _ in range(n_stations):
+        system.add_ds(latitude = rng.uniform(25, 49), longitude = rng.uniform(-124, -67))
+    queries = [(rng.uniform(25, 49), rng.uniform(-124, -67)) for _ in range(n_queries)]
+    ids = list(system.spatial_index.locations)
+    lats = [system.spatial_index.locations[i][0] for i in ids]
+    lons = [system.spatial_index.locations[i][1] for i in ids]
+
+    def scan(lat, lon):
+        return sorted(zip(SpatialIndex.haversine_km(lat, lon, lats, lons).tolist(), ids))
+
+    cases = {
+        "nearest 10": (lambda lat, lon: system.spatial_index.nearest(lat, lon, 10),
+                       lambda lat, lon: scan(lat, lon)[:10]),
+        "radius 50km": (lambda lat, lon: system.spatial_index.within_radius(lat, lon, 50),
+                        lambda lat, lon: [p for p in scan(lat, lon) if p[0] <= 50]),
+    }
+    for name, (indexed, brute_force) in cases.items():
+        timings = []
+        for query in [indexed, brute_force]:
+            # the scan is slow, time it on a tenth of the queries
+            sample = queries if query is indexed else queries[:max(1, n_queries // 10)]
+            start = time.perf_counter()
+            for lat, lon in sample:
+                query(lat, lon)
+            timings.append((time.perf_counter() - start) / len(sample))
+        print("stations=" + str(n_stations), format(name, "12s"),
+              "index=" + format(timings[0] * 1e3, ".3f") + "ms",
+              "scan=" + format(timings[1] * 1e3, ".2f") + "ms",
+              "speedup=" + format(timings[1] / timings[0], ".0f") + "x")
+
+
+# create n_projects projects over n_stations stations, cancel or close 90% of them
+# and report the latency of the active project queries against scanning every project
+def benchmark_projects(n_projects, n_stations = 1000, n_queries = 200):
+    rng = random.Random(0)
+    system = DSSystem.DSSystem()
+    for _ in range(n_stations):
+        system.add_ds()
+    for i in range(n_projects):
+        system.add_project("project" + str(i), rng.sample(range(1, n_stations + 1), 3))
+    start = time.perf_counter()
+    for project_id in range(1, n_projects + 1):
+        if rng.random() < 0.9:
+            system.set_project_status(project_id, rng.choice([0, 2]))
+    status_change = (time.perf_counter() - start) / n_projects
+
+    def scan_system():
+        return [p.project_id for p in system.project_list.values() if p.get_project_status() == 1]
+
+    def scan_ds(ds_id):
+        return [p.project_id for p in system.get_ds(ds_id).project_list.values() if p.get_project_status() == 1]
+
+    cases = {
+        "system": (system.active_project_ids, scan_system, lambda: ()),
+        "station": (system.ds_active_project_ids, scan_ds, lambda: (rng.randint(1, n_stations),)),
+    }
+    for name, (indexed, scan, arguments) in cases.items():
+        timings = []
+        for query in [indexed, scan]:
+            start = time.perf_counter()
+            for _ in range(n_queries):
+                query(*arguments())
+            timings.append((time.perf_counter() - start) / n_queries)
+        print("projects=" + str(n_projects), format(name, "8s"),
+              "index=" + format(timings[0] * 1e6, ".1f") + "us",
+              "scan=" + format(timings[1] * 1e6, ".1f") + "us",
+              "status change=" + format(status_change * 1e6, ".1f") + "us")
+
+
+# save n_stations stations with designs_per_station designs each and a project per
+# 10 stations to sqlite, then report the time of the bulk save, of opening the
+# database in a new system and of queries that read designs lazily
+def benchmark_sqlite(n_stations, designs_per_station = 5, n_queries = 1000):
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "ds.db")
+        system = DSSystem.DSSystem(storage = SQLiteStore.SQLiteStore(path))
+        for i in range(n_stations):
+            ds = system.add_ds("address" + str(i), rng.uniform(25, 49), rng.uniform(-124, -67), "city" + str(i % 100), "state" + str(i % 50))
+            for v in range(designs_per_station):
+                ds.upload_new_design("drawing" + str(i) + "-" + str(v) + ".png", "designer", "uploader")
+        for i in range(0, n_stations, 10):
+            system.add_project("project" + str(i), range(i + 1, min(i + 11, n_stations + 1)))
+        start = time.perf_counter()
+        system.save()
+        save = time.perf_counter() - start
+        system.storage.close()
+
+        start = time.perf_counter()
+        system = DSSystem.DSSystem(storage = SQLiteStore.SQLiteStore(path))
+        cold_open = time.perf_counter() - start
+
+        ds_ids = [rng.randint(1, n_stations) for _ in range(n_queries)]
+        timings = {}
+        for name in ["first design read", "cached design read"]:
+            start = time.perf_counter()
+            for ds_id in ds_ids:
+                system.ds_key_metrics(ds_id)
+            timings[name] = (time.perf_counter() - start) / n_queries
+        start = time.perf_counter()
+        for ds_id in ds_ids:
+            system.ds_active_project_ids(ds_id)
+        timings["station projects"] = (time.perf_counter() - start) / n_queries
+
+        print("stations=" + str(n_stations), "designs=" + str(n_stations * designs_per_station),
+              "db=" + format(os.path.getsize(path) / 2**20, ".1f") + "MiB",
+              "save=" + format(save, ".2f") + "s",
+              "open=" + format(cold_open, ".2f") + "s",
+              " ".join(name.replace(" ", "_") + "=" + format(t * 1e6, ".1f") + "us" for name, t in timings.items()))
+    finally:
+        shutil.rmtree(directory)
+
+
+# import n_stations stations and designs_per_station designs each over 200
+# distinct 64 KiB drawings from csv manifests into sqlite and a blob store, with
+# a single worker thread and with 8, against creating them one call at a time
+def benchmark_import_manifest(n_stations, designs_per_station = 2, n_drawings = 200):
+    directory = tempfile.mkdtemp()
+    try:
+        drawings = []
+        for i in range(n_drawings):
+            drawings.append(os.path.join(directory, "drawing" + str(i) + ".png"))
+            with open(drawings[-1], "wb") as f:
+                f.write(random.Random(i).randbytes(2**16))
+        stations_path = os.path.join(directory, "stations.csv")
+        with open(stations_path, "w") as f:
+            f.write("key,address,latitude,longitude,city,state\n")
+            for i in range(n_stations):
+                f.write("station" + str(i) + ",address" + str(i) + ",40.0,-100.0,city,state\n")
+        designs_path = os.path.join(directory, "designs.csv")
+        with open(designs_path, "w") as f:
+            f.write("station_key,drawing_file,designer,uploader\n")
+            for i in range(n_stations * designs_per_station):
+                f.write("station" + str(i % n_stations) + "," + drawings[i % n_drawings] + ",designer,uploader\n")
+
+        def open_system(name):
+            return DSSystem.DSSystem(BlobStore.BlobStore(os.path.join(directory, name + "-blobs")),
+                                     storage = SQLiteStore.SQLiteStore(os.path.join(directory, name + ".db")))
+
+        for workers in [1, 8]:
+            system = open_system("bulk" + str(workers))
+            start = time.perf_counter()
+            BulkImport.BulkImporter(system, workers = workers).run(stations_path, designs_path)
+            elapsed = time.perf_counter() - start
+            system.storage.close()
+            print("bulk import    workers=" + str(workers), "stations=" + str(n_stations),
+                  format((n_stations * (1 + designs_per_station)) / elapsed, ".0f") + " rows/s")
+
+        system = open_system("calls")
+        start = time.perf_counter()
+        for i in range(n_stations):
+            system.add_ds("address" + str(i), 40.0, -100.0, "city", "state")
+        for i in range(n_stations * designs_per_station):
+            system.upload_ds_design(i % n_stations + 1, drawings[i % n_drawings], "designer", "uploader")
+            # one call per row, each saved like an interactive upload would be
+            system.save()
+        elapsed = time.perf_counter() - start
+        system.storage.close()
+        print("one call/row   stations=" + str(n_stations), format((n_stations * (1 + designs_per_station)) / elapsed, ".0f") + " rows/s")
+    finally:
+        shutil.rmtree(directory)
+
+
+# memory held by n_revisions design uploads over 1000 stations, kept in the
+# columnar logs of the stations and in dicts of CADDesign and Revision objects
+def benchmark_logs(n_revisions, n_stations = 1000):
+    per_station = n_revisions // n_stations
+
+    def uploads(ds_id):
+        for v in range(per_station):
+            yield ("drawing" + str(ds_id) + "-" + str(v) + ".png", "designer" + str(v % 50),
+                   "uploader" + str(v % 20), 1.7e9 + v)
+
+    def columnar():
+        stations = [DeliveryStation.DeliveryStation(i) for i in range(n_stations)]
+        for ds in stations:
+            for drawing_file, designer, uploader, create_time in uploads(ds.id):
+                ds.upload_new_design(drawing_file, designer, uploader, create_time)
+        return stations
+
+    # the same stations and uploads with the logs as dicts of objects, as they were
+    def objects():
+        stations = [DeliveryStation.DeliveryStation(i) for i in range(n_stations)]
+        for ds in stations:
+            ds.cad_file_log = {}
+            ds.revision_logs = {}
+            for drawing_file, designer, uploader, create_time in uploads(ds.id):
+                ds.upload_new_design(drawing_file, designer, uploader, create_time)
+        return stations
+
+    for name, build in [("columnar logs", columnar), ("dicts of objects", objects)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        held = build()
+        elapsed = time.perf_counter() - start
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del held
+        print(format(name, "18s"), "revisions=" + str(n_stations * per_station),
+              "memory=" + format(current / 2**20, ".1f") + "MiB",
+              format(current / (n_stations * per_station), ".0f") + "B/revision",
+              "build=" + format(elapsed, ".1f") + "s")
+
+
+# give n_stations stations in 50 states of 20 cities a design, update the key
+# metrics of all of them n_updates times 6 hours apart, and report the time per update and the
+# latency of windowed and fleet queries against scanning every station
+def benchmark_metrics(n_stations, n_updates = 10, n_queries = 20):
+    rng = random.Random(0)
+    system = DSSystem.DSSystem()
+    for i in range(n_stations):
+        ds = system.add_ds(city = "city" + str(i % 20), state = "state" + str(i // 20 % 50))
+        ds.upload_new_design("ds" + str(ds.id) + ".dwg", "designer", "uploader", 0.0)
+    start_time = 1.7e9
+    start = time.perf_counter()
+    for u in range(n_updates):
+        # one update of every station, as a metric csv load applies it
+        with system.metrics_history.batch():
+            for ds in system.ds_id.values():
+                ds.update_key_metrics(rng.randint(0, 500), rng.randint(0, 50), start_time + u * 6 * 3600)
+    elapsed = time.perf_counter() - start
+    end_time = start_time + n_updates * 6 * 3600
+
+    def scan_by_state():
+        totals = {}
+        for ds in system.ds_id.values():
+            metrics = ds.get_key_metrics()
+            state_totals = totals.setdefault(ds.state, [0, 0])
+            state_totals[0] += metrics["no_shelving_units"]
+            state_totals[1] += metrics["no_conveyor_system"]
+        return totals
+
+    def scan_top():
+        return sorted(((ds.latest_cad.no_conveyor_system, ds.id) for ds in system.ds_id.values()), reverse = True)[:10]
+
+    def scan_window():
+        # daily max of the fleet total needs every update of every station
+        days = {}
+        for ds_id in system.ds_id:
+            series = system.metrics_history.series(ds_id)
+            for t, _, metrics in series.between(start_time, end_time):
+                days[int(t // 86400)] = days.get(int(t // 86400), 0) + metrics["no_conveyor_system"]
+        return days
+
+    print("stations=" + str(n_stations), "updates=" + str(n_stations * n_updates),
+          "record=" + format(elapsed / (n_stations * n_updates) * 1e6, ".1f") + "us/update")
+    cases = {
+        "totals by state": (system.key_metrics_by_state, scan_by_state),
+        "top 10 conveyor": (lambda: system.top_ds_by_key_metric(10), scan_top),
+        "fleet day window": (lambda: system.region_metrics_window(start_time, end_time), scan_window),
+        "ds hour window": (lambda: system.ds_metrics_window(n_stations // 2, start_time, end_time, "hour"), None),
+    }
+    for name, (query, scan) in cases.items():
+        timings = []
+        for q in [query, scan]:
+            if q is None:
+                continue
+            start = time.perf_counter()
+            for _ in range(n_queries):
+                q()
+            timings.append((time.perf_counter() - start) / n_queries)
+        line = ["stations=" + str(n_stations), format(name, "16s"), "query=" + format(timings[0] * 1e3, ".3f") + "ms"]
+        if len(timings) > 1:
+            line += ["scan=" + format(timings[1] * 1e3, ".1f") + "ms", "speedup=" + format(timings[1] / timings[0], ".0f") + "x"]
+        print(*line)
+
+
+# index n_revisions revisions of n_stations stations by n_revisors revisors over
+# a year, a third of them with a comment, and report the indexing time and memory
+# and the latency of the first page and of all results of some queries, against
+# a scan of every revision
+def benchmark_revisions(n_revisions, n_stations = 50000, n_revisors = 500, n_queries = 20):
+    rng = random.Random(0)
+    vocabulary = ["word" + str(i) for i in range(200)] + ["conveyor", "shelving", "fix", "layout", "dock"]
+    revisors = ["revisor" + str(i) for i in range(n_revisors)]
+    index = RevisionIndex.RevisionIndex()
+    revision_nos = [0] * (n_stations + 1)
+    start_time = 1.7e9
+    step = 365 * 86400 / n_revisions
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for i in range(n_revisions):
+        ds_id = rng.randint(1, n_stations)
+        revision_nos[ds_id] += 1
+        comment = " ".join(rng.sample(vocabulary, 3)) if rng.random() < 1 / 3 else None
+        index.add(ds_id, revision_nos[ds_id], start_time + i * step, rng.choice(revisors), comment)
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    print("revisions=" + str(n_revisions), "index=" + format(elapsed, ".1f") + "s",
+          format(elapsed / n_revisions * 1e6, ".1f") + "us/revision", "rss=+" + format(rss / 1024, ".0f") + "MiB")
+
+    end_time = start_time + 365 * 86400
+    week = end_time - 7 * 86400
+    month = end_time - 30 * 86400
+    cases = {
+        "revisor, last week": dict(revisor = "revisor7", time_from = week),
+        "station": dict(ds_id = 42),
+        "2 words, last month": dict(text = "conveyor fix", time_from = month),
+        "revisor and word": dict(revisor = "revisor7", text = "dock"),
+        "last hour": dict(time_from = end_time - 3600),
+    }
+    for name, conditions in cases.items():
+        start = time.perf_counter()
+        for _ in range(n_queries):
+            index.page(100, newest_first = True, **conditions)
+        first_page = (time.perf_counter() - start) / n_queries
+        start = time.perf_counter()
+        n_hits = sum(len(page) for page in index.pages(100, **conditions))
+        all_pages = time.perf_counter() - start
+        print("revisions=" + str(n_revisions), format(name, "20s"), "hits=" + str(n_hits),
+              "first page=" + format(first_page * 1e3, ".3f") + "ms", "all=" + format(all_pages * 1e3, ".2f") + "ms")
+
+    # what a query by revisor and time costs without the index
+    revisor_index = index.strings.indexes["revisor7"]
+    start = time.perf_counter()
+    hits = [i for i, (t, r) in enumerate(zip(index.times, index.revisors)) if r == revisor_index and t >= week]
+    print("revisions=" + str(n_revisions), format("scan revisor, week", "20s"), "hits=" + str(len(hits)),
+          "all=" + format((time.perf_counter() - start) * 1e3, ".0f") + "ms")
+
+
+# create n_stations stations in 50 states of 20 cities and a project per 5
+# stations, then report the cost of emitting change events on design uploads
+# and the latency of the materialized views against recomputing from every
+# station after some project status changes and design uploads
+def benchmark_views(n_stations, n_queries = 20):
+    rng = random.Random(0)
+    system = DSSystem.DSSystem()
+    for i in range(n_stations):
+        system.add_ds(city = "city" + str(i % 20), state = "state" + str(i // 20 % 50))
+    for _ in range(n_stations // 5):
+        system.add_project("project", rng.sample(range(1, n_stations + 1), min(5, n_stations)))
+    by_region = MaterializedViews.ActiveProjectsByRegion(system)
+    design_changes = MaterializedViews.LatestDesignChanges(system)
+
+    timings = []
+    for change_feed in [None, system.change_feed]:
+        for ds in system.ds_id.values():
+            ds.set_change_feed(change_feed)
+        start = time.perf_counter()
+        for ds in system.ds_id.values():
+            ds.upload_new_design("drawing.dwg", "designer", "uploader", 1.0)
+        timings.append((time.perf_counter() - start) / n_stations)
+    print("stations=" + str(n_stations), "upload=" + format(timings[0] * 1e6, ".1f") + "us",
+          "with change feed=" + format(timings[1] * 1e6, ".1f") + "us", "events=" + str(system.change_feed.last_seq))
+
+    versions = {ds.id: ds.latest_cad_version_no for ds in system.ds_id.values()}
+    cursor = system.change_feed.last_seq
+    for project_id in rng.sample(list(system.project_list), len(system.project_list) // 10):
+        system.set_project_status(project_id, rng.choice([0, 2]))
+    for ds_id in rng.sample(range(1, n_stations + 1), min(1000, n_stations)):
+        system.ds_id[ds_id].upload_new_design("drawing.dwg", "designer", "uploader", 2.0)
+
+    def scan_by_state():
+        projects = {}
+        for ds in system.ds_id.values():
+            projects.setdefault(ds.state, set()).update(ds.active_projects)
+        return {state: len(ids) for state, ids in projects.items() if ids}
+
+    def scan_changed():
+        return [(ds.id, ds.latest_cad_version_no) for ds in system.ds_id.values()
+                if ds.latest_cad_version_no != versions[ds.id]]
+
+    def rows(result):
+        return sorted(result.items() if isinstance(result, dict) else result)
+
+    cases = {
+        "active projects by state": (by_region.counts_by_state, scan_by_state),
+        "designs changed since": (lambda: design_changes.changed_since(cursor), scan_changed),
+    }
+    for name, (view, scan) in cases.items():
+        assert rows(view()) == rows(scan())
+        query_timings = []
+        for query in [view, scan]:
+            start = time.perf_counter()
+            for _ in range(n_queries):
+                query()
+            query_timings.append((time.perf_counter() - start) / n_queries)
+        print("stations=" + str(n_stations), format(name, "25s"), "view=" + format(query_timings[0] * 1e3, ".3f") + "ms",
+              "recompute=" + format(query_timings[1] * 1e3, ".1f") + "ms",
+              "speedup=" + format(query_timings[1] / query_timings[0], ".0f") + "x")
+
+
+# upload n_versions drawings of pixels x pixels to a station of a system with a
+# preview store, and report the time to render their previews in the pool and
+# the latency of a gallery of all versions read from the preview files, from
+# the cache, and by decoding every drawing as rendering them at full size did
+def benchmark_previews(n_versions, pixels):
+    from PIL import Image, ImageDraw
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        drawings = []
+        for v in range(n_versions):
+            image = Image.new("L", (pixels, pixels), 255)
+            draw = ImageDraw.Draw(image)
+            for _ in range(200):
+                draw.line([(rng.randrange(pixels), rng.randrange(pixels)) for _ in range(2)], fill = 0, width = 3)
+            path = os.path.join(directory, "drawing" + str(v) + ".png")
+            image.save(path)
+            drawings.append(path)
+
+        blob_store = BlobStore.BlobStore(os.path.join(directory, "blobs"))
+        previews = Previews.PreviewStore(os.path.join(directory, "previews"))
+        system = DSSystem.DSSystem(blob_store, previews = previews)
+        ds = system.add_ds()
+        start = time.perf_counter()
+        for path in drawings:
+            ds.upload_new_design(path, "designer", "uploader")
+        uploaded = time.perf_counter() - start
+        previews.wait()
+        rendered = time.perf_counter() - start
+
+        # a new store reads the previews from disk
+        previews.close()
+        system.previews = Previews.PreviewStore(os.path.join(directory, "previews"))
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            system.ds_design_previews(ds.id)
+            timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for design in ds.get_past_design().values():
+            with Image.open(io.BytesIO(design.get_drawing())) as image:
+                image.load()
+        full_size = time.perf_counter() - start
+        print("versions=" + str(n_versions), "pixels=" + str(pixels),
+              "upload=" + format(uploaded / n_versions * 1e3, ".1f") + "ms/version",
+              "all previews=" + format(rendered, ".2f") + "s",
+              "gallery from disk=" + format(timings[0] * 1e3, ".1f") + "ms",
+              "cached=" + format(timings[1] * 1e3, ".2f") + "ms",
+              "full size decode=" + format(full_size * 1e3, ".0f") + "ms")
+        system.previews.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else "csv"
+    sizes = [int(n) for n in sys.argv[2:]]
+
+    if benchmark == "csv":
+        for n in sizes or [100000, 1000000, 10000000]:
+            benchmark_csv(n)
+    elif benchmark == "import":
+        benchmark_import(*sizes)
+    elif benchmark == "blobs":
+        n_designs, n_distinct = sizes + [1000, 50][len(sizes):]
+        benchmark_blobs(n_designs, n_distinct)
+    elif benchmark == "deltas":
+        n_versions, drawing_bytes = sizes + [200, 2**20][len(sizes):]
+        benchmark_deltas(n_versions, drawing_bytes)
+    elif benchmark == "spatial":
+        for n in sizes or [10000, 50000]:
+            benchmark_spatial(n)
+    elif benchmark == "projects":
+        for n in sizes or [10000, 100000]:
+            benchmark_projects(n)
+    elif benchmark == "sqlite":
+        for n in sizes or [10000, 100000]:
+            benchmark_sqlite(n)
+    elif benchmark == "import_manifest":
+        # either argument may be left out
+        n_stations, designs_per_station = sizes + [20000, 2][len(sizes):]
+        benchmark_import_manifest(n_stations, designs_per_station)
+    elif benchmark == "logs":
+        for n in sizes or [1000000]:
+            benchmark_logs(n)
+    elif benchmark == "metrics":
+        for n in sizes or [50000]:
+            benchmark_metrics(n)
+    elif benchmark == "revisions":
+        for n in sizes or [10000000]:
+            benchmark_revisions(n)
+    elif benchmark == "views":
+        for n in sizes or [50000]:
+            benchmark_views(n)
+    elif benchmark == "previews":
+        n_versions, pixels = sizes + [50, 4000][len(sizes):]
+        benchmark_previews(n_versions, pixels)
@@ -0,0 +1,50 @@
+# Tests of the bulk import of stations from manifests
+#
+#     python -m unittest test_BulkImport
+
+import os
+import tempfile
+import unittest
+
+import BulkImport
+import DSSystem
+
+class ImportStationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write_manifest(self, rows):
+        path = os.path.join(self.dir.name, "stations.csv")
+        with open(path, "w") as f:
+            f.write("key,address,latitude,longitude,city,state\n")
+            for row in rows:
+                f.write(row + "\n")
+        return path
+
+    # a key repeated within one batch creates a single station and skips the later row
+    def test_duplicate_key_in_batch(self):
+        path = self.write_manifest(["a,1 Main St,1.0,2.0,city,state", "b,,,,city,state", "a,2 Main St,3.0,4.0,city,state"])
+        system = DSSystem.DSSystem()
+        importer = BulkImport.BulkImporter(system, batch_size = 10)
+        no_bad_rows, bad_rows = importer.run(path)
+
+        self.assertEqual(system.get_no_stations(), 2)
+        self.assertEqual(no_bad_rows, 1)
+        self.assertEqual(bad_rows[0][1], 4)
+        self.assertEqual(bad_rows[0][3], "duplicate key a")
+        self.assertEqual(system.get_ds(importer.station_keys["a"]).get_address(), "1 Main St")
+
+    # a key repeated in a later batch is skipped as well
+    def test_duplicate_key_across_batches(self):
+        path = self.write_manifest(["a,,,,city,state", "b,,,,city,state", "a,,,,city,state"])
+        system = DSSystem.DSSystem()
+        no_bad_rows, _ = BulkImport.BulkImporter(system, batch_size = 2).run(path)
+
+        self.assertEqual(system.get_no_stations(), 2)
+        self.assertEqual(no_bad_rows, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()